@@ -27,12 +27,15 @@ from sphinx.roles import XRefRole
 from sphinx.config import Config
 from sphinx.errors import SphinxError, SphinxWarning, ExtensionError, \
      VersionRequirementError
-from sphinx.domains import ObjType, BUILTIN_DOMAINS
+from sphinx.domains import Domain, ObjType, BUILTIN_DOMAINS
 from sphinx.domains.std import GenericObject, Target, StandardDomain
 from sphinx.builders import BUILTIN_BUILDERS
-from sphinx.environment import BuildEnvironment, SphinxStandaloneReader
+from sphinx.environment import BuildEnvironment, SphinxStandaloneReader, \
+     DoctreeCache
 from sphinx.util import pycompat  # imported for side-effects
 from sphinx.util.tags import Tags
+from sphinx.util.watch import SourceWatcher
+from sphinx.util.profiling import BuildProfiler
 from sphinx.util.osutil import ENOENT
 from sphinx.util.console import bold
 
@@ -46,9 +49,11 @@ events = {
     'doctree-read': 'the doctree before being pickled',
     'missing-reference': 'env, node, contnode',
     'doctree-resolved': 'doctree, docname',
+    'env-merge-info': 'env, read docnames, other env instance',
     'env-updated': 'env',
     'html-collect-pages': 'builder',
     'html-page-context': 'pagename, context, doctree or None',
+    'write-worker-finished': '',
     'build-finished': 'exception',
 }
 
@@ -60,9 +65,11 @@ class Sphinx(object):
 
     def __init__(self, srcdir, confdir, outdir, doctreedir, buildername,
                  confoverrides=None, status=sys.stdout, warning=sys.stderr,
-                 freshenv=False, warningiserror=False, tags=None):
+                 freshenv=False, warningiserror=False, tags=None,
+                 parallel=0, profile=False):
         self.next_listener_id = 0
         self._extensions = {}
+        self._extension_metadata = {}
         self._listeners = {}
         self.domains = BUILTIN_DOMAINS.copy()
         self.builderclasses = BUILTIN_BUILDERS.copy()
@@ -74,6 +81,12 @@ class Sphinx(object):
         self.outdir = outdir
         self.doctreedir = doctreedir
 
+        # number of worker processes to use for reading; 0 or 1 means serial
+        self.parallel = parallel
+
+        # times the phases of the build if enabled
+        self.profiler = BuildProfiler(enabled=profile)
+
         if status is None:
             self._status = StringIO()
             self.quiet = True
@@ -111,7 +124,8 @@ class Sphinx(object):
         self.setup_extension('sphinx.ext.oldcmarkup')
         # load all user-given extension modules
         for extension in self.config.extensions:
-            self.setup_extension(extension)
+            self.profiler.call('setup extension %s' % extension,
+                               self.setup_extension, extension)
         # the config file itself can be an extension
         if self.config.setup:
             self.config.setup(self)
@@ -119,6 +133,15 @@ class Sphinx(object):
         # now that we know all config values, collect them from conf.py
         self.config.init_values()
 
+        # an invalid cache size would only be noticed in the middle of the build
+        try:
+            DoctreeCache.parse_limits(self.config.doctree_cache_size)
+        except ValueError, err:
+            self.warn('invalid doctree_cache_size (%s), using the default'
+                      % err)
+            self.config.doctree_cache_size = \
+                self.config.values['doctree_cache_size'][0]
+
         # check the Sphinx version if requested
         if self.config.needs_sphinx and \
            self.config.needs_sphinx > sphinx.__version__[:3]:
@@ -129,9 +152,9 @@ class Sphinx(object):
         # set up translation infrastructure
         self._init_i18n()
         # set up the build environment
-        self._init_env(freshenv)
+        self.profiler.call('load environment', self._init_env, freshenv)
         # set up the builder
-        self._init_builder(buildername)
+        self.profiler.call('init builder', self._init_builder, buildername)
 
     def _init_i18n(self):
         """Load translated strings from the configured localedirs if enabled in
@@ -195,6 +218,10 @@ class Sphinx(object):
         self.emit('builder-inited')
 
     def build(self, force_all=False, filenames=None):
+        self._build(force_all, filenames)
+        self.builder.cleanup()
+
+    def _build(self, force_all=False, filenames=None):
         try:
             if force_all:
                 self.builder.build_all()
@@ -207,7 +234,55 @@ class Sphinx(object):
             raise
         else:
             self.emit('build-finished', None)
-        self.builder.cleanup()
+
+    def watch(self, force_all=False, filenames=None, checkpoint=10):
+        """Build like :meth:`build`, then rebuild whenever the sources
+        change, until interrupted.
+
+        The environment, templates and highlighter stay in memory between
+        builds; the environment is only pickled every *checkpoint* builds
+        and when watching ends, and not if the last build did not complete.
+        Return true if the configuration file changed, in which case the
+        application must be created again.
+        """
+        self.builder.defer_pickling = True
+        builds = 0
+        # an environment left by an unfinished build must not be pickled
+        completed = False
+        try:
+            self._build(force_all, filenames)
+            completed = True
+            watcher = SourceWatcher(self)
+            while True:
+                self.info(bold('watching for changes...'))
+                try:
+                    changed = watcher.wait()
+                except KeyboardInterrupt:
+                    return False
+                if watcher.config_file in changed:
+                    self.info(bold('configuration changed, restarting'))
+                    return True
+                self.info(bold('%d changed file%s' %
+                               (len(changed), len(changed) != 1 and 's' or '')))
+                self._warncount = 0
+                completed = False
+                try:
+                    self._build()
+                    completed = True
+                except (KeyboardInterrupt, SystemExit):
+                    raise
+                except Exception, err:
+                    # keep watching, the next change may fix the problem
+                    self._warning.write('ERROR: build failed: %s\n' % err)
+                builds += 1
+                if builds % checkpoint == 0 and completed and \
+                       self.builder.env_unsaved:
+                    self.builder.pickle_environment(force=True)
+        finally:
+            if completed and self.builder.env_unsaved:
+                self.builder.pickle_environment(force=True)
+            self.builder.defer_pickling = False
+            self.builder.cleanup()
 
     def warn(self, message, location=None, prefix='WARNING: '):
         if isinstance(location, tuple):
@@ -253,15 +328,44 @@ class Sphinx(object):
                       'a Sphinx extension module?' % extension)
         else:
             try:
-                mod.setup(self)
+                metadata = mod.setup(self)
             except VersionRequirementError, err:
                 # add the extension name to the version required
                 raise VersionRequirementError(
                     'The %s extension used by this project needs at least '
                     'Sphinx v%s; it therefore cannot be built with this '
                     'version.' % (extension, err))
+            if not isinstance(metadata, dict):
+                metadata = {}
+            self._extension_metadata[extension] = metadata
         self._extensions[extension] = mod
 
+    def is_parallel_allowed(self, typ):
+        """Check if all loaded extensions declare that they are safe for
+        parallel processing of the type *typ* (``'read'`` or ``'write'``).
+        """
+        attrname = 'parallel_%s_safe' % typ
+        for extname, metadata in sorted(self._extension_metadata.iteritems()):
+            allowed = metadata.get(attrname)
+            if allowed is None:
+                self.warn('the %s extension does not declare if it is safe '
+                          'for parallel %sing, assuming it isn\'t - please '
+                          'ask the extension author to check and make it '
+                          'explicit' % (extname, typ))
+                return False
+            elif not allowed:
+                return False
+        if typ == 'read':
+            # the domain data collected by the workers must be merged
+            for domainname, domaincls in sorted(self.domains.iteritems()):
+                if domaincls.merge_domaindata.im_func is \
+                       Domain.merge_domaindata.im_func:
+                    self.warn('the %s domain does not implement '
+                              'merge_domaindata, so the source files are not '
+                              'read in parallel' % domainname)
+                    return False
+        return True
+
     def require_sphinx(self, version):
         # check the Sphinx version if requested
         if version > sphinx.__version__[:3]:
@@ -310,8 +414,15 @@ class Sphinx(object):
     def emit(self, event, *args):
         results = []
         if event in self._listeners:
+            profiler = self.profiler
             for _, callback in self._listeners[event].iteritems():
-                results.append(callback(self, *args))
+                if profiler.enabled:
+                    phase = 'event %s: %s.%s' % (
+                        event, getattr(callback, '__module__', '?'),
+                        getattr(callback, '__name__', '?'))
+                    results.append(profiler.call(phase, callback, self, *args))
+                else:
+                    results.append(callback(self, *args))
         return results
 
     def emit_firstresult(self, event, *args):
@@ -526,6 +637,39 @@ class TemplateBridge(object):
         """
         raise NotImplementedError('must be implemented in subclasses')
 
+    def loaded_templates(self):
+        """Called by the builder after :meth:`render` to determine which
+        template files the page depends on.  Return the set of the file names
+        of all templates used by the last :meth:`render` call, including
+        extended and included templates, or ``None`` if unknown.  The default
+        implementation returns ``None``, which makes the builder consider
+        pages outdated if any template changed.
+
+        .. versionadded:: 1.1
+        """
+        return None
+
+    def loaded_variables(self):
+        """Called by the builder after :meth:`render` to determine which
+        config values the page depends on.  Return the set of the names of
+        all context variables the templates used by the last :meth:`render`
+        call refer to, or ``None`` if unknown.  The default implementation
+        returns ``None``, which makes the builder consider the page outdated
+        if any config value that is given to templates changed.
+
+        .. versionadded:: 1.1
+        """
+        return None
+
+    def template_files(self):
+        """Called by the builder to detect added or removed templates.  Return
+        the set of file names of all available templates, or ``None`` if
+        unknown.  The default implementation returns ``None``.
+
+        .. versionadded:: 1.1
+        """
+        return None
+
     def render_string(self, template, context):
         """Called by the builder to render a template given as a string with a
         specified context (a Python dictionary).
@@ -15,6 +15,8 @@ from os import path
 from docutils import nodes
 
 from sphinx.util.osutil import SEP, relative_uri
+from sphinx.util.parallel import ParallelTasks, parallel_available, \
+     make_chunks
 from sphinx.util.console import bold, purple, darkgreen, term_width_line
 
 # side effect: registers roles and directives
@@ -33,6 +35,13 @@ class Builder(object):
     format = ''
     # doctree versioning method
     versioning_method = 'none'
+    # if true, the environment is only pickled when forced to; used by the
+    # watch mode, which keeps it in memory between builds
+    defer_pickling = False
+    # if true, documents may be written in parallel worker processes; the
+    # builder must then send back all state collected while writing, see
+    # get_write_data()
+    allow_parallel = False
 
     def __init__(self, app):
         self.env = app.env
@@ -45,6 +54,7 @@ class Builder(object):
             os.makedirs(self.doctreedir)
 
         self.app = app
+        self.env_unsaved = False
         self.warn = app.warn
         self.info = app.info
         self.config = app.config
@@ -223,8 +233,9 @@ class Builder(object):
 
         doccount = len(updated_docnames)
         self.info(bold('looking for now-outdated files... '), nonl=1)
-        for docname in self.env.check_dependents(updated_docnames):
-            updated_docnames.add(docname)
+        updated_docnames.update(self.app.profiler.call(
+            'check dependents', list,
+            self.env.check_dependents(updated_docnames)))
         outdated = len(updated_docnames) - doccount
         if outdated:
             self.info('%d found' % outdated)
@@ -233,14 +244,12 @@ class Builder(object):
 
         if updated_docnames:
             # save the environment
-            from sphinx.application import ENV_PICKLE_FILENAME
-            self.info(bold('pickling environment... '), nonl=True)
-            self.env.topickle(path.join(self.doctreedir, ENV_PICKLE_FILENAME))
-            self.info('done')
+            self.pickle_environment()
 
             # global actions
             self.info(bold('checking consistency... '), nonl=True)
-            self.env.check_consistency()
+            self.app.profiler.call('check consistency',
+                                   self.env.check_consistency)
             self.info('done')
         else:
             if method == 'update' and not docnames:
@@ -249,10 +258,19 @@ class Builder(object):
 
         # another indirection to support builders that don't build
         # files individually
-        self.write(docnames, list(updated_docnames), method)
+        self.app.profiler.call('write', self.write,
+                               docnames, list(updated_docnames), method)
 
         # finish (write static files etc.)
-        self.finish()
+        self.app.profiler.call('finish', self.finish)
+        if self.env.references_changed():
+            # the references between documents are only known after
+            # writing, save them for the next incremental build
+            self.pickle_environment()
+        cache = self.env.doctree_cache
+        if cache.hits or cache.misses:
+            self.info(bold('doctree cache: ') + '%d hits, %d misses' %
+                      (cache.hits, cache.misses))
         status = (self.app.statuscode == 0 and 'succeeded'
                                            or 'finished with problems')
         if self.app._warncount:
@@ -262,6 +280,20 @@ class Builder(object):
         else:
             self.info(bold('build %s.' % status))
 
+    def pickle_environment(self, force=False):
+        """Save the environment, unless :attr:`defer_pickling` is set and
+        *force* is not given.
+        """
+        if self.defer_pickling and not force:
+            self.env_unsaved = True
+            return
+        from sphinx.application import ENV_PICKLE_FILENAME
+        self.info(bold('pickling environment... '), nonl=True)
+        self.app.profiler.call('pickle environment', self.env.topickle,
+                               path.join(self.doctreedir, ENV_PICKLE_FILENAME))
+        self.env_unsaved = False
+        self.info('done')
+
     def write(self, build_docnames, updated_docnames, method='update'):
         if build_docnames is None or build_docnames == ['__all__']:
             # build_all
@@ -279,21 +311,108 @@ class Builder(object):
                     docnames.add(tocdocname)
         docnames.add(self.config.master_doc)
 
+        profiler = self.app.profiler
         self.info(bold('preparing documents... '), nonl=True)
-        self.prepare_writing(docnames)
+        profiler.call('prepare writing', self.prepare_writing, docnames)
         self.info('done')
 
         # write target files
         warnings = []
         self.env.set_warnfunc(lambda *args: warnings.append(args))
+        docnames = sorted(docnames)
+        if self.allow_parallel and self.app.parallel > 1 and \
+               parallel_available and len(docnames) > 5 and \
+               self.app.is_parallel_allowed('write'):
+            writer = self._write_parallel(docnames, warnings,
+                                          self.app.parallel)
+        else:
+            writer = self._write_serial(docnames)
         for docname in self.status_iterator(
-            sorted(docnames), 'writing output... ', darkgreen, len(docnames)):
-            doctree = self.env.get_and_resolve_doctree(docname, self)
-            self.write_doc(docname, doctree)
+            writer, 'writing output... ', darkgreen, len(docnames)):
+            pass
         for warning in warnings:
             self.warn(*warning)
         self.env.set_warnfunc(self.warn)
 
+    def _write_serial(self, docnames):
+        profiler = self.app.profiler
+        for docname in docnames:
+            yield docname
+            profiler.start('write document', docname)
+            try:
+                doctree = self.env.get_and_resolve_doctree(docname, self)
+                profiler.call('write_doc', self.write_doc,
+                              docname, doctree)
+            finally:
+                profiler.stop()
+
+    def _write_parallel(self, docnames, warnings, nproc):
+        """Write *docnames* in *nproc* forked worker processes, each with
+        its own copy of the environment, and merge the data they collected;
+        yields docnames as they are merged.
+        """
+        app = self.app
+
+        def write_process(docs):
+            # only send back what this worker collected; warnings are
+            # emitted by the main process
+            app.profiler = app.profiler.fork()
+            del warnings[:]
+            appwarnings = []
+            def warn(*args, **kwds):
+                appwarnings.append((args, kwds))
+            app.warn = self.warn = warn
+            self.init_write_worker()
+            for docname in self._write_serial(docs):
+                pass
+            app.emit('write-worker-finished')
+            return (warnings, appwarnings, self.get_write_data(docs),
+                    app.profiler)
+
+        merged = []
+        def merge(docs, result):
+            envwarnings, appwarnings, data, profiler = result
+            app.profiler.merge(profiler)
+            warnings.extend(envwarnings)
+            for args, kwds in appwarnings:
+                app.warn(*args, **kwds)
+            self.merge_write_data(docs, data)
+            merged.extend(docs)
+
+        tasks = ParallelTasks(nproc)
+        for chunk in make_chunks(docnames, nproc):
+            tasks.add_task(write_process, chunk,
+                           lambda result, chunk=chunk: merge(chunk, result))
+            for docname in merged:
+                yield docname
+            del merged[:]
+        tasks.join()
+        for docname in merged:
+            yield docname
+
+    def init_write_worker(self):
+        """Called in a worker process before it writes documents in
+        parallel.  Reset the state that is collected while writing and must
+        be sent back to the main process by :meth:`get_write_data`.
+        """
+        self.images = {}
+
+    def get_write_data(self, docnames):
+        """Return the picklable data collected while writing *docnames* in
+        a worker process.
+        """
+        return {
+            'images': self.images,
+            'references': self.env.get_references(docnames),
+        }
+
+    def merge_write_data(self, docnames, data):
+        """Merge *data*, as returned by :meth:`get_write_data` in a worker
+        process that wrote *docnames*.
+        """
+        self.images.update(data['images'])
+        self.env.merge_references(docnames, data['references'])
+
     def prepare_writing(self, docnames):
         raise NotImplementedError
 
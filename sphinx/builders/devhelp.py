@@ -47,6 +47,8 @@ class DevhelpBuilder(StandaloneHTMLBuilder):
 
     # don't copy the reST source
     copysource = False
+    # the output is packaged, compressed copies are not wanted
+    allow_precompress = False
     supported_image_types = ['image/png', 'image/gif', 'image/jpeg']
 
     # don't add links
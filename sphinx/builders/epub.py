@@ -150,6 +150,8 @@ class EpubBuilder(StandaloneHTMLBuilder):
 
     # don't copy the reST source
     copysource = False
+    # the output is packaged, compressed copies are not wanted
+    allow_precompress = False
     supported_image_types = ['image/svg+xml', 'image/png', 'image/gif',
                              'image/jpeg']
 
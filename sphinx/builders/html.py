@@ -13,6 +13,8 @@ import os
 import sys
 import zlib
 import codecs
+import random
+import struct
 import posixpath
 import cPickle as pickle
 from os import path
@@ -23,19 +25,22 @@ except ImportError:
     from md5 import md5
 
 from docutils import nodes
-from docutils.io import DocTreeInput, StringOutput
-from docutils.core import Publisher
+from docutils.io import StringOutput
 from docutils.utils import new_document
 from docutils.frontend import OptionParser
+from docutils.parsers.rst import Parser as RSTParser
 from docutils.readers.doctree import Reader as DoctreeReader
 
-from sphinx import package_dir, __version__
+from sphinx import addnodes, package_dir, __version__
 from sphinx.util import jsonimpl, copy_static_entry
 from sphinx.util.osutil import SEP, os_path, relative_uri, ensuredir, \
-     movefile, ustrftime, copyfile
+     ustrftime
+from sphinx.util.manifest import OutputManifest, OutputWriter, \
+     MANIFEST_FILENAME
+from sphinx.util.parallel import ThreadedTasks
 from sphinx.util.nodes import inline_all_toctrees
-from sphinx.util.matching import patmatch, compile_matchers
-from sphinx.util.pycompat import any, b
+from sphinx.util.matching import PatternMatcher, compile_matchers
+from sphinx.util.pycompat import b
 from sphinx.errors import SphinxError
 from sphinx.locale import _
 from sphinx.search import js_index
@@ -53,6 +58,18 @@ INVENTORY_FILENAME = 'objects.inv'
 LAST_BUILD_FILENAME = 'last_build'
 
 
+def gzip_compress(data, level=9):
+    """Return *data* compressed in gzip format.  Unlike the gzip module,
+    no file name and time is stored, so that the result only depends on the
+    data.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return b('\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff') + \
+           compressor.compress(data) + compressor.flush() + \
+           struct.pack('<LL', zlib.crc32(data) & 0xffffffffL,
+                       len(data) & 0xffffffffL)
+
+
 class StandaloneHTMLBuilder(Builder):
     """
     Builds standalone HTML docs.
@@ -69,6 +86,13 @@ class StandaloneHTMLBuilder(Builder):
     searchindex_filename = 'searchindex.js'
     add_permalinks = True
     embedded = False  # for things like HTML help or Qt help: suppresses sidebar
+    allow_parallel = True
+    # whether html_precompress is honored; not for packaged formats
+    allow_precompress = True
+    precompress_suffixes = ('.html', '.js', '.css', '.txt', '.svg', '.xml',
+                            '.inv')
+    precompress_threads = 2
+    writer_threads = 2
 
     # This is a class attribute because it is mutated by Sphinx.add_javascript.
     script_files = ['_static/jquery.js', '_static/underscore.js',
@@ -79,17 +103,34 @@ class StandaloneHTMLBuilder(Builder):
     default_sidebars = ['localtoc.html', 'relations.html',
                         'sourcelink.html', 'searchbox.html']
 
-    # cached publisher object for snippets
-    _publisher = None
+    # config values that only reach the pages through these template context
+    # variables; changing one only writes the pages whose templates use them
+    context_config_values = {
+        'html_last_updated_fmt': ('last_updated',),
+        'html_show_copyright': ('show_copyright',),
+        'html_show_sphinx': ('show_sphinx',),
+        'html_show_sourcelink': ('show_source',),
+        'html_style': ('style',),
+    }
+
+    # settings used for rendering lone nodes
+    _partial_settings = None
 
     def init(self):
-        # a hash of all config values that, if changed, cause a full rebuild
+        # hashes of all config values that affect the output and of the tags
         self.config_hash = ''
         self.tags_hash = ''
+        # config value -> digest of its value
+        self.config_digests = {}
+        # sorted names of context config values -> digest for pages using them
+        self._page_config_digests = {}
         # section numbers for headings in the currently visited document
         self.secnumbers = {}
         # currently written docname
         self.current_docname = None
+        # docname -> ((read time, section number), title rendered as HTML)
+        self._title_cache = {}
+        self.init_manifest()
 
         self.init_templates()
         self.init_highlighter()
@@ -122,6 +163,66 @@ class StandaloneHTMLBuilder(Builder):
     def get_theme_config(self):
         return self.config.html_theme, self.config.html_theme_options
 
+    def init_manifest(self):
+        # digests of the output files, so that unchanged files are not
+        # written again
+        self.manifest = OutputManifest(self.outdir)
+        self.manifest.load()
+        # output files are written in background threads
+        self.writer = OutputWriter(self.manifest, self.warn,
+                                   self.writer_threads)
+        self.init_precompress()
+
+    def init_precompress(self):
+        level = self.config.html_precompress
+        if level is True:
+            level = 9
+        elif level and (not isinstance(level, (int, long)) or
+                        not 1 <= level <= 9):
+            self.warn('html_precompress must be a compression level from 1 '
+                      'to 9 or True, not %r; not compressing output files'
+                      % (level,))
+            level = 0
+        self.precompress_level = self.allow_precompress and level or 0
+        self._precompress_tasks = ThreadedTasks(self.precompress_threads)
+        self._precompress_errors = []
+        if self.precompress_level:
+            self.manifest.write_hook = self.precompress
+
+    def precompress(self, filename, data, written):
+        """Write a gzip compressed copy of an output file in a background
+        thread, unless it is unchanged.
+        """
+        if path.splitext(filename)[1] not in self.precompress_suffixes:
+            return
+        gzname = filename + '.gz'
+        if not written and self.manifest.is_current(gzname):
+            return
+        self._precompress_tasks.add_task(self._write_compressed,
+                                         (gzname, data))
+
+    def _write_compressed(self, args):
+        gzname, data = args
+        try:
+            self.manifest.write(gzname, gzip_compress(data,
+                                                      self.precompress_level))
+        except (EnvironmentError, zlib.error), err:
+            self._precompress_errors.append(
+                'error writing compressed file %s: %s' % (gzname, err))
+
+    def finish_precompress(self):
+        """Wait until all compressed files are written, and warn about those
+        that could not be written.
+        """
+        self._precompress_tasks.join()
+        errors, self._precompress_errors = self._precompress_errors, []
+        for error in errors:
+            self.warn(error)
+
+    def flush_writer(self):
+        """Wait until all queued output files are written."""
+        self.app.profiler.call('html: wait for writer', self.writer.flush)
+
     def init_templates(self):
         Theme.init_themes(self.confdir, self.config.html_theme_path,
                           warn=self.warn)
@@ -152,95 +253,199 @@ class StandaloneHTMLBuilder(Builder):
         else:
             self.translator_class = HTMLTranslator
 
-    def get_outdated_docs(self):
+    def compute_config_digests(self):
+        """Compute the digests of the config values and tags that affect the
+        output.
+        """
         cfgdict = dict((name, self.config[name])
                        for (name, desc) in self.config.values.iteritems()
                        if desc[1] == 'html')
         self.config_hash = md5(unicode(cfgdict).encode('utf-8')).hexdigest()
         self.tags_hash = md5(unicode(sorted(self.tags)).encode('utf-8')) \
                 .hexdigest()
-        old_config_hash = old_tags_hash = ''
-        try:
-            fp = open(path.join(self.outdir, '.buildinfo'))
-            version = fp.readline()
-            if version.rstrip() != '# Sphinx build info version 1':
-                raise ValueError
-            fp.readline()  # skip commentary
-            cfg, old_config_hash = fp.readline().strip().split(': ')
-            if cfg != 'config':
-                raise ValueError
-            tag, old_tags_hash = fp.readline().strip().split(': ')
-            if tag != 'tags':
-                raise ValueError
-            fp.close()
-        except ValueError:
-            self.warn('unsupported build info format in %r, building all' %
-                      path.join(self.outdir, '.buildinfo'))
-        except Exception:
-            pass
-        if old_config_hash != self.config_hash or \
-               old_tags_hash != self.tags_hash:
-            for docname in self.env.found_docs:
-                yield docname
-            return
+        self.config_digests = dict(
+            (name, md5(unicode(value).encode('utf-8')).hexdigest())
+            for (name, value) in cfgdict.iteritems())
+        self._page_config_digests = {}
+
+    def get_page_config_digest(self, keys):
+        """Return the digest of the configuration of a page that uses the
+        :attr:`context_config_values` named in *keys*.
+        """
+        keys = tuple(sorted(keys))
+        digest = self._page_config_digests.get(keys)
+        if digest is None:
+            parts = [('tags', self.tags_hash)]
+            for name, value in sorted(self.config_digests.iteritems()):
+                if name not in self.context_config_values or name in keys:
+                    parts.append((name, value))
+            digest = self._page_config_digests[keys] = \
+                md5(repr(parts)).hexdigest()
+        return digest
+
+    def note_page(self, pagename, outfilename, variables):
+        """Record what the page *pagename*, written to *outfilename*, depends
+        on.  *variables* are the names of the context variables its templates
+        use, or None if unknown.
+        """
+        keys = [name for (name, names) in self.context_config_values.items()
+                if variables is None or variables.intersection(names)]
+        self.manifest.set_page(outfilename, self.env.all_docs.get(pagename),
+                               self.get_page_config_digest(keys), keys)
 
+    def get_outdated_docs(self):
+        self.compute_config_digests()
+        template_mtime = 0
+        # template file name -> mtime, if the templates each page was rendered
+        # from are to be checked
+        template_mtimes = None
         if self.templates:
             template_mtime = self.templates.newest_template_mtime()
-        else:
-            template_mtime = 0
+            template_files = self.templates.template_files()
+            if template_files is not None:
+                template_files = sorted(template_files)
+                if template_files == self.manifest.template_files:
+                    # no templates were added or removed, so pages only need
+                    # to be written again if a template they use changed
+                    template_mtimes = {}
+                self.manifest.template_files = template_files
+
+        docfiles = set()
+        outdated = False
         for docname in self.env.found_docs:
             if docname not in self.env.all_docs:
+                outdated = True
                 yield docname
                 continue
             targetname = self.get_outfilename(docname)
-            try:
-                targetmtime = path.getmtime(targetname)
-            except Exception:
-                targetmtime = 0
-            try:
-                srcmtime = max(path.getmtime(self.env.doc2path(docname)),
-                               template_mtime)
+            docfiles.add(path.abspath(targetname))
+            if self._page_outdated(targetname, docname, template_mtimes,
+                                   template_mtime):
+                outdated = True
+                yield docname
+        if outdated:
+            return
+        # the pages written in finish(), e.g. indices and the search page,
+        # are written again whenever any document is written
+        for filename in self.manifest.dependent_files():
+            if filename not in docfiles and self._page_outdated(
+                    filename, None, template_mtimes, template_mtime):
+                yield self.config.master_doc
+                return
+
+    def _page_outdated(self, filename, docname, template_mtimes,
+                       template_mtime):
+        """Return True if the page *filename*, written from the document
+        *docname* (None for other pages), needs to be written again.
+        """
+        page = self.manifest.get_page(filename)
+        if page is None or \
+               page['config'] != self.get_page_config_digest(page['keys']):
+            return True
+        try:
+            targetmtime = self.manifest.get_mtime(filename)
+        except EnvironmentError:
+            return True
+        if docname is not None:
+            if self.manifest.is_current(filename):
+                # the page is unmodified: it is outdated if the document
+                # was read again since it was written
+                if page['source'] != self.env.all_docs[docname]:
+                    return True
+            else:
+                try:
+                    if self.config.source_digests:
+                        srcmtime = self.env.all_docs[docname]
+                    else:
+                        srcmtime = path.getmtime(self.env.doc2path(docname))
+                except EnvironmentError:
+                    # source doesn't exist anymore
+                    return False
                 if srcmtime > targetmtime:
-                    yield docname
-            except EnvironmentError:
-                # source doesn't exist anymore
-                pass
+                    return True
+        if template_mtimes is not None:
+            template_mtime = self._get_template_mtime(
+                filename, template_mtimes, template_mtime)
+        return template_mtime > targetmtime
+
+    def _get_template_mtime(self, filename, mtimes, default):
+        """Return the mtime of the newest template the output file
+        *filename* was rendered from, or *default* if not known.
+        """
+        deps = self.manifest.get_dependencies(filename)
+        if deps is None:
+            return default
+        newest = 0
+        for dep in deps:
+            mtime = mtimes.get(dep)
+            if mtime is None:
+                try:
+                    mtime = mtimes[dep] = path.getmtime(dep)
+                except EnvironmentError:
+                    return default
+            newest = max(newest, mtime)
+        return newest
 
     def render_partial(self, node):
         """Utility: Render a lone doctree node."""
         if node is None:
             return {'fragment': ''}
-        doc = new_document(b('<partial node>'))
-        doc.append(node)
-
-        if self._publisher is None:
-            self._publisher = Publisher(
-                    source_class = DocTreeInput,
-                    destination_class=StringOutput)
-            self._publisher.set_components('standalone',
-                                           'restructuredtext', 'pseudoxml')
-
-        pub = self._publisher
-
-        pub.reader = DoctreeReader()
-        pub.writer = HTMLWriter(self)
-        pub.process_programmatic_settings(
-            None, {'output_encoding': 'unicode'}, None)
-        pub.set_source(doc, None)
-        pub.set_destination(None, None)
-        pub.publish()
-        return pub.writer.parts
+        self.app.profiler.start('html: render partial')
+        try:
+            if self._partial_settings is None:
+                # the same settings a publisher for doctrees would use (not
+                # those of the environment, e.g. emails are not cloaked)
+                self._partial_settings = OptionParser(
+                    components=(RSTParser(), DoctreeReader(),
+                                HTMLWriter(self)),
+                    defaults={'output_encoding': 'unicode'},
+                    read_config_files=True).get_default_values()
+            # no need for a publisher with reader, transforms and writer:
+            # translate a copy of the node (the translator modifies it)
+            # directly; the publisher's transforms are meant for whole
+            # documents
+            doc = new_document(b('<partial node>'), self._partial_settings)
+            doc.append(node.deepcopy())
+            visitor = self.translator_class(self, doc)
+            doc.walkabout(visitor)
+            parts = {}
+            for part in HTMLWriter.visitor_attributes:
+                parts[part] = ''.join(getattr(visitor, part))
+            return parts
+        finally:
+            self.app.profiler.stop()
+
+    def render_title(self, docname):
+        """Return the title of *docname* rendered as HTML.
+
+        Titles are cached until the document is read again or its section
+        number changes.
+        """
+        titlenode = self.env.titles[docname]
+        key = (self.env.all_docs.get(docname), titlenode.get('secnumber'))
+        cached = self._title_cache.get(docname)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        title = self.render_partial(titlenode)['title']
+        self._title_cache[docname] = (key, title)
+        return title
 
     def prepare_writing(self, docnames):
+        self.compute_config_digests()
         # create the search indexer
         from sphinx.search import IndexBuilder, languages
         lang = self.config.html_search_language or self.config.language
         if not lang or lang not in languages:
             lang = 'en'
+        snippet_length = 0
+        if self.indexer_format is js_index:
+            snippet_length = self.config.html_search_snippets
         self.indexer = IndexBuilder(self.env, lang,
-                                    self.config.html_search_options)
+                                    self.config.html_search_options,
+                                    snippet_length)
         self.load_indexer(docnames)
 
+        self.sidebar_matcher = PatternMatcher(self.config.html_sidebars)
         self.docwriter = HTMLWriter(self)
         self.docsettings = OptionParser(
             defaults=self.env.settings,
@@ -343,23 +548,24 @@ class StandaloneHTMLBuilder(Builder):
         parents = []
         rellinks = self.globalcontext['rellinks'][:]
         related = self.relations.get(docname)
-        titles = self.env.titles
         if related and related[2]:
             try:
                 next = {
                     'link': self.get_relative_uri(docname, related[2]),
-                    'title': self.render_partial(titles[related[2]])['title']
+                    'title': self.render_title(related[2])
                 }
                 rellinks.append((related[2], next['title'], 'N', _('next')))
+                self.env.note_reference(docname, related[2])
             except KeyError:
                 next = None
         if related and related[1]:
             try:
                 prev = {
                     'link': self.get_relative_uri(docname, related[1]),
-                    'title': self.render_partial(titles[related[1]])['title']
+                    'title': self.render_title(related[1])
                 }
                 rellinks.append((related[1], prev['title'], 'P', _('previous')))
+                self.env.note_reference(docname, related[1])
             except KeyError:
                 # the relation is (somehow) not in the TOC tree, handle
                 # that gracefully
@@ -368,7 +574,8 @@ class StandaloneHTMLBuilder(Builder):
             try:
                 parents.append(
                     {'link': self.get_relative_uri(docname, related[0]),
-                     'title': self.render_partial(titles[related[0]])['title']})
+                     'title': self.render_title(related[0])})
+                self.env.note_reference(docname, related[0])
             except KeyError:
                 pass
             related = self.relations.get(related[0])
@@ -414,13 +621,17 @@ class StandaloneHTMLBuilder(Builder):
         self.post_process_images(doctree)
         self.dlpath = relative_uri(self.get_target_uri(docname), '_downloads')
         self.current_docname = docname
-        self.docwriter.write(doctree, destination)
+        profiler = self.app.profiler
+        profiler.call('html: translate', self.docwriter.write,
+                      doctree, destination)
         self.docwriter.assemble_parts()
         body = self.docwriter.parts['fragment']
         metatags = self.docwriter.clean_meta
 
-        ctx = self.get_doc_context(docname, body, metatags)
-        self.index_page(docname, doctree, ctx.get('title', ''))
+        ctx = profiler.call('html: page context', self.get_doc_context,
+                            docname, body, metatags)
+        profiler.call('html: search index', self.index_page,
+                      docname, doctree, ctx.get('title', ''))
         self.handle_page(docname, ctx, event_arg=doctree)
 
     def finish(self):
@@ -431,12 +642,13 @@ class StandaloneHTMLBuilder(Builder):
             for pagename, context, template in pagelist:
                 self.handle_page(pagename, context, template)
 
+        profiler = self.app.profiler
         # the global general index
         if self.config.html_use_index:
-            self.write_genindex()
+            profiler.call('html: genindex', self.write_genindex)
 
         # the global domain-specific indices
-        self.write_domain_indices()
+        profiler.call('html: domain indices', self.write_domain_indices)
 
         # the search page
         if self.name != 'htmlhelp':
@@ -455,13 +667,18 @@ class StandaloneHTMLBuilder(Builder):
 
         self.info()
 
-        self.copy_image_files()
-        self.copy_download_files()
-        self.copy_static_files()
-        self.write_buildinfo()
+        profiler.call('html: copy images', self.copy_image_files)
+        profiler.call('html: copy downloads', self.copy_download_files)
+        profiler.call('html: copy static files', self.copy_static_files)
+        profiler.call('html: buildinfo', self.write_buildinfo)
+        # builders like epub package the output files in handle_finish()
+        self.flush_writer()
 
         # dump the search index
-        self.handle_finish()
+        profiler.call('html: handle finish', self.handle_finish)
+        self.flush_writer()
+        self.finish_precompress()
+        self.dump_manifest()
 
     def write_genindex(self):
         # the total count of lines for each index letter, used to distribute
@@ -509,12 +726,10 @@ class StandaloneHTMLBuilder(Builder):
             for src in self.status_iterator(self.images, 'copying images... ',
                                             brown, len(self.images)):
                 dest = self.images[src]
-                try:
-                    copyfile(path.join(self.srcdir, src),
-                             path.join(self.outdir, '_images', dest))
-                except Exception, err:
-                    self.warn('cannot copy image file %r: %s' %
-                              (path.join(self.srcdir, src), err))
+                self.writer.copy(path.join(self.srcdir, src),
+                                 path.join(self.outdir, '_images', dest),
+                                 'cannot copy image file %r: ' %
+                                 path.join(self.srcdir, src))
 
     def copy_download_files(self):
         # copy downloadable files
@@ -524,27 +739,24 @@ class StandaloneHTMLBuilder(Builder):
                                             'copying downloadable files... ',
                                             brown, len(self.env.dlfiles)):
                 dest = self.env.dlfiles[src][1]
-                try:
-                    copyfile(path.join(self.srcdir, src),
-                             path.join(self.outdir, '_downloads', dest))
-                except Exception, err:
-                    self.warn('cannot copy downloadable file %r: %s' %
-                              (path.join(self.srcdir, src), err))
+                self.writer.copy(path.join(self.srcdir, src),
+                                 path.join(self.outdir, '_downloads', dest),
+                                 'cannot copy downloadable file %r: ' %
+                                 path.join(self.srcdir, src))
 
     def copy_static_files(self):
         # copy static files
         self.info(bold('copying static files... '), nonl=True)
         ensuredir(path.join(self.outdir, '_static'))
         # first, create pygments style file
-        f = open(path.join(self.outdir, '_static', 'pygments.css'), 'w')
-        f.write(self.highlighter.get_stylesheet())
-        f.close()
+        self.writer.write(path.join(self.outdir, '_static', 'pygments.css'),
+                          b(self.highlighter.get_stylesheet()))
         # then, copy translations JavaScript file
         if self.config.language is not None:
             jsfile = self._get_translations_js()
             if jsfile:
-                copyfile(jsfile, path.join(self.outdir, '_static',
-                                           'translations.js'))
+                self.writer.copy(jsfile, path.join(self.outdir, '_static',
+                                                   'translations.js'))
 
         # add context items for search function used in searchtools.js_t
         ctx = self.globalcontext.copy()
@@ -571,31 +783,42 @@ class StandaloneHTMLBuilder(Builder):
             copy_static_entry(entry, path.join(self.outdir, '_static'), self,
                               ctx, exclude_matchers=matchers)
         # copy logo and favicon files if not already in static path
+        if self.config.html_logo or self.config.html_favicon:
+            # the static files must be there to check that
+            self.flush_writer()
         if self.config.html_logo:
             logobase = path.basename(self.config.html_logo)
             logotarget = path.join(self.outdir, '_static', logobase)
             if not path.isfile(logotarget):
-                copyfile(path.join(self.confdir, self.config.html_logo),
-                         logotarget)
+                self.writer.copy(path.join(self.confdir,
+                                           self.config.html_logo),
+                                 logotarget)
         if self.config.html_favicon:
             iconbase = path.basename(self.config.html_favicon)
             icontarget = path.join(self.outdir, '_static', iconbase)
             if not path.isfile(icontarget):
-                copyfile(path.join(self.confdir, self.config.html_favicon),
-                         icontarget)
+                self.writer.copy(path.join(self.confdir,
+                                           self.config.html_favicon),
+                                 icontarget)
         self.info('done')
 
     def write_buildinfo(self):
-        # write build info file
-        fp = open(path.join(self.outdir, '.buildinfo'), 'w')
-        try:
-            fp.write('# Sphinx build info version 1\n'
-                     '# This file hashes the configuration used when building'
-                     ' these files. When it is not found, a full rebuild will'
-                     ' be done.\nconfig: %s\ntags: %s\n' %
-                     (self.config_hash, self.tags_hash))
-        finally:
-            fp.close()
+        # write build info file; it is kept for external tools, Sphinx itself
+        # finds outdated pages with the output manifest
+        self.writer.write(path.join(self.outdir, '.buildinfo'), b(
+            '# Sphinx build info version 1\n'
+            '# This file hashes the configuration used when building'
+            ' these files. It is not used to find outdated files; those'
+            ' are recorded in %s.\nconfig: %s\ntags: %s\n' %
+            (MANIFEST_FILENAME, self.config_hash, self.tags_hash)))
+
+    def dump_manifest(self):
+        self.manifest.save()
+        self.info(bold('output files: ') + '%d written, %d unchanged, '
+                  '%.2fs waiting for I/O' % (self.manifest.written,
+                                             self.manifest.unchanged,
+                                             self.writer.blocked))
+        self.writer.blocked = 0
 
     def cleanup(self):
         # clean up theme stuff
@@ -624,6 +847,34 @@ class StandaloneHTMLBuilder(Builder):
             node.replace_self(reference)
             reference.append(node)
 
+    def init_write_worker(self):
+        Builder.init_write_worker(self)
+        if self.indexer is not None:
+            self.indexer = self.indexer.fork()
+        self.manifest = self.manifest.fork()
+        # the writer and compression threads are not inherited by the worker
+        # process
+        self.writer = OutputWriter(self.manifest, self.warn,
+                                   self.writer_threads)
+        self._precompress_tasks = ThreadedTasks(self.precompress_threads)
+        self._precompress_errors = []
+
+    def get_write_data(self, docnames):
+        self.flush_writer()
+        self.finish_precompress()
+        data = Builder.get_write_data(self, docnames)
+        data['indexer'] = self.indexer
+        data['manifest'] = self.manifest
+        data['blocked'] = self.writer.blocked
+        return data
+
+    def merge_write_data(self, docnames, data):
+        Builder.merge_write_data(self, docnames, data)
+        if self.indexer is not None:
+            self.indexer.merge(data['indexer'])
+        self.manifest.merge(data['manifest'])
+        self.writer.blocked += data['blocked']
+
     def load_indexer(self, docnames):
         keep = set(self.env.all_docs) - set(docnames)
         try:
@@ -633,7 +884,8 @@ class StandaloneHTMLBuilder(Builder):
             else:
                 f = open(searchindexfn, 'rb')
             try:
-                self.indexer.load(f, self.indexer_format)
+                self.indexer.load(f, self.indexer_format,
+                                  self.load_search_shard)
             finally:
                 f.close()
         except (IOError, OSError, ValueError):
@@ -644,6 +896,14 @@ class StandaloneHTMLBuilder(Builder):
         # delete all entries for files that will be rebuilt
         self.indexer.prune(keep)
 
+    def load_search_shard(self, name):
+        f = codecs.open(path.join(self.outdir, '_searchindex', name + '.js'),
+                        'r', encoding='utf-8')
+        try:
+            return js_index.loads_shard(f.read())
+        finally:
+            f.close()
+
     def index_page(self, pagename, doctree, title):
         # only index pages with title
         if self.indexer is not None and title:
@@ -657,25 +917,16 @@ class StandaloneHTMLBuilder(Builder):
         return path.join(self.outdir, os_path(pagename) + self.out_suffix)
 
     def add_sidebars(self, pagename, ctx):
-        def has_wildcard(pattern):
-            return any(char in pattern for char in '*?[')
         sidebars = None
-        matched = None
         customsidebar = None
-        for pattern, patsidebars in self.config.html_sidebars.iteritems():
-            if patmatch(pagename, pattern):
-                if matched:
-                    if has_wildcard(pattern):
-                        # warn if both patterns contain wildcards
-                        if has_wildcard(matched):
-                            self.warn('page %s matches two patterns in '
-                                      'html_sidebars: %r and %r' %
-                                      (pagename, matched, pattern))
-                        # else the already matched pattern is more specific
-                        # than the present one, because it contains no wildcard
-                        continue
-                matched = pattern
-                sidebars = patsidebars
+        matches = self.sidebar_matcher.match(pagename)
+        if matches:
+            sidebars = matches[0][1]
+            if len(matches) > 1:
+                # only patterns with wildcards can match together
+                self.warn('page %s matches two patterns in html_sidebars: '
+                          '%r and %r' % (pagename, matches[0][0],
+                                         matches[1][0]))
         if sidebars is None:
             # keep defaults
             pass
@@ -691,8 +942,11 @@ class StandaloneHTMLBuilder(Builder):
     def get_target_uri(self, docname, typ=None):
         return docname + self.link_suffix
 
-    def handle_page(self, pagename, addctx, templatename='page.html',
-                    outfilename=None, event_arg=None):
+    def render_page(self, pagename, addctx, templatename='page.html',
+                    event_arg=None):
+        """Render a page with the given template.  Return the complete
+        context and the output, or None if rendering failed.
+        """
         ctx = self.globalcontext.copy()
         # current_page_name is backwards compatibility
         ctx['pagename'] = ctx['current_page_name'] = pagename
@@ -709,9 +963,9 @@ class StandaloneHTMLBuilder(Builder):
         ctx['pathto'] = pathto
         ctx['hasdoc'] = lambda name: name in self.env.all_docs
         if self.name != 'htmlhelp':
-            ctx['encoding'] = encoding = self.config.html_output_encoding
+            ctx['encoding'] = self.config.html_output_encoding
         else:
-            ctx['encoding'] = encoding = self.encoding
+            ctx['encoding'] = self.encoding
         ctx['toctree'] = lambda **kw: self._get_local_toctree(pagename, **kw)
         self.add_sidebars(pagename, ctx)
         ctx.update(addctx)
@@ -720,81 +974,123 @@ class StandaloneHTMLBuilder(Builder):
                       ctx, event_arg)
 
         try:
-            output = self.templates.render(templatename, ctx)
+            output = self.app.profiler.call('html: template render',
+                                            self.templates.render,
+                                            templatename, ctx)
         except UnicodeError:
             self.warn("a Unicode error occurred when rendering the page %s. "
                       "Please make sure all config values that contain "
                       "non-ASCII content are Unicode strings." % pagename)
+            return None
+        return ctx, output
+
+    def handle_page(self, pagename, addctx, templatename='page.html',
+                    outfilename=None, event_arg=None):
+        rendered = self.render_page(pagename, addctx, templatename,
+                                    event_arg)
+        if rendered is None:
             return
+        ctx, output = rendered
 
         if not outfilename:
             outfilename = self.get_outfilename(pagename)
-        # outfilename's path is in general different from self.outdir
-        ensuredir(path.dirname(outfilename))
+        self.manifest.set_dependencies(outfilename,
+                                       self.templates.loaded_templates())
+        self.note_page(pagename, outfilename,
+                       self.templates.loaded_variables())
+        # this only blocks if the writer threads are behind
+        self.app.profiler.start('html: write file')
         try:
-            f = codecs.open(outfilename, 'w', encoding, 'xmlcharrefreplace')
-            try:
-                f.write(output)
-            finally:
-                f.close()
-        except (IOError, OSError), err:
-            self.warn("error writing file %s: %s" % (outfilename, err))
-        if self.copysource and ctx.get('sourcename'):
-            # copy the source file for the "show source" link
-            source_name = path.join(self.outdir, '_sources',
-                                    os_path(ctx['sourcename']))
-            ensuredir(path.dirname(source_name))
-            copyfile(self.env.doc2path(pagename), source_name)
+            self.writer.write_text(outfilename, output, ctx['encoding'],
+                                   'xmlcharrefreplace')
+            if self.copysource and ctx.get('sourcename'):
+                # copy the source file for the "show source" link
+                source_name = path.join(self.outdir, '_sources',
+                                        os_path(ctx['sourcename']))
+                self.writer.copy(self.env.doc2path(pagename), source_name)
+        finally:
+            self.app.profiler.stop()
 
     def handle_finish(self):
-        self.dump_search_index()
-        self.dump_inventory()
+        self.app.profiler.call('html: dump search index',
+                               self.dump_search_index)
+        self.app.profiler.call('html: dump inventory', self.dump_inventory)
 
     def dump_inventory(self):
         self.info(bold('dumping object inventory... '), nonl=True)
-        f = open(path.join(self.outdir, INVENTORY_FILENAME), 'wb')
-        try:
-            f.write((u'# Sphinx inventory version 2\n'
-                     u'# Project: %s\n'
-                     u'# Version: %s\n'
-                     u'# The remainder of this file is compressed using zlib.\n'
-                     % (self.config.project, self.config.version)
-                    ).encode('utf-8'))
-            compressor = zlib.compressobj(9)
-            for domainname, domain in self.env.domains.iteritems():
-                for name, dispname, type, docname, anchor, prio in \
-                        domain.get_objects():
-                    if anchor.endswith(name):
-                        # this can shorten the inventory by as much as 25%
-                        anchor = anchor[:-len(name)] + '$'
-                    uri = self.get_target_uri(docname) + '#' + anchor
-                    if dispname == name:
-                        dispname = u'-'
-                    f.write(compressor.compress(
-                        (u'%s %s:%s %s %s %s\n' % (name, domainname, type,
-                                                   prio, uri, dispname)
-                        ).encode('utf-8')))
-            f.write(compressor.flush())
-        finally:
-            f.close()
+        parts = [(u'# Sphinx inventory version 2\n'
+                  u'# Project: %s\n'
+                  u'# Version: %s\n'
+                  u'# The remainder of this file is compressed using zlib.\n'
+                  % (self.config.project, self.config.version)
+                 ).encode('utf-8')]
+        compressor = zlib.compressobj(9)
+        for domainname, domain in sorted(self.env.domains.iteritems()):
+            for name, dispname, type, docname, anchor, prio in \
+                    sorted(domain.get_objects()):
+                if anchor.endswith(name):
+                    # this can shorten the inventory by as much as 25%
+                    anchor = anchor[:-len(name)] + '$'
+                uri = self.get_target_uri(docname) + '#' + anchor
+                if dispname == name:
+                    dispname = u'-'
+                parts.append(compressor.compress(
+                    (u'%s %s:%s %s %s %s\n' % (name, domainname, type,
+                                               prio, uri, dispname)
+                    ).encode('utf-8')))
+        parts.append(compressor.flush())
+        self.writer.write(path.join(self.outdir, INVENTORY_FILENAME),
+                          b('').join(parts))
         self.info('done')
 
     def dump_search_index(self):
         self.info(bold('dumping search index... '), nonl=True)
         self.indexer.prune(self.env.all_docs)
         searchindexfn = path.join(self.outdir, self.searchindex_filename)
-        # first write to a temporary file, so that if dumping fails,
-        # the existing index won't be overwritten
+        # dump to a string first, so that if dumping fails, the existing
+        # index won't be overwritten
+        sizes = None
+        if self.indexer_format is js_index:
+            # only searchtools.js knows how to load the shards and snippets
+            # and decode the compact encoding
+            nshards = self.config.html_search_shards
+            compact = self.config.html_search_compact
+            objectindex = self.config.html_search_object_index
+            sizes = {}
+            files = {}
+            if nshards:
+                frozen, files = self.indexer.freeze_sharded(nshards, compact,
+                                                            objectindex)
+            else:
+                frozen = self.indexer.freeze(compact, objectindex)
+            if self.config.html_search_snippets:
+                snippets = self.indexer.freeze_snippets()
+                frozen['snippets'] = len(snippets)
+                files.update(snippets)
+            # the shards and snippet files are loaded as they are needed;
+            # unchanged ones are not written again
+            for name, filedata in files.iteritems():
+                filedata = js_index.dumps_shard(name, filedata)
+                self.writer.write_text(
+                    path.join(self.outdir, '_searchindex', name + '.js'),
+                    filedata)
+                section = name.rstrip('0123456789')
+                sizes[section] = sizes.get(section, 0) + len(filedata)
+            data, sectionsizes = js_index.dumps_sections(frozen)
+            # leave out flags like "compact"
+            sizes.update((key, size) for (key, size) in sectionsizes
+                         if not isinstance(frozen[key], int))
+        else:
+            data = self.indexer.dumps(self.indexer_format)
         if self.indexer_dumps_unicode:
-            f = codecs.open(searchindexfn + '.tmp', 'w', encoding='utf-8')
+            self.writer.write_text(searchindexfn, data)
         else:
-            f = open(searchindexfn + '.tmp', 'wb')
-        try:
-            self.indexer.dump(f, self.indexer_format)
-        finally:
-            f.close()
-        movefile(searchindexfn + '.tmp', searchindexfn)
+            self.writer.write(searchindexfn, data)
         self.info('done')
+        if sizes:
+            self.info('search index sections: ' +
+                      ', '.join('%s %d bytes' % item
+                                for item in sorted(sizes.iteritems())))
 
 
 class DirectoryHTMLBuilder(StandaloneHTMLBuilder):
@@ -900,6 +1196,121 @@ class SingleFileHTMLBuilder(StandaloneHTMLBuilder):
             display_toc = display_toc,
         )
 
+    def render_inlined(self, docname, level, marker):
+        """Resolve and render *docname* on its own, for streaming.
+
+        The documents included by its toctrees are left out; after the
+        anchor of each one, *marker* marks where it belongs.  Return the HTML
+        fragments between the included documents, the included documents
+        with the section level they are included at, and the meta tags.
+        """
+        env = self.env
+        master = self.config.master_doc
+        tree = env.get_doctree(docname)
+        if docname == master:
+            env.resolve_references(tree, master, self)
+        else:
+            # all references are resolved from the master document, but
+            # resolving forgets those noted for the other documents so far
+            references = env.references.get(master, set()).copy()
+            unresolved = master in env.unresolved_refs
+            env.resolve_references(tree, master, self)
+            for todocname in references:
+                env.note_reference(master, todocname)
+            if unresolved:
+                env.note_unresolved_reference(master)
+        self.fix_refuris(tree)
+        self.post_process_images(tree)
+
+        includes = []
+        for toctreenode in tree.traverse(addnodes.toctree):
+            sectionlevel = level
+            parent = toctreenode.parent
+            while parent is not None:
+                if isinstance(parent, nodes.section):
+                    sectionlevel += 1
+                parent = parent.parent
+            newnodes = []
+            for includefile in map(str, toctreenode['includefiles']):
+                if includefile not in env.all_docs:
+                    self.warn('toctree contains ref to nonexisting '
+                              'file %r' % includefile, env.doc2path(docname))
+                    continue
+                sof = addnodes.start_of_file(docname=includefile)
+                sof.append(nodes.Text(marker))
+                newnodes.append(sof)
+                includes.append((includefile, sectionlevel))
+            toctreenode.parent.replace(toctreenode, newnodes)
+
+        self.app.profiler.start('html: translate')
+        try:
+            tree.settings = self.docsettings
+            visitor = self.translator_class(self, tree)
+            # headings continue at the level of the including toctree
+            visitor.section_level = level
+            tree.walkabout(visitor)
+        finally:
+            self.app.profiler.stop()
+        fragments = u''.join(visitor.fragment).split(marker)
+        return fragments, includes, ''.join(visitor.meta[2:])
+
+    def stream_document(self, fragments, includes, marker):
+        """Yield the HTML of a document rendered by :meth:`render_inlined`,
+        with the included documents rendered in their places.
+        """
+        yield fragments[0]
+        for fragment, (includefile, level) in zip(fragments[1:], includes):
+            self.info(darkgreen(includefile) + ' ', nonl=1)
+            subfragments, subincludes = \
+                self.render_inlined(includefile, level, marker)[:2]
+            for chunk in self.stream_document(subfragments, subincludes,
+                                              marker):
+                yield chunk
+            yield fragment
+
+    def write_streaming(self):
+        """Write the single page one document after the other, without
+        assembling the whole doctree in memory.
+        """
+        master = self.config.master_doc
+        self.secnumbers = self.env.toc_secnumbers.get(master, {})
+        self.imgpath = relative_uri(self.get_target_uri(master), '_images')
+        self.dlpath = relative_uri(self.get_target_uri(master), '_downloads')
+        self.current_docname = master
+        # stands in for the included documents, and for the body of the page
+        marker = 'sphinxinlined%x' % random.getrandbits(64)
+
+        # only the meta tags of the master document can go in the page head
+        fragments, includes, metatags = \
+            self.render_inlined(master, 0, marker)
+        ctx = self.get_doc_context(master, marker, metatags)
+        rendered = self.render_page(master, ctx)
+        if rendered is None:
+            return
+        ctx, output = rendered
+        if output.count(marker) != 1:
+            self.warn('the page template does not contain the body exactly '
+                      'once, the single document cannot be streamed')
+            self.write_doc(master, self.assemble_doctree())
+            return
+        head, tail = output.split(marker)
+        encoding = ctx['encoding']
+
+        def chunks():
+            yield head.encode(encoding, 'xmlcharrefreplace')
+            for chunk in self.stream_document(fragments, includes, marker):
+                yield chunk.encode(encoding, 'xmlcharrefreplace')
+            yield tail.encode(encoding, 'xmlcharrefreplace')
+
+        outfilename = self.get_outfilename(master)
+        self.manifest.set_dependencies(outfilename,
+                                       self.templates.loaded_templates())
+        self.note_page(master, outfilename,
+                       self.templates.loaded_variables())
+        self.app.profiler.call('html: write file',
+                               self.manifest.write_chunks,
+                               outfilename, chunks())
+
     def write(self, *ignored):
         docnames = self.env.all_docs
 
@@ -907,6 +1318,12 @@ class SingleFileHTMLBuilder(StandaloneHTMLBuilder):
         self.prepare_writing(docnames)
         self.info('done')
 
+        if self.config.singlehtml_streaming:
+            self.info(bold('writing single document... '), nonl=True)
+            self.write_streaming()
+            self.info()
+            return
+
         self.info(bold('assembling single document... '), nonl=True)
         doctree = self.assemble_doctree()
         self.info()
@@ -935,6 +1352,9 @@ class SingleFileHTMLBuilder(StandaloneHTMLBuilder):
         self.copy_static_files()
         self.write_buildinfo()
         self.dump_inventory()
+        self.flush_writer()
+        self.finish_precompress()
+        self.dump_manifest()
 
 
 class SerializingHTMLBuilder(StandaloneHTMLBuilder):
@@ -952,14 +1372,20 @@ class SerializingHTMLBuilder(StandaloneHTMLBuilder):
     #: the filename for the global context file
     globalcontext_filename = None
 
+    allow_precompress = False
+
     supported_image_types = ['image/svg+xml', 'image/png',
                              'image/gif', 'image/jpeg']
 
     def init(self):
         self.config_hash = ''
         self.tags_hash = ''
+        self.config_digests = {}
+        self._page_config_digests = {}
         self.theme = None       # no theme necessary
         self.templates = None   # no template bridge necessary
+        self._title_cache = {}
+        self.init_manifest()
         self.init_translator_class()
         self.init_highlighter()
 
@@ -971,14 +1397,11 @@ class SerializingHTMLBuilder(StandaloneHTMLBuilder):
         return docname + SEP
 
     def dump_context(self, context, filename):
+        data = self.implementation.dumps(context, *self.additional_dump_args)
         if self.implementation_dumps_unicode:
-            f = codecs.open(filename, 'w', encoding='utf-8')
+            self.writer.write_text(filename, data)
         else:
-            f = open(filename, 'wb')
-        try:
-            self.implementation.dump(context, f, *self.additional_dump_args)
-        finally:
-            f.close()
+            self.writer.write(filename, data)
 
     def handle_page(self, pagename, ctx, templatename='page.html',
                     outfilename=None, event_arg=None):
@@ -992,16 +1415,16 @@ class SerializingHTMLBuilder(StandaloneHTMLBuilder):
         self.app.emit('html-page-context', pagename, templatename,
                       ctx, event_arg)
 
-        ensuredir(path.dirname(outfilename))
         self.dump_context(ctx, outfilename)
+        # the global context is dumped separately
+        self.note_page(pagename, outfilename, None)
 
         # if there is a source file, copy the source file for the
         # "show source" link
         if ctx.get('sourcename'):
             source_name = path.join(self.outdir, '_sources',
                                     os_path(ctx['sourcename']))
-            ensuredir(path.dirname(source_name))
-            copyfile(self.env.doc2path(pagename), source_name)
+            self.writer.copy(self.env.doc2path(pagename), source_name)
 
     def handle_finish(self):
         # dump the global context
@@ -1011,10 +1434,10 @@ class SerializingHTMLBuilder(StandaloneHTMLBuilder):
         # super here to dump the search index
         StandaloneHTMLBuilder.handle_finish(self)
 
-        # copy the environment file from the doctree dir to the output dir
-        # as needed by the web app
-        copyfile(path.join(self.doctreedir, ENV_PICKLE_FILENAME),
-                 path.join(self.outdir, ENV_PICKLE_FILENAME))
+        # pickle the complete environment (not only the core that is kept in
+        # the doctree dir) to the output dir as needed by the web app
+        self.env.topickle(path.join(self.outdir, ENV_PICKLE_FILENAME),
+                          sharded=False)
 
         # touch 'last build' file, used by the web application to determine
         # when to reload its environment and clear the cache
@@ -97,6 +97,8 @@ class QtHelpBuilder(StandaloneHTMLBuilder):
 
     # don't copy the reST source
     copysource = False
+    # the output is packaged, compressed copies are not wanted
+    allow_precompress = False
     supported_image_types = ['image/svg+xml', 'image/png', 'image/gif',
                              'image/jpeg']
 
@@ -27,6 +27,8 @@ class WebSupportBuilder(PickleHTMLBuilder):
     """
     name = 'websupport'
     versioning_method = 'commentable'
+    # documents are added to the storage backend while writing
+    allow_parallel = False
 
     def init(self):
         PickleHTMLBuilder.init(self)
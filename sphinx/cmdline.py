@@ -21,7 +21,8 @@ from sphinx import __version__
 from sphinx.errors import SphinxError
 from sphinx.application import Sphinx
 from sphinx.util import Tee, format_exception_cut_frames, save_traceback
-from sphinx.util.console import red, nocolor, color_terminal
+from sphinx.util.parallel import parallel_available
+from sphinx.util.console import red, bold, nocolor, color_terminal
 
 
 def usage(argv, msg=None):
@@ -35,6 +36,7 @@ Options: -b <builder> -- builder to use; default is html
          -a        -- write all files; default is to only write \
 new and changed files
          -E        -- don't use a saved environment, always read all files
+         -j <N>    -- read in parallel using N processes where possible
          -t <tag>  -- include "only" blocks with <tag>
          -d <path> -- path for the cached environment and doctree files
                       (default: outdir/.doctrees)
@@ -50,6 +52,9 @@ new and changed files
          -w <file> -- write warnings (and errors) to given file
          -W        -- turn warnings into errors
          -P        -- run Pdb on exception
+         --watch   -- after building, keep rebuilding when sources change
+         --profile-report <file> -- write the times of all build phases
+                      to <file> (JSON) and show the slowest ones
 Modi:
 * without -a and without filenames, write new and changed files.
 * with -a, write all files.
@@ -62,7 +67,8 @@ def main(argv):
         nocolor()
 
     try:
-        opts, args = getopt.getopt(argv[1:], 'ab:t:d:c:CD:A:ng:NEqQWw:P')
+        opts, args = getopt.getopt(argv[1:], 'ab:t:d:c:CD:A:ng:NEqQWw:Pj:',
+                                   ['watch', 'profile-report='])
         allopts = set(opt[0] for opt in opts)
         srcdir = confdir = path.abspath(args[0])
         if not path.isdir(srcdir):
@@ -98,11 +104,13 @@ def main(argv):
         likely_encoding = None
 
     buildername = None
-    force_all = freshenv = warningiserror = use_pdb = False
+    force_all = freshenv = warningiserror = use_pdb = watch = False
+    parallel = 0
     status = sys.stdout
     warning = sys.stderr
     error = sys.stderr
     warnfile = None
+    profile_report = None
     confoverrides = {}
     tags = []
     doctreedir = path.join(outdir, '.doctrees')
@@ -175,6 +183,22 @@ def main(argv):
             warnfile = val
         elif opt == '-P':
             use_pdb = True
+        elif opt == '--watch':
+            watch = True
+        elif opt == '--profile-report':
+            profile_report = path.abspath(val)
+        elif opt == '-j':
+            try:
+                parallel = int(val)
+            except ValueError:
+                print >>sys.stderr, ('Error: -j option argument must be an '
+                                     'integer.')
+                return 1
+
+    if parallel > 1 and not parallel_available:
+        print >>sys.stderr, ('Warning: parallel building is not supported on '
+                             'this platform, building serially.')
+        parallel = 0
 
     if warning and warnfile:
         warnfp = open(warnfile, 'w')
@@ -184,8 +208,24 @@ def main(argv):
     try:
         app = Sphinx(srcdir, confdir, outdir, doctreedir, buildername,
                      confoverrides, status, warning, freshenv,
-                     warningiserror, tags)
-        app.build(force_all, filenames)
+                     warningiserror, tags, parallel, bool(profile_report))
+        if not watch:
+            app.build(force_all, filenames)
+        else:
+            while app.watch(force_all, filenames):
+                # the configuration changed: start over with a new
+                # application, keeping the saved environment
+                app = Sphinx(srcdir, confdir, outdir, doctreedir, buildername,
+                             confoverrides, status, warning, False,
+                             warningiserror, tags, parallel,
+                             bool(profile_report))
+                force_all, filenames = False, []
+        if profile_report:
+            app.profiler.dump(profile_report)
+            app.info(bold('slowest build phases '
+                          '(full report in %s):' % profile_report))
+            for line in app.profiler.summary():
+                app.info(line)
         return app.statuscode
     except KeyboardInterrupt:
         if use_pdb:
@@ -72,6 +72,8 @@ class Config(object):
         needs_sphinx = (None, None),
         nitpicky = (False, 'env'),
         nitpick_ignore = ([], 'env'),
+        source_digests = (False, None),
+        doctree_cache_size = (16, None),
 
         # HTML options
         html_theme = ('default', 'html'),
@@ -109,6 +111,14 @@ class Config(object):
         html_secnumber_suffix = ('. ', 'html'),
         html_search_language = (None, 'html'),
         html_search_options = ({}, 'html'),
+        html_search_shards = (0, 'html'),
+        html_search_compact = (False, 'html'),
+        html_search_snippets = (0, 'html'),
+        html_search_object_index = (False, 'html'),
+        html_precompress = (False, 'html'),
+
+        # Single HTML only options
+        singlehtml_streaming = (False, 'html'),
 
         # HTML help only options
         htmlhelp_basename = (lambda self: make_filename(self.project), None),
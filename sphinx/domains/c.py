@@ -19,6 +19,7 @@ from sphinx.roles import XRefRole
 from sphinx.locale import l_, _
 from sphinx.domains import Domain, ObjType
 from sphinx.directives import ObjectDescription
+from sphinx.util import DocIndexedDict
 from sphinx.util.nodes import make_refnode
 from sphinx.util.docfields import Field, TypedField
 
@@ -223,13 +224,17 @@ class CDomain(Domain):
         'type':   CXRefRole(),
     }
     initial_data = {
-        'objects': {},  # fullname -> docname, objtype
+        'objects': DocIndexedDict(),  # fullname -> docname, objtype
     }
 
     def clear_doc(self, docname):
-        for fullname, (fn, _) in self.data['objects'].items():
-            if fn == docname:
-                del self.data['objects'][fullname]
+        self.data['objects'].purge_doc(docname)
+
+    def merge_domaindata(self, docnames, otherdata):
+        for docname in docnames:
+            for fullname in otherdata['objects'].keys_for(docname):
+                self.data['objects'][fullname] = \
+                    otherdata['objects'][fullname]
 
     def resolve_xref(self, env, fromdocname, builder,
                      typ, target, node, contnode):
@@ -15,6 +15,7 @@ from sphinx.locale import l_, _
 from sphinx.directives import ObjectDescription
 from sphinx.roles import XRefRole
 from sphinx.domains.python import _pseudo_parse_arglist
+from sphinx.util import DocIndexedDict
 from sphinx.util.nodes import make_refnode
 from sphinx.util.docfields import Field, GroupedField, TypedField
 
@@ -177,13 +178,17 @@ class JavaScriptDomain(Domain):
         'attr':  JSXRefRole(),
     }
     initial_data = {
-        'objects': {}, # fullname -> docname, objtype
+        'objects': DocIndexedDict(),  # fullname -> docname, objtype
     }
 
     def clear_doc(self, docname):
-        for fullname, (fn, _) in self.data['objects'].items():
-            if fn == docname:
-                del self.data['objects'][fullname]
+        self.data['objects'].purge_doc(docname)
+
+    def merge_domaindata(self, docnames, otherdata):
+        for docname in docnames:
+            for fullname in otherdata['objects'].keys_for(docname):
+                self.data['objects'][fullname] = \
+                    otherdata['objects'][fullname]
 
     def find_obj(self, env, obj, name, typ, searchorder=0):
         if name[-2:] == '()':
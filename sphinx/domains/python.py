@@ -19,6 +19,7 @@ from sphinx.roles import XRefRole
 from sphinx.locale import l_, _
 from sphinx.domains import Domain, ObjType, Index
 from sphinx.directives import ObjectDescription
+from sphinx.util import DocIndexedDict
 from sphinx.util.nodes import make_refnode
 from sphinx.util.compat import Directive
 from sphinx.util.docfields import Field, GroupedField, TypedField
@@ -550,6 +551,69 @@ class PythonModuleIndex(Index):
         return content, collapse
 
 
+class DottedNameDict(DocIndexedDict):
+    """
+    A :class:`~sphinx.util.DocIndexedDict` with dotted names as keys that
+    also keeps an index of the names' suffixes (``"b.c"`` and ``"c"`` for
+    ``"a.b.c"``), used for "fuzzy" lookups of objects.
+    """
+    def __init__(self, initial=None, docpos=0):
+        self._suffixes = {}  # suffix -> set of full names
+        DocIndexedDict.__init__(self, initial, docpos)
+
+    def _iter_suffixes(self, name):
+        i = name.find('.')
+        while i != -1:
+            yield name[i+1:]
+            i = name.find('.', i+1)
+
+    def _add_suffixes(self, name):
+        for suffix in self._iter_suffixes(name):
+            self._suffixes.setdefault(suffix, set()).add(name)
+
+    def _remove_suffixes(self, name):
+        for suffix in self._iter_suffixes(name):
+            names = self._suffixes[suffix]
+            names.discard(name)
+            if not names:
+                del self._suffixes[suffix]
+
+    def __setitem__(self, key, value):
+        if key not in self:
+            self._add_suffixes(key)
+        DocIndexedDict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        DocIndexedDict.__delitem__(self, key)
+        self._remove_suffixes(key)
+
+    def popitem(self):
+        key, value = DocIndexedDict.popitem(self)
+        self._remove_suffixes(key)
+        return key, value
+
+    def clear(self):
+        DocIndexedDict.clear(self)
+        self._suffixes.clear()
+
+    def purge_doc(self, docname):
+        for key in self.keys_for(docname):
+            self._remove_suffixes(key)
+        DocIndexedDict.purge_doc(self, docname)
+
+    def find_suffix(self, name):
+        """Return the names ending with ``"." + name``."""
+        return self._suffixes.get(name, set())
+
+    def __reduce__(self):
+        return (self.__class__, (None, self.docpos),
+                (dict(self), self._dockeys, self._suffixes))
+
+    def __setstate__(self, state):
+        items, self._dockeys, self._suffixes = state
+        dict.update(self, items)
+
+
 class PythonDomain(Domain):
     """Python language domain."""
     name = 'py'
@@ -592,20 +656,26 @@ class PythonDomain(Domain):
         'obj':   PyXRefRole(),
     }
     initial_data = {
-        'objects': {},  # fullname -> docname, objtype
-        'modules': {},  # modname -> docname, synopsis, platform, deprecated
+        # fullname -> docname, objtype
+        'objects': DottedNameDict(),
+        # modname -> docname, synopsis, platform, deprecated
+        'modules': DocIndexedDict(),
     }
     indices = [
         PythonModuleIndex,
     ]
 
     def clear_doc(self, docname):
-        for fullname, (fn, _) in self.data['objects'].items():
-            if fn == docname:
-                del self.data['objects'][fullname]
-        for modname, (fn, _, _, _) in self.data['modules'].items():
-            if fn == docname:
-                del self.data['modules'][modname]
+        self.data['objects'].purge_doc(docname)
+        self.data['modules'].purge_doc(docname)
+
+    def merge_domaindata(self, docnames, otherdata):
+        for docname in docnames:
+            for fullname in otherdata['objects'].keys_for(docname):
+                self.data['objects'][fullname] = \
+                    otherdata['objects'][fullname]
+            for modname in otherdata['modules'].keys_for(docname):
+                self.data['modules'][modname] = otherdata['modules'][modname]
 
     def find_obj(self, env, modname, classname, name, type, searchmode=0):
         """Find a Python object for "name", perhaps using the given module
@@ -636,10 +706,9 @@ class PythonDomain(Domain):
                     newname = name
                 else:
                     # "fuzzy" searching mode
-                    searchname = '.' + name
-                    matches = [(name, objects[name]) for name in objects
-                               if name.endswith(searchname)
-                               and objects[name][1] in objtypes]
+                    matches = [(oname, objects[oname]) for oname
+                               in sorted(objects.find_suffix(name))
+                               if objects[oname][1] in objtypes]
         else:
             # NOTE: searching for exact match, object type is not considered
             if name in objects:
@@ -16,6 +16,7 @@ from sphinx.domains import Domain, ObjType
 from sphinx.locale import l_, _
 from sphinx.directives import ObjectDescription
 from sphinx.roles import XRefRole
+from sphinx.util import DocIndexedDict
 from sphinx.util.nodes import make_refnode
 
 
@@ -115,13 +116,17 @@ class ReSTDomain(Domain):
         'role': XRefRole(),
     }
     initial_data = {
-        'objects': {},  # fullname -> docname, objtype
+        # (objtype, fullname) -> docname
+        'objects': DocIndexedDict(docpos=None),
     }
 
     def clear_doc(self, docname):
-        for (typ, name), doc in self.data['objects'].items():
-            if doc == docname:
-                del self.data['objects'][typ, name]
+        self.data['objects'].purge_doc(docname)
+
+    def merge_domaindata(self, docnames, otherdata):
+        for docname in docnames:
+            for key in otherdata['objects'].keys_for(docname):
+                self.data['objects'][key] = docname
 
     def resolve_xref(self, env, fromdocname, builder, typ, target, node,
                      contnode):
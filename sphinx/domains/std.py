@@ -21,7 +21,7 @@ from sphinx.roles import XRefRole
 from sphinx.locale import l_, _
 from sphinx.domains import Domain, ObjType
 from sphinx.directives import ObjectDescription
-from sphinx.util import ws_re
+from sphinx.util import ws_re, DocIndexedDict
 from sphinx.util.nodes import clean_astext, make_refnode
 from sphinx.util.compat import Directive
 
@@ -421,18 +421,20 @@ class StandardDomain(Domain):
     }
 
     initial_data = {
-        'progoptions': {},  # (program, name) -> docname, labelid
-        'objects': {},      # (type, name) -> docname, labelid
-        'labels': {         # labelname -> docname, labelid, sectionname
+        'progoptions': DocIndexedDict(),  # (program, name) -> docname, labelid
+        'objects': DocIndexedDict(),      # (type, name) -> docname, labelid
+        # labelname -> docname, labelid, sectionname
+        'labels': DocIndexedDict({
             'genindex': ('genindex', '', l_('Index')),
             'modindex': ('py-modindex', '', l_('Module Index')),
             'search':   ('search', '', l_('Search Page')),
-        },
-        'anonlabels': {     # labelname -> docname, labelid
+        }),
+        # labelname -> docname, labelid
+        'anonlabels': DocIndexedDict({
             'genindex': ('genindex', ''),
             'modindex': ('py-modindex', ''),
             'search':   ('search', ''),
-        },
+        }),
     }
 
     dangling_warnings = {
@@ -443,18 +445,14 @@ class StandardDomain(Domain):
     }
 
     def clear_doc(self, docname):
-        for key, (fn, _) in self.data['progoptions'].items():
-            if fn == docname:
-                del self.data['progoptions'][key]
-        for key, (fn, _) in self.data['objects'].items():
-            if fn == docname:
-                del self.data['objects'][key]
-        for key, (fn, _, _) in self.data['labels'].items():
-            if fn == docname:
-                del self.data['labels'][key]
-        for key, (fn, _) in self.data['anonlabels'].items():
-            if fn == docname:
-                del self.data['anonlabels'][key]
+        for inv in ('progoptions', 'objects', 'labels', 'anonlabels'):
+            self.data[inv].purge_doc(docname)
+
+    def merge_domaindata(self, docnames, otherdata):
+        for inv in ('progoptions', 'objects', 'labels', 'anonlabels'):
+            for docname in docnames:
+                for key in otherdata[inv].keys_for(docname):
+                    self.data[inv][key] = otherdata[inv][key]
 
     def process_doc(self, env, docname, document):
         labels, anonlabels = self.data['labels'], self.data['anonlabels']
@@ -526,6 +524,7 @@ class StandardDomain(Domain):
                     fromdocname, docname)
                 if labelid:
                     newnode['refuri'] += '#' + labelid
+                env.note_reference(fromdocname, docname)
             newnode.append(innernode)
             return newnode
         elif typ == 'keyword':
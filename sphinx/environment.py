@@ -21,6 +21,11 @@ import posixpath
 import unicodedata
 import cPickle as pickle
 from os import path
+try:
+    from hashlib import md5
+except ImportError:
+    # 2.4 compatibility
+    from md5 import md5
 from glob import glob
 from itertools import izip, groupby
 
@@ -38,11 +43,14 @@ from docutils.transforms.parts import ContentsFilter
 
 from sphinx import addnodes
 from sphinx.util import url_re, get_matching_docs, docname_join, split_into, \
-     FilenameUniqDict
+     FilenameUniqDict, DocIndexedDict
 from sphinx.util.nodes import clean_astext, make_refnode, extract_messages
-from sphinx.util.osutil import movefile, SEP, ustrftime
+from sphinx.util.osutil import movefile, SEP, ustrftime, ensuredir
 from sphinx.util.matching import compile_matchers
 from sphinx.util.pycompat import all, class_types
+from sphinx.util.profiling import null_profiler
+from sphinx.util.parallel import ParallelTasks, parallel_available, \
+     make_chunks
 from sphinx.util.websupport import is_commentable
 from sphinx.errors import SphinxError, ExtensionError
 from sphinx.locale import _, init as init_locale
@@ -69,7 +77,7 @@ default_settings = {
 
 # This is increased every time an environment attribute is added
 # or changed to properly invalidate pickle files.
-ENV_VERSION = 41
+ENV_VERSION = 50
 
 
 default_substitutions = set([
@@ -265,6 +273,249 @@ class SphinxContentsFilter(ContentsFilter):
         raise nodes.SkipNode
 
 
+class DocShardStore(object):
+    """
+    Keeps the per-document inventories of an environment in one pickle file
+    per document ("shard"), next to its doctree.  Shards are only loaded when
+    an entry of their document is first accessed, and only rewritten for
+    documents whose entries were changed.
+    """
+
+    def __init__(self, env):
+        self.env = env
+        self.dicts = []          # the LazyDocDicts using this store
+        self.on_disk = set()     # docnames with an up-to-date shard file
+        self.dirty = set()       # docnames whose shard must be rewritten
+        self.pickling_core = False
+
+    def filename(self, docname):
+        return self.env.doc2path(docname, self.env.doctreedir, '.envshard')
+
+    def load(self, docname):
+        """Load the shard of *docname* into all dicts."""
+        f = open(self.filename(docname), 'rb')
+        try:
+            shard = pickle.load(f)
+        finally:
+            f.close()
+        for d in self.dicts:
+            if docname in d._unloaded:
+                d._unloaded.discard(docname)
+                d._data[docname] = shard[d.name]
+
+    def load_all(self):
+        docnames = set()
+        for d in self.dicts:
+            docnames.update(d._unloaded)
+        for docname in sorted(docnames):
+            self.load(docname)
+
+    def discard(self, docname):
+        """Remove all entries of *docname*, without loading its shard."""
+        for d in self.dicts:
+            d._unloaded.discard(docname)
+            d._data.pop(docname, None)
+        self.dirty.add(docname)
+
+    def flush(self):
+        """Write the shards of all changed documents."""
+        docnames = set(self.dirty)
+        for d in self.dicts:
+            docnames.update(set(d._data) - self.on_disk)
+        for docname in docnames:
+            shard = {}
+            for d in self.dicts:
+                if docname in d._data:
+                    shard[d.name] = d._data[docname]
+            filename = self.filename(docname)
+            if not shard:
+                if path.isfile(filename):
+                    os.unlink(filename)
+                self.on_disk.discard(docname)
+                continue
+            ensuredir(path.dirname(filename))
+            f = open(filename, 'wb')
+            try:
+                pickle.dump(shard, f, pickle.HIGHEST_PROTOCOL)
+            finally:
+                f.close()
+            self.on_disk.add(docname)
+        self.dirty.clear()
+
+
+class LazyDocDict(object):
+    """
+    A mapping of docname -> value whose values are stored in the document
+    shards of a :class:`DocShardStore` and loaded on first access.
+
+    Only assignment and deletion mark a document's shard as changed, so
+    values must be reassigned (as the environment does when re-reading a
+    document) instead of being modified in place.
+    """
+
+    def __init__(self, name, store):
+        self.name = name
+        self._store = store
+        self._data = {}          # loaded values
+        self._unloaded = set()   # docnames whose value is still on disk
+        store.dicts.append(self)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self._store.pickling_core:
+            # the values are written to the shards
+            state['_unloaded'] = self._unloaded | \
+                (set(self._data) & self._store.on_disk)
+            state['_data'] = dict((key, value) for (key, value)
+                                  in self._data.iteritems()
+                                  if key not in self._store.on_disk)
+        return state
+
+    def _load(self, key):
+        if key in self._unloaded:
+            self._store.load(key)
+
+    def __getitem__(self, key):
+        self._load(key)
+        return self._data[key]
+
+    def __setitem__(self, key, value):
+        # load the other entries of the document before its shard is changed
+        self._load(key)
+        self._data[key] = value
+        self._store.dirty.add(key)
+
+    def __delitem__(self, key):
+        self._load(key)
+        del self._data[key]
+        self._store.dirty.add(key)
+
+    def __contains__(self, key):
+        return key in self._data or key in self._unloaded
+    has_key = __contains__
+
+    def __len__(self):
+        return len(self._data) + len(self._unloaded)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __eq__(self, other):
+        return dict(self.iteritems()) == dict(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def keys(self):
+        return list(self._data) + list(self._unloaded)
+    iterkeys = __iter__
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def pop(self, key, *default):
+        if key in self:
+            value = self[key]
+            del self[key]
+            return value
+        if default:
+            return default[0]
+        raise KeyError(key)
+
+    def setdefault(self, key, default=None):
+        if key in self:
+            return self[key]
+        self[key] = default
+        return default
+
+    def iteritems(self):
+        self._store.load_all()
+        return self._data.iteritems()
+
+    def items(self):
+        return list(self.iteritems())
+
+    def itervalues(self):
+        self._store.load_all()
+        return self._data.itervalues()
+
+    def values(self):
+        return list(self.itervalues())
+
+
+class DoctreeCache(object):
+    """
+    A least-recently-used cache of pickled doctrees, keyed by docname and the
+    mtime of the doctree file.  Besides the pickled data, the unpickled tree
+    is kept for callers that don't modify it.
+    """
+
+    def __init__(self):
+        self.entries = {}        # docname -> [mtime, pickled data, doctree]
+        self.order = []          # docnames, least recently used first
+        self.size = 0            # total size of the pickled data
+        self.hits = self.misses = 0
+
+    @staticmethod
+    def parse_limits(size):
+        """Return (maximum count, maximum size) for the value *size* of the
+        doctree_cache_size config value.  Raise ValueError if it is invalid.
+        """
+        if isinstance(size, basestring) and size.strip().upper().endswith('MB'):
+            maxsize = float(size.strip()[:-2])
+            if maxsize < 0:
+                raise ValueError('negative size: %r' % size)
+            return None, int(maxsize * 1024 * 1024)
+        try:
+            maxcount = int(size)
+        except TypeError:
+            raise ValueError('not a number: %r' % (size,))
+        if maxcount < 0:
+            raise ValueError('negative count: %r' % (size,))
+        return maxcount, None
+
+    def __getstate__(self):
+        # the cache is never pickled with the environment
+        return {}
+
+    def __setstate__(self, state):
+        self.__init__()
+
+    def get(self, docname, mtime):
+        entry = self.entries.get(docname)
+        if entry is None or entry[0] != mtime:
+            self.discard(docname)
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.order.remove(docname)
+        self.order.append(docname)
+        return entry
+
+    def add(self, docname, mtime, data, maxcount, maxsize):
+        """Add the pickled *data* of a doctree, then evict least recently used
+        entries until at most *maxcount* entries or *maxsize* bytes are in
+        the cache (None means no limit).  Return the new entry.
+        """
+        self.discard(docname)
+        entry = self.entries[docname] = [mtime, data, None]
+        self.order.append(docname)
+        self.size += len(data)
+        while self.order and (
+            (maxcount is not None and len(self.order) > maxcount) or
+            (maxsize is not None and self.size > maxsize)):
+            self.discard(self.order[0])
+        return entry
+
+    def discard(self, docname):
+        entry = self.entries.pop(docname, None)
+        if entry is not None:
+            self.order.remove(docname)
+            self.size -= len(entry[1])
+
+
 class BuildEnvironment:
     """
     The environment in which the ReST files are translated.
@@ -286,7 +537,10 @@ class BuildEnvironment:
         env.config.values = config.values
         return env
 
-    def topickle(self, filename):
+    def topickle(self, filename, sharded=True):
+        """Pickle the environment to *filename*.  If *sharded* is true, the
+        per-document inventories are written to the document shards instead.
+        """
         # remove unpicklable attributes
         warnfunc = self._warnfunc
         self.set_warnfunc(None)
@@ -304,16 +558,35 @@ class BuildEnvironment:
                    isinstance(val, types.FunctionType) or \
                    isinstance(val, class_types):
                 del self.config[key]
+        if sharded:
+            # the references pickled to the doctree dir are those to compare
+            # with from now on (not those of a copy in the output dir)
+            self._saved_references = {}
+            self._shards.flush()
+            self._shards.pickling_core = True
+        else:
+            self._shards.load_all()
         try:
             pickle.dump(self, picklefile, pickle.HIGHEST_PROTOCOL)
         finally:
             picklefile.close()
+            self._shards.pickling_core = False
         movefile(filename + '.tmp', filename)
         # reset attributes
         self.domains = domains
         self.config.values = values
         self.set_warnfunc(warnfunc)
 
+    def __getstate__(self):
+        # the resolved global toctrees are only valid during one build
+        state = self.__dict__.copy()
+        del state['_global_toctrees']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._global_toctrees = {}
+
     # --------- ENVIRONMENT INITIALIZATION -------------------------------------
 
     def __init__(self, srcdir, doctreedir, config):
@@ -353,16 +626,30 @@ class BuildEnvironment:
                                     # names, relative to documentation root
         self.reread_always = set()  # docnames to re-read unconditionally on
                                     # next build
+        self.doc_digests = {}       # docname -> dict of file name -> content
+                                    # digest at the time of reading (only with
+                                    # source_digests)
+        self.file_digests = {}      # file name -> (mtime, size, digest) of
+                                    # the last computed digest
+
+        # the following per-document inventories are stored in one shard
+        # per document, which is only loaded when needed
+        self._shards = DocShardStore(self)
 
         # File metadata
-        self.metadata = {}          # docname -> dict of metadata items
+        self.metadata = LazyDocDict('metadata', self._shards)
+                                    # docname -> dict of metadata items
 
         # TOC inventory
-        self.titles = {}            # docname -> title node
-        self.longtitles = {}        # docname -> title node; only different if
+        self.titles = LazyDocDict('titles', self._shards)
+                                    # docname -> title node
+        self.longtitles = LazyDocDict('longtitles', self._shards)
+                                    # docname -> title node; only different if
                                     # set differently with title directive
-        self.tocs = {}              # docname -> table of contents nodetree
-        self.toc_num_entries = {}   # docname -> number of real entries
+        self.tocs = LazyDocDict('tocs', self._shards)
+                                    # docname -> table of contents nodetree
+        self.toc_num_entries = LazyDocDict('toc_num_entries', self._shards)
+                                    # docname -> number of real entries
         # used to determine when to show the TOC
         # in a sidebar (don't show if it's only one item)
         self.toc_secnumbers = {}    # docname -> dict of sectionid -> number
@@ -378,7 +665,8 @@ class BuildEnvironment:
 
         # Other inventories
         self.citations = {}         # citation name -> docname, labelid
-        self.indexentries = {}      # docname -> list of
+        self.indexentries = LazyDocDict('indexentries', self._shards)
+                                    # docname -> list of
                                     # (type, string, target, aliasname)
         self.versionchanges = {}    # version -> list of (type, docname,
                                     # lineno, module, descname, content)
@@ -390,6 +678,26 @@ class BuildEnvironment:
         # temporary data storage while reading a document
         self.temp_data = {}
 
+        # recently used doctrees
+        self.doctree_cache = DoctreeCache()
+
+        # (builder, maxdepth, titles_only, includehidden) -> resolved entries
+        # of the global toctree, see get_toctree_for
+        self._global_toctrees = {}
+
+        # fine-grained reference graph, used to rewrite only the documents
+        # that refer to a document whose titles or targets changed
+        self.referrers = {}         # docname -> set of docnames with resolved
+                                    # references to it
+        self.references = {}        # docname -> set of docnames it refers to
+        self.unresolved_refs = set() # docnames with unresolved references
+        self.target_signatures = {} # docname -> digest of its referable
+                                    # titles and targets
+        self.changed_targets = set() # docnames whose signature changed during
+                                    # the current update
+        self._saved_references = {} # docname -> (references, unresolved) as
+                                    # last pickled, for changed docnames
+
     def set_warnfunc(self, func):
         self._warnfunc = func
         self.settings['warning_stream'] = WarningStream(func)
@@ -420,15 +728,14 @@ class BuildEnvironment:
         if docname in self.all_docs:
             self.all_docs.pop(docname, None)
             self.reread_always.discard(docname)
-            self.metadata.pop(docname, None)
+            self.doctree_cache.discard(docname)
+            # metadata, titles, longtitles, tocs, toc_num_entries and
+            # indexentries
+            self._shards.discard(docname)
             self.dependencies.pop(docname, None)
-            self.titles.pop(docname, None)
-            self.longtitles.pop(docname, None)
-            self.tocs.pop(docname, None)
+            self.doc_digests.pop(docname, None)
             self.toc_secnumbers.pop(docname, None)
-            self.toc_num_entries.pop(docname, None)
             self.toctree_includes.pop(docname, None)
-            self.indexentries.pop(docname, None)
             self.glob_toctrees.discard(docname)
             self.numbered_toctrees.discard(docname)
             self.images.purge_doc(docname)
@@ -507,6 +814,7 @@ class BuildEnvironment:
 
         added = set()
         changed = set()
+        use_digests = self.config.source_digests
 
         if config_changed:
             # config values affect e.g. substitutions
@@ -521,14 +829,22 @@ class BuildEnvironment:
                                                  '.doctree')):
                     changed.add(docname)
                     continue
+                # same if its shard is missing
+                if docname in self._shards.on_disk and \
+                       not path.isfile(self._shards.filename(docname)):
+                    changed.add(docname)
+                    continue
                 # check the "reread always" list
                 if docname in self.reread_always:
                     changed.add(docname)
                     continue
-                # check the mtime of the document
+                # check the mtime of the document; if digests are used, a
+                # newer file is only outdated if its contents changed
                 mtime = self.all_docs[docname]
+                digests = use_digests and self.doc_digests.get(docname)
                 newmtime = path.getmtime(self.doc2path(docname))
-                if newmtime > mtime:
+                if newmtime > mtime and not self._digest_matches(
+                        self.doc2path(docname, None), digests):
                     changed.add(docname)
                     continue
                 # finally, check the mtime of dependencies
@@ -540,16 +856,165 @@ class BuildEnvironment:
                             changed.add(docname)
                             break
                         depmtime = path.getmtime(deppath)
-                        if depmtime > mtime:
+                        if depmtime > mtime and \
+                               not self._digest_matches(dep, digests):
                             changed.add(docname)
                             break
                     except EnvironmentError:
                         # give it another chance
                         changed.add(docname)
                         break
+                else:
+                    if use_digests and docname not in self.doc_digests:
+                        # digests were enabled after this document was read
+                        self.note_digests(docname)
 
         return added, changed, removed
 
+    def get_file_digest(self, filename):
+        """Return the content digest of *filename*, given relative to the
+        source directory or absolute.
+
+        The digest is only computed again if the mtime or size of the file
+        changed since it was last computed.
+        """
+        st = os.stat(path.join(self.srcdir, filename))
+        cached = self.file_digests.get(filename)
+        if cached and cached[:2] == (st.st_mtime, st.st_size):
+            return cached[2]
+        hasher = md5()
+        f = open(path.join(self.srcdir, filename), 'rb')
+        try:
+            while True:
+                data = f.read(65536)
+                if not data:
+                    break
+                hasher.update(data)
+        finally:
+            f.close()
+        digest = hasher.hexdigest()
+        self.file_digests[filename] = (st.st_mtime, st.st_size, digest)
+        return digest
+
+    def note_digests(self, docname):
+        """Record the content digests of the source file of *docname* and
+        its dependencies.
+        """
+        digests = {}
+        for filename in [self.doc2path(docname, None)] + \
+                sorted(self.dependencies.get(docname, ())):
+            try:
+                digests[filename] = self.get_file_digest(filename)
+            except EnvironmentError:
+                # a missing file never matches, so the document is re-read
+                pass
+        self.doc_digests[docname] = digests
+
+    def get_target_signature(self, docname):
+        """Return a digest of everything in *docname* that other documents
+        can refer to: its title, citations and domain objects.
+        """
+        parts = []
+        if docname in self.titles:
+            parts.append(self.titles[docname].astext())
+        parts.append(sorted((key, data) for (key, data)
+                            in self.citations.iteritems()
+                            if data[0] == docname))
+        for domainname in sorted(self.domaindata):
+            for key, data in sorted(self.domaindata[domainname].iteritems()):
+                if isinstance(data, DocIndexedDict):
+                    parts.append((domainname, key,
+                                  sorted((name, data[name]) for name
+                                         in data.keys_for(docname))))
+        return md5(repr(parts)).hexdigest()
+
+    def note_target_signature(self, docname):
+        """Record the target signature of *docname* and remember the
+        document as changed if it differs from the last one.
+        """
+        signature = self.get_target_signature(docname)
+        if self.target_signatures.get(docname) != signature:
+            self.target_signatures[docname] = signature
+            self.changed_targets.add(docname)
+
+    def note_reference(self, fromdocname, todocname):
+        """Note that *fromdocname* contains a resolved reference into
+        *todocname*.
+        """
+        if fromdocname == todocname:
+            return
+        todocs = self.references.setdefault(fromdocname, set())
+        if todocname not in todocs:
+            self._save_references(fromdocname)
+            todocs.add(todocname)
+            self.referrers.setdefault(todocname, set()).add(fromdocname)
+
+    def note_unresolved_reference(self, fromdocname):
+        """Note that *fromdocname* contains an unresolved reference."""
+        if fromdocname not in self.unresolved_refs:
+            self._save_references(fromdocname)
+            self.unresolved_refs.add(fromdocname)
+
+    def clear_references(self, fromdocname):
+        """Forget the references noted for *fromdocname*, before it is
+        resolved again.
+        """
+        self._save_references(fromdocname)
+        for todocname in self.references.pop(fromdocname, ()):
+            fromdocs = self.referrers.get(todocname)
+            if fromdocs is not None:
+                fromdocs.discard(fromdocname)
+                if not fromdocs:
+                    del self.referrers[todocname]
+        self.unresolved_refs.discard(fromdocname)
+
+    def _save_references(self, docname):
+        # remember the references as they were pickled the last time, before
+        # they are changed for the first time
+        if docname not in self._saved_references:
+            self._saved_references[docname] = (
+                self.references.get(docname, set()).copy(),
+                docname in self.unresolved_refs)
+
+    def references_changed(self):
+        """Return true if the references noted for any document differ from
+        those in the last pickled environment.
+        """
+        for docname, (todocnames, unresolved) in \
+                self._saved_references.iteritems():
+            if self.references.get(docname, set()) != todocnames or \
+                   (docname in self.unresolved_refs) != unresolved:
+                return True
+        return False
+
+    def get_references(self, docnames):
+        """Return the references noted for *docnames*, to be given to
+        :meth:`merge_references` of another environment.
+        """
+        return dict((docname, (self.references.get(docname, set()),
+                               docname in self.unresolved_refs))
+                    for docname in docnames)
+
+    def merge_references(self, docnames, references):
+        """Replace the references noted for *docnames* by *references*, as
+        returned by :meth:`get_references`.
+        """
+        for docname in docnames:
+            self.clear_references(docname)
+            todocnames, unresolved = references[docname]
+            for todocname in todocnames:
+                self.note_reference(docname, todocname)
+            if unresolved:
+                self.note_unresolved_reference(docname)
+
+    def _digest_matches(self, filename, digests):
+        if not digests or filename not in digests:
+            return False
+        try:
+            return self.get_file_digest(filename) == digests[filename]
+        except EnvironmentError:
+            return False
+
     def update(self, config, srcdir, doctreedir, app=None):
         """(Re-)read all files new or changed since last update.
 
@@ -558,6 +1023,8 @@ class BuildEnvironment:
         environment docnames in the canonical format (ie using SEP as a
         separator in place of os.path.sep).
         """
+        self._global_toctrees.clear()
+        self.changed_targets = set()
         config_changed = False
         if self.config is None:
             msg = '[new config] '
@@ -582,10 +1049,12 @@ class BuildEnvironment:
         # the source and doctree directories may have been relocated
         self.srcdir = srcdir
         self.doctreedir = doctreedir
-        self.find_files(config)
+        profiler = app and app.profiler or null_profiler
+        profiler.call('find files', self.find_files, config)
         self.config = config
 
-        added, changed, removed = self.get_outdated_files(config_changed)
+        added, changed, removed = profiler.call(
+            'get outdated files', self.get_outdated_files, config_changed)
 
         # allow user intervention as well
         for docs in app.emit('env-get-outdated', self, added, changed, removed):
@@ -608,11 +1077,18 @@ class BuildEnvironment:
                 if app:
                     app.emit('env-purge-doc', self, docname)
                 self.clear_doc(docname)
+                self.target_signatures.pop(docname, None)
+                self.changed_targets.add(docname)
 
             # read all new and changed files
-            for docname in sorted(added | changed):
+            docnames = sorted(added | changed)
+            if app and app.parallel > 1 and parallel_available and \
+                   len(docnames) > 5 and app.is_parallel_allowed('read'):
+                reader = self._read_parallel(docnames, app, app.parallel)
+            else:
+                reader = self._read_serial(docnames, app)
+            for docname in reader:
                 yield docname
-                self.read_doc(docname, app=app)
 
             if config.master_doc not in self.all_docs:
                 self.warn(None, 'master file %s not found' %
@@ -624,10 +1100,135 @@ class BuildEnvironment:
 
         return msg, len(added | changed), update_generator()
 
+    def _read_serial(self, docnames, app):
+        for docname in docnames:
+            yield docname
+            self._read_doc_profiled(docname, app)
+
+    def _read_doc_profiled(self, docname, app):
+        profiler = app and app.profiler or null_profiler
+        profiler.start('read', docname)
+        try:
+            self.read_doc(docname, app=app)
+        finally:
+            profiler.stop()
+
+    def _read_parallel(self, docnames, app, nproc):
+        """Read *docnames* in *nproc* forked worker processes and merge the
+        inventories they collected; yields docnames as they are merged.
+        """
+        # clear all outdated docs at once
+        for docname in docnames:
+            app.emit('env-purge-doc', self, docname)
+            self.clear_doc(docname)
+
+        def read_process(docs):
+            warnings = []
+            self.app = app
+            self.set_warnfunc(lambda *args: warnings.append(args))
+            # only send back the times of this worker
+            app.profiler = app.profiler.fork()
+            for docname in docs:
+                self._read_doc_profiled(docname, app)
+            # remove unpicklable attributes to send the environment back
+            self.set_warnfunc(None)
+            self.app = None
+            self.domains = None
+            self.config = None
+            return warnings, self, app.profiler
+
+        merged = []
+        reread = set()
+        def merge(docs, result):
+            warnings, other, profiler = result
+            app.profiler.merge(profiler)
+            for warning in warnings:
+                self._warnfunc(*warning)
+            reread.update(self.merge_info_from(docs, other, app))
+            merged.extend(docs)
+
+        tasks = ParallelTasks(nproc)
+        for chunk in make_chunks(docnames, nproc):
+            tasks.add_task(read_process, chunk,
+                           lambda result, chunk=chunk: merge(chunk, result))
+            for docname in merged:
+                yield docname
+            del merged[:]
+        tasks.join()
+        for docname in merged:
+            yield docname
+
+        # documents whose download file names clashed with those of another
+        # worker must be read again to get the final names into the doctree
+        for docname in sorted(reread):
+            self._read_doc_profiled(docname, app)
+
+    def merge_info_from(self, docnames, other, app):
+        """Merge the inventories for *docnames* from *other*, an environment
+        that was used to read them in a worker process.
+
+        Return the set of docnames that need to be read again.
+        """
+        docnames = set(docnames)
+        for docname in docnames:
+            self.all_docs[docname] = other.all_docs[docname]
+            if docname in other.reread_always:
+                self.reread_always.add(docname)
+            self.metadata[docname] = other.metadata[docname]
+            if docname in other.dependencies:
+                self.dependencies[docname] = other.dependencies[docname]
+            if docname in other.doc_digests:
+                self.doc_digests[docname] = other.doc_digests[docname]
+                for filename in other.doc_digests[docname]:
+                    self.file_digests[filename] = other.file_digests[filename]
+            self.titles[docname] = other.titles[docname]
+            self.longtitles[docname] = other.longtitles[docname]
+            self.tocs[docname] = other.tocs[docname]
+            self.toc_num_entries[docname] = other.toc_num_entries[docname]
+            # toc_secnumbers is not assigned during reading
+            if docname in other.toctree_includes:
+                self.toctree_includes[docname] = \
+                    other.toctree_includes[docname]
+            self.indexentries[docname] = other.indexentries[docname]
+            if docname in other.glob_toctrees:
+                self.glob_toctrees.add(docname)
+            if docname in other.numbered_toctrees:
+                self.numbered_toctrees.add(docname)
+            self.target_signatures[docname] = \
+                other.target_signatures[docname]
+        self.changed_targets.update(other.changed_targets & docnames)
+
+        self.images.merge_other(docnames, other.images)
+        reread = self.dlfiles.merge_other(docnames, other.dlfiles)
+
+        for subfn, fnset in other.files_to_rebuild.iteritems():
+            fnset = fnset & docnames
+            if fnset:
+                self.files_to_rebuild.setdefault(subfn, set()).update(fnset)
+        for key, data in other.citations.iteritems():
+            if data[0] in docnames:
+                self.citations[key] = data
+        for version, changes in other.versionchanges.iteritems():
+            self.versionchanges.setdefault(version, []).extend(
+                change for change in changes if change[1] in docnames)
+
+        for domainname, domain in self.domains.iteritems():
+            domain.merge_domaindata(docnames, other.domaindata[domainname])
+        app.emit('env-merge-info', self, docnames, other)
+        return reread
+
     def check_dependents(self, already):
         to_rewrite = self.assign_section_numbers()
+        if self.changed_targets:
+            # documents that refer to changed titles or targets, and those
+            # that may now resolve a reference they could not before
+            for docname in sorted(self.changed_targets):
+                to_rewrite.extend(sorted(self.referrers.get(docname, ())))
+            to_rewrite.extend(sorted(self.unresolved_refs))
+        seen = set(already)
         for docname in to_rewrite:
-            if docname not in already:
+            if docname not in seen and docname in self.all_docs:
+                seen.add(docname)
                 yield docname
 
     # --------- SINGLE FILE READING --------------------------------------------
@@ -758,25 +1359,29 @@ class BuildEnvironment:
         pub.process_programmatic_settings(None, self.settings, None)
         pub.set_source(None, src_path.encode(fs_encoding))
         pub.set_destination(None, None)
+        profiler = app and app.profiler or null_profiler
+        if profiler.enabled:
+            apply_transforms = pub.apply_transforms
+            pub.apply_transforms = lambda: profiler.call(
+                'read: transforms', apply_transforms)
         try:
-            pub.publish()
+            profiler.call('read: parse', pub.publish)
             doctree = pub.document
         except UnicodeError, err:
             raise SphinxError(str(err))
 
         # post-processing
-        self.filter_messages(doctree)
-        self.process_dependencies(docname, doctree)
-        self.process_images(docname, doctree)
-        self.process_downloads(docname, doctree)
-        self.process_metadata(docname, doctree)
-        self.process_refonly_bullet_lists(docname, doctree)
-        self.create_title_from(docname, doctree)
-        self.note_indexentries_from(docname, doctree)
-        self.note_citations_from(docname, doctree)
-        self.build_toc_from(docname, doctree)
+        profiler.call('read: filter_messages', self.filter_messages, doctree)
+        for process in (self.process_dependencies, self.process_images,
+                        self.process_downloads, self.process_metadata,
+                        self.process_refonly_bullet_lists,
+                        self.create_title_from, self.note_indexentries_from,
+                        self.note_citations_from, self.build_toc_from):
+            profiler.call('read: ' + process.__name__,
+                          process, docname, doctree)
         for domain in self.domains.itervalues():
-            domain.process_doc(self, docname, doctree)
+            profiler.call('read: domain %s' % domain.name,
+                          domain.process_doc, self, docname, doctree)
 
         # allow extension-specific post-processing
         if app:
@@ -784,6 +1389,9 @@ class BuildEnvironment:
 
         # store time of build, for outdated files detection
         self.all_docs[docname] = time.time()
+        if self.config.source_digests:
+            self.note_digests(docname)
+        self.note_target_signature(docname)
 
         if self.versioning_condition:
             # get old doctree
@@ -826,7 +1434,8 @@ class BuildEnvironment:
                 os.makedirs(dirname)
             f = open(doctree_filename, 'wb')
             try:
-                pickle.dump(doctree, f, pickle.HIGHEST_PROTOCOL)
+                profiler.call('read: pickle doctree', pickle.dump,
+                              doctree, f, pickle.HIGHEST_PROTOCOL)
             finally:
                 f.close()
         else:
@@ -1175,16 +1784,23 @@ class BuildEnvironment:
 
     def get_toctree_for(self, docname, builder, collapse, **kwds):
         """Return the global TOC nodetree."""
-        doctree = self.get_doctree(self.config.master_doc)
+        maxdepth = kwds.get('maxdepth', 0)
+        titles_only = kwds.get('titles_only', False)
+        includehidden = kwds.get('includehidden', True)
+        # the document-independent part is only resolved once per build
+        key = (builder.name, maxdepth, titles_only, includehidden)
+        if key not in self._global_toctrees:
+            doctree = self.get_doctree(self.config.master_doc, copy=False)
+            self._global_toctrees[key] = [
+                self._resolve_toctree_entries(self.config.master_doc, builder,
+                                              toctreenode, True, maxdepth,
+                                              titles_only, includehidden)
+                for toctreenode in doctree.traverse(addnodes.toctree)]
         toctrees = []
-        if 'includehidden' not in kwds:
-            kwds['includehidden'] = True
-        if 'maxdepth' not in kwds:
-            kwds['maxdepth'] = 0
-        kwds['collapse'] = collapse
-        for toctreenode in doctree.traverse(addnodes.toctree):
-            toctree = self.resolve_toctree(docname, builder, toctreenode,
-                                           prune=True, **kwds)
+        for toctree in self._global_toctrees[key]:
+            if toctree is not None:
+                toctree = toctree.deepcopy()
+                self._localize_toctree(docname, builder, toctree, collapse)
             toctrees.append(toctree)
         if not toctrees:
             return None
@@ -1205,14 +1821,34 @@ class BuildEnvironment:
 
     # --------- RESOLVING REFERENCES AND TOCTREES ------------------------------
 
-    def get_doctree(self, docname):
-        """Read the doctree for a file from the pickle and return it."""
+    def get_doctree(self, docname, copy=True):
+        """Read the doctree for a file from the pickle and return it.
+
+        Recently used doctrees are cached.  If *copy* is false, the cached
+        doctree itself can be returned; the caller must not modify it then.
+        """
         doctree_filename = self.doc2path(docname, self.doctreedir, '.doctree')
-        f = open(doctree_filename, 'rb')
-        try:
-            doctree = pickle.load(f)
-        finally:
-            f.close()
+        mtime = path.getmtime(doctree_filename)
+        entry = self.doctree_cache.get(docname, mtime)
+        if entry is None:
+            f = open(doctree_filename, 'rb')
+            try:
+                data = f.read()
+            finally:
+                f.close()
+            maxcount, maxsize = DoctreeCache.parse_limits(
+                self.config.doctree_cache_size)
+            if maxcount == 0 or maxsize == 0:
+                entry = [mtime, data, None]
+            else:
+                entry = self.doctree_cache.add(docname, mtime, data,
+                                               maxcount, maxsize)
+        if copy:
+            doctree = pickle.loads(entry[1])
+        else:
+            if entry[2] is None:
+                entry[2] = pickle.loads(entry[1])
+            doctree = entry[2]
         doctree.settings.env = self
         doctree.reporter = Reporter(self.doc2path(docname), 2, 5,
                                     stream=WarningStream(self._warnfunc))
@@ -1228,12 +1864,15 @@ class BuildEnvironment:
             doctree = self.get_doctree(docname)
 
         # resolve all pending cross-references
-        self.resolve_references(doctree, docname, builder)
+        profiler = builder.app.profiler
+        profiler.call('resolve references', self.resolve_references,
+                      doctree, docname, builder)
 
         # now, resolve all toctree nodes
         for toctreenode in doctree.traverse(addnodes.toctree):
-            result = self.resolve_toctree(docname, builder, toctreenode,
-                                          prune=prune_toctrees)
+            result = profiler.call('resolve toctree', self.resolve_toctree,
+                                   docname, builder, toctreenode,
+                                   prune=prune_toctrees)
             if result is None:
                 toctreenode.replace_self([])
             else:
@@ -1254,6 +1893,20 @@ class BuildEnvironment:
         If *collapse* is True, all branches not containing docname will
         be collapsed.
         """
+        newnode = self._resolve_toctree_entries(docname, builder, toctree,
+                                                prune, maxdepth, titles_only,
+                                                includehidden)
+        if newnode is not None:
+            self._localize_toctree(docname, builder, newnode, collapse)
+        return newnode
+
+    def _resolve_toctree_entries(self, docname, builder, toctree, prune,
+                                 maxdepth, titles_only, includehidden):
+        """Resolve the part of :meth:`resolve_toctree` that does not depend
+        on the document the toctree is shown in: collect the entries, prune
+        them to *maxdepth* and set the level classes.  *docname* is only
+        used for warnings.
+        """
         if toctree.get('hidden', False) and not includehidden:
             return None
 
@@ -1283,38 +1936,11 @@ class BuildEnvironment:
                     _walk_depth(subnode, depth, maxdepth)
 
                 elif isinstance(subnode, nodes.bullet_list):
-                    # for <ul>, determine if the depth is too large or if the
-                    # entry is to be collapsed
+                    # for <ul>, determine if the depth is too large
                     if maxdepth > 0 and depth > maxdepth:
                         subnode.parent.replace(subnode, [])
                     else:
-                        # to find out what to collapse, *first* walk subitems,
-                        # since that determines which children point to the
-                        # current page
                         _walk_depth(subnode, depth+1, maxdepth)
-                        # cull sub-entries whose parents aren't 'current'
-                        if (collapse and depth > 1 and
-                            'iscurrent' not in subnode.parent):
-                            subnode.parent.remove(subnode)
-
-                elif isinstance(subnode, nodes.reference):
-                    # for <a>, identify which entries point to the current
-                    # document and therefore may not be collapsed
-                    if subnode['refuri'] == docname:
-                        if not subnode['anchorname']:
-                            # give the whole branch a 'current' class
-                            # (useful for styling it differently)
-                            branchnode = subnode
-                            while branchnode:
-                                branchnode['classes'].append('current')
-                                branchnode = branchnode.parent
-                        # mark the list_item as "on current page"
-                        if subnode.parent.parent.get('iscurrent'):
-                            # but only if it's not already done
-                            return
-                        while subnode:
-                            subnode['iscurrent'] = True
-                            subnode = subnode.parent
 
         def _entries_from_toctree(toctreenode, separate=False, subtree=False):
             """Return TOC entries for a toctree node."""
@@ -1408,16 +2034,61 @@ class BuildEnvironment:
 
         # prune the tree to maxdepth and replace titles, also set level classes
         _walk_depth(newnode, 1, prune and maxdepth or 0)
+        return newnode
+
+    def _localize_toctree(self, docname, builder, newnode, collapse):
+        """Mark the entries of a toctree returned by
+        :meth:`_resolve_toctree_entries` that point to *docname*, collapse
+        the others if *collapse* is true and make all URIs relative to
+        *docname*.
+        """
+        def _walk_depth(node, depth):
+            for subnode in node.children[:]:
+                if isinstance(subnode, (addnodes.compact_paragraph,
+                                        nodes.list_item)):
+                    _walk_depth(subnode, depth)
+
+                elif isinstance(subnode, nodes.bullet_list):
+                    # to find out what to collapse, *first* walk subitems,
+                    # since that determines which children point to the
+                    # current page
+                    _walk_depth(subnode, depth+1)
+                    # cull sub-entries whose parents aren't 'current'
+                    if (collapse and depth > 1 and
+                        'iscurrent' not in subnode.parent):
+                        subnode.parent.remove(subnode)
+
+                elif isinstance(subnode, nodes.reference):
+                    # for <a>, identify which entries point to the current
+                    # document and therefore may not be collapsed
+                    if subnode['refuri'] == docname:
+                        if not subnode['anchorname']:
+                            # give the whole branch a 'current' class
+                            # (useful for styling it differently)
+                            branchnode = subnode
+                            while branchnode:
+                                branchnode['classes'].append('current')
+                                branchnode = branchnode.parent
+                        # mark the list_item as "on current page"
+                        if subnode.parent.parent.get('iscurrent'):
+                            # but only if it's not already done
+                            return
+                        while subnode:
+                            subnode['iscurrent'] = True
+                            subnode = subnode.parent
+
+        _walk_depth(newnode, 1)
 
         # set the target paths in the toctrees (they are not known at TOC
         # generation time)
         for refnode in newnode.traverse(nodes.reference):
             if not url_re.match(refnode['refuri']):
+                self.note_reference(docname, refnode['refuri'])
                 refnode['refuri'] = builder.get_relative_uri(
                     docname, refnode['refuri']) + refnode['anchorname']
-        return newnode
 
     def resolve_references(self, doctree, fromdocname, builder):
+        self.clear_references(fromdocname)
         for node in doctree.traverse(addnodes.pending_xref):
             contnode = node[0].deepcopy()
             newnode = None
@@ -1452,6 +2123,7 @@ class BuildEnvironment:
                         newnode['refuri'] = builder.get_relative_uri(
                             fromdocname, docname)
                         newnode.append(innernode)
+                        self.note_reference(fromdocname, docname)
                 elif typ == 'citation':
                     docname, labelid = self.citations.get(target, ('', ''))
                     if docname:
@@ -1463,6 +2135,7 @@ class BuildEnvironment:
                         'missing-reference', self, node, contnode)
                     # still not found? warn if in nit-picky mode
                     if newnode is None:
+                        self.note_unresolved_reference(fromdocname)
                         self._warn_missing_reference(
                             fromdocname, typ, target, node, domain)
             except NoUri:
@@ -1517,6 +2190,8 @@ class BuildEnvironment:
 
     def assign_section_numbers(self):
         """Assign a section number to each heading under a numbered toctree."""
+        # the numbers are part of the global toctree
+        self._global_toctrees.clear()
         # a list of all docnames whose section numbers changed
         rewrite_needed = []
 
@@ -1568,9 +2243,11 @@ class BuildEnvironment:
                               self.titles.get(ref))
                     if secnums != old_secnumbers.get(ref):
                         rewrite_needed.append(ref)
+                        # the section numbers are stored in the toc too
+                        self._shards.dirty.add(ref)
 
         for docname in self.numbered_toctrees:
-            doctree = self.get_doctree(docname)
+            doctree = self.get_doctree(docname, copy=False)
             for toctreenode in doctree.traverse(addnodes.toctree):
                 depth = toctreenode.get('numbered', 0)
                 if depth:
@@ -56,6 +56,19 @@ class VersionRequirementError(SphinxError):
     category = 'Sphinx version error'
 
 
+class SphinxParallelError(SphinxError):
+    """Raised if a worker process of a parallel build fails."""
+    category = 'Sphinx parallel build error'
+
+    def __init__(self, message, traceback):
+        SphinxError.__init__(self, message)
+        self.traceback = traceback
+
+    def __str__(self):
+        return '%s\n\n[worker traceback follows]\n%s' % (
+            SphinxError.__str__(self), self.traceback.rstrip())
+
+
 class PycodeError(Exception):
     def __str__(self):
         res = self.args[0]
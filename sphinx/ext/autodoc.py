@@ -1348,3 +1348,4 @@ def setup(app):
     app.add_event('autodoc-process-docstring')
     app.add_event('autodoc-process-signature')
     app.add_event('autodoc-skip-member')
+    return {'parallel_read_safe': True, 'parallel_write_safe': True}
@@ -490,3 +490,4 @@ def setup(app):
     app.connect('doctree-read', process_autosummary_toc)
     app.connect('builder-inited', process_generate_options)
     app.add_config_value('autosummary_generate', [], True)
+    return {'parallel_read_safe': True, 'parallel_write_safe': True}
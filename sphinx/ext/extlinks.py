@@ -57,3 +57,4 @@ def setup_link_roles(app):
 def setup(app):
     app.add_config_value('extlinks', {}, 'env')
     app.connect('builder-inited', setup_link_roles)
+    return {'parallel_read_safe': True, 'parallel_write_safe': True}
@@ -71,3 +71,4 @@ def setup(app):
     app.add_node(ifconfig)
     app.add_directive('ifconfig', IfConfig)
     app.connect('doctree-resolved', process_ifconfig_nodes)
+    return {'parallel_read_safe': True, 'parallel_write_safe': True}
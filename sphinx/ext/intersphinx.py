@@ -241,3 +241,4 @@ def setup(app):
     app.add_config_value('intersphinx_cache_limit', 5, False)
     app.connect('missing-reference', missing_reference)
     app.connect('builder-inited', load_mappings)
+    return {'parallel_read_safe': True, 'parallel_write_safe': True}
@@ -56,3 +56,4 @@ def setup(app):
     mathbase_setup(app, (html_visit_math, None), (html_visit_displaymath, None))
     app.add_config_value('jsmath_path', '', False)
     app.connect('builder-inited', builder_inited)
+    return {'parallel_read_safe': True, 'parallel_write_safe': True}
@@ -9,6 +9,7 @@
     :license: BSD, see LICENSE for details.
 """
 
+import os
 import re
 import codecs
 import shutil
@@ -91,13 +92,16 @@ def render_math(self, math):
     latex = DOC_HEAD + self.builder.config.pngmath_latex_preamble
     latex += (use_preview and DOC_BODY_PREVIEW or DOC_BODY) % math
 
-    # use only one tempdir per build -- the use of a directory is cleaner
-    # than using temporary files, since we can clean up everything at once
-    # just removing the whole directory (see cleanup_tempdir)
+    # use only one tempdir per build and process -- the use of a directory
+    # is cleaner than using temporary files, since we can clean up everything
+    # at once just removing the whole directory (see cleanup_tempdir); worker
+    # processes writing in parallel must not share it
     if not hasattr(self.builder, '_mathpng_tempdir'):
-        tempdir = self.builder._mathpng_tempdir = tempfile.mkdtemp()
-    else:
-        tempdir = self.builder._mathpng_tempdir
+        self.builder._mathpng_tempdir = {}
+    tempdirs = self.builder._mathpng_tempdir
+    tempdir = tempdirs.get(os.getpid())
+    if tempdir is None:
+        tempdir = tempdirs[os.getpid()] = tempfile.mkdtemp()
 
     tf = codecs.open(path.join(tempdir, 'math.tex'), 'w', 'utf-8')
     tf.write(latex)
@@ -168,15 +172,19 @@ def render_math(self, math):
 
     return relfn, depth
 
-def cleanup_tempdir(app, exc):
+def cleanup_tempdir(app, exc=None):
     if exc:
         return
-    if not hasattr(app.builder, '_mathpng_tempdir'):
+    tempdirs = getattr(app.builder, '_mathpng_tempdir', {})
+    if os.getpid() not in tempdirs:
         return
     try:
-        shutil.rmtree(app.builder._mathpng_tempdir)
+        shutil.rmtree(tempdirs.pop(os.getpid()))
     except Exception:
         pass
+    # the builder is used again for the next build in watch mode
+    if not tempdirs:
+        del app.builder._mathpng_tempdir
 
 def get_tooltip(self, node):
     if self.builder.config.pngmath_add_tooltips:
@@ -242,3 +250,5 @@ def setup(app):
     app.add_config_value('pngmath_latex_preamble', '', 'html')
     app.add_config_value('pngmath_add_tooltips', True, 'html')
     app.connect('build-finished', cleanup_tempdir)
+    app.connect('write-worker-finished', cleanup_tempdir)
+    return {'parallel_read_safe': True, 'parallel_write_safe': True}
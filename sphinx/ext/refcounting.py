@@ -98,3 +98,4 @@ def setup(app):
     app.add_node(refcount)
     app.add_config_value('refcount_file', '', True)
     app.connect('builder-inited', init_refcounts)
+    return {'parallel_read_safe': True, 'parallel_write_safe': True}
@@ -72,6 +72,21 @@ def doctree_read(app, doctree):
             signode += onlynode
 
 
+def env_merge_info(app, env, docnames, other):
+    if not hasattr(other, '_viewcode_modules'):
+        return
+    if not hasattr(env, '_viewcode_modules'):
+        env._viewcode_modules = {}
+    for modname, entry in other._viewcode_modules.iteritems():
+        if modname not in env._viewcode_modules:
+            env._viewcode_modules[modname] = entry
+        elif entry and env._viewcode_modules[modname]:
+            used = env._viewcode_modules[modname][2]
+            for fullname, docname in entry[2].iteritems():
+                if docname in docnames:
+                    used[fullname] = docname
+
+
 def missing_reference(app, env, node, contnode):
     # resolve our "viewcode" reference nodes -- they need special treatment
     if node['reftype'] == 'viewcode':
@@ -171,7 +186,9 @@ def collect_pages(app):
 
 def setup(app):
     app.connect('doctree-read', doctree_read)
+    app.connect('env-merge-info', env_merge_info)
     app.connect('html-collect-pages', collect_pages)
     app.connect('missing-reference', missing_reference)
     #app.add_config_value('viewcode_include_modules', [], 'env')
     #app.add_config_value('viewcode_exclude_modules', [], 'env')
+    return {'parallel_read_safe': True, 'parallel_write_safe': True}
@@ -9,16 +9,20 @@
     :license: BSD, see LICENSE for details.
 """
 
+import os
 from os import path
 from pprint import pformat
 
+import jinja2
 from jinja2 import FileSystemLoader, BaseLoader, TemplateNotFound, \
-     contextfunction
+     TemplateSyntaxError, contextfunction, meta
+from jinja2.bccache import FileSystemBytecodeCache
 from jinja2.utils import open_if_exists
 from jinja2.sandbox import SandboxedEnvironment
 
+from sphinx import __version__
 from sphinx.application import TemplateBridge
-from sphinx.util.osutil import mtimes_of_files
+from sphinx.util.osutil import ensuredir, movefile
 
 
 def _tobool(val):
@@ -78,6 +82,98 @@ class SphinxFileSystemLoader(FileSystemLoader):
         raise TemplateNotFound(template)
 
 
+class SphinxBytecodeCache(FileSystemBytecodeCache):
+    """
+    Stores compiled templates in *directory*, so that templates need not be
+    compiled again in the next build.
+
+    The cache key is derived from the template name and file name; cached
+    code is only used if the template source, the Sphinx and Jinja versions
+    and the enabled Jinja extensions are unchanged.  The number of cache
+    hits and misses is counted in the :attr:`hits` and :attr:`misses`
+    attributes.
+    """
+
+    def __init__(self, directory, extensions=()):
+        FileSystemBytecodeCache.__init__(self, directory, '%s.cache')
+        self.salt = '|'.join([__version__, jinja2.__version__] +
+                             sorted(extensions))
+        self.hits = 0
+        self.misses = 0
+
+    def get_source_checksum(self, source):
+        return FileSystemBytecodeCache.get_source_checksum(
+            self, self.salt + '|' + source)
+
+    def load_bytecode(self, bucket):
+        try:
+            FileSystemBytecodeCache.load_bytecode(self, bucket)
+        except Exception:
+            # a damaged cache file: compile the template again
+            bucket.reset()
+        if bucket.code is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+    def dump_bytecode(self, bucket):
+        # write to a temporary file first, so that other processes never see
+        # a partially written file
+        filename = self._get_cache_filename(bucket)
+        tempname = '%s.%d' % (filename, os.getpid())
+        try:
+            ensuredir(self.directory)
+            f = open(tempname, 'wb')
+            try:
+                bucket.write_bytecode(f)
+            finally:
+                f.close()
+            movefile(tempname, filename)
+        except EnvironmentError:
+            # not being able to cache a template is no reason to fail
+            pass
+
+    def clear(self):
+        if path.isdir(self.directory):
+            FileSystemBytecodeCache.clear(self)
+
+
+class SphinxEnvironment(SandboxedEnvironment):
+    """
+    Sandboxed environment that records the file names of all templates
+    loaded through it, including extended, included and imported ones.
+    """
+
+    def __init__(self, *args, **kwds):
+        SandboxedEnvironment.__init__(self, *args, **kwds)
+        self.loaded = set()
+        # template file name -> names of the variables it refers to
+        self.variables = {}
+
+    def get_template(self, name, parent=None, globals=None):
+        template = SandboxedEnvironment.get_template(self, name, parent,
+                                                     globals)
+        if template.filename:
+            self.loaded.add(path.abspath(template.filename))
+        return template
+
+    def get_variables(self, filename):
+        """Return the set of the names of the context variables the template
+        in *filename* refers to, or None if it cannot be parsed.
+        """
+        if filename not in self.variables:
+            try:
+                f = open(filename, 'rb')
+                try:
+                    source = f.read().decode('utf-8')
+                finally:
+                    f.close()
+                names = meta.find_undeclared_variables(self.parse(source))
+            except (EnvironmentError, UnicodeError, TemplateSyntaxError):
+                names = None
+            self.variables[filename] = names
+        return self.variables[filename]
+
 
 class BuiltinTemplateLoader(TemplateBridge, BaseLoader):
     """
@@ -106,14 +202,19 @@ class BuiltinTemplateLoader(TemplateBridge, BaseLoader):
 
         # store it for use in newest_template_mtime
         self.pathchain = chain
+        self.ignored_dirs = set([path.abspath(builder.outdir),
+                                 path.abspath(builder.doctreedir)])
 
         # make the paths into loaders
         self.loaders = map(SphinxFileSystemLoader, chain)
 
         use_i18n = builder.app.translator is not None
         extensions = use_i18n and ['jinja2.ext.i18n'] or []
-        self.environment = SandboxedEnvironment(loader=self,
-                                                extensions=extensions)
+        self.bytecode_cache = SphinxBytecodeCache(
+            path.join(builder.doctreedir, '.templatecache'), extensions)
+        self.environment = SphinxEnvironment(
+            loader=self, extensions=extensions,
+            bytecode_cache=self.bytecode_cache)
         self.environment.filters['tobool'] = _tobool
         self.environment.filters['toint'] = _toint
         self.environment.globals['debug'] = contextfunction(pformat)
@@ -124,13 +225,47 @@ class BuiltinTemplateLoader(TemplateBridge, BaseLoader):
                 builder.app.translator)
 
     def render(self, template, context):
+        self.environment.loaded = set()
         return self.environment.get_template(template).render(context)
 
+    def loaded_templates(self):
+        return self.environment.loaded
+
+    def loaded_variables(self):
+        names = set()
+        for filename in self.environment.loaded:
+            variables = self.environment.get_variables(filename)
+            if variables is None:
+                return None
+            names.update(variables)
+        return names
+
+    def template_files(self):
+        files = set()
+        for dirname in self.pathchain:
+            for root, dirs, filenames in os.walk(path.abspath(dirname)):
+                # a template path may contain the output directory
+                for subdir in dirs[:]:
+                    if path.join(root, subdir) in self.ignored_dirs:
+                        dirs.remove(subdir)
+                for sfile in filenames:
+                    if sfile.endswith('.html'):
+                        files.add(path.join(root, sfile))
+        return files
+
     def render_string(self, source, context):
         return self.environment.from_string(source).render(context)
 
     def newest_template_mtime(self):
-        return max(mtimes_of_files(self.pathchain, '.html'))
+        # the output directory may be in a template path, but its files are
+        # no templates
+        mtimes = [0]
+        for filename in self.template_files():
+            try:
+                mtimes.append(path.getmtime(filename))
+            except EnvironmentError:
+                pass
+        return max(mtimes)
 
     # Loader interface
 
@@ -11,7 +11,8 @@
 import re
 import cPickle as pickle
 
-from docutils.nodes import comment, Text, NodeVisitor, SkipNode
+from docutils.nodes import comment, Text, Inline, TextElement, \
+     NodeVisitor, SkipNode
 
 from sphinx.util import jsdump, rpartition
 
@@ -107,11 +108,24 @@ class _JavaScriptIndex(object):
     """
 
     PREFIX = 'Search.setIndex('
+    SHARD_PREFIX = 'Search.setShard('
     SUFFIX = ')'
 
     def dumps(self, data):
         return self.PREFIX + jsdump.dumps(data) + self.SUFFIX
 
+    def dumps_sections(self, data):
+        """Like :meth:`dumps`, but also return a list of the keys of *data*
+        and the size of their dumped values in bytes.
+        """
+        parts = []
+        sizes = []
+        for key, value in sorted(data.iteritems()):
+            dumped = jsdump.dumps(value)
+            parts.append('%s:%s' % (jsdump.dumps(key, True), dumped))
+            sizes.append((key, len(dumped)))
+        return self.PREFIX + '{%s}' % ','.join(parts) + self.SUFFIX, sizes
+
     def loads(self, s):
         data = s[len(self.PREFIX):-len(self.SUFFIX)]
         if not data or not s.startswith(self.PREFIX) or not \
@@ -119,6 +133,17 @@ class _JavaScriptIndex(object):
             raise ValueError('invalid data')
         return jsdump.loads(data)
 
+    def dumps_shard(self, name, data):
+        return '%s%s,%s%s' % (self.SHARD_PREFIX, jsdump.dumps(name),
+                              jsdump.dumps(data), self.SUFFIX)
+
+    def loads_shard(self, s):
+        data = s[len(self.SHARD_PREFIX):-len(self.SUFFIX)]
+        if not data or not s.startswith(self.SHARD_PREFIX) or not \
+           s.endswith(self.SUFFIX):
+            raise ValueError('invalid data')
+        return jsdump.loads('[' + data + ']')[1]
+
     def dump(self, data, f):
         f.write(self.dumps(data))
 
@@ -129,21 +154,156 @@ class _JavaScriptIndex(object):
 js_index = _JavaScriptIndex()
 
 
+def term_shard(term, nshards):
+    """Return the number of the shard *term* is put in when the terms are
+    split into *nshards* shards.  searchtools.js computes the same hash over
+    the UTF-16 code units of the term.
+    """
+    data = unicode(term).encode('utf-16-le')
+    h = 0
+    for i in xrange(0, len(data), 2):
+        h = (h * 31 + (ord(data[i]) | ord(data[i+1]) << 8)) % 4294967296
+    return h % nshards
+
+
+# the digits of numbers in the compact index: a digit from the first half
+# ends a number, one from the second half is followed by more significant
+# digits
+_compact_digits = ('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdef'
+                   'ghijklmnopqrstuvwxyz0123456789+/')
+_compact_values = dict((c, i) for (i, c) in enumerate(_compact_digits))
+
+
+def encode_numbers(numbers):
+    """Encode a list of non-negative integers as a string of base-32 digits,
+    least significant digit first.
+    """
+    result = []
+    for n in numbers:
+        while n >= 32:
+            result.append(_compact_digits[32 + (n & 31)])
+            n >>= 5
+        result.append(_compact_digits[n])
+    return ''.join(result)
+
+
+def decode_numbers(s):
+    """Decode a string written by :func:`encode_numbers`."""
+    numbers = []
+    value = shift = 0
+    for c in s:
+        digit = _compact_values[c]
+        if digit >= 32:
+            value |= (digit - 32) << shift
+            shift += 5
+        else:
+            numbers.append(value | digit << shift)
+            value = shift = 0
+    return numbers
+
+
+def encode_postings(postings):
+    """Encode a sorted list of file indices as the differences between
+    neighbouring indices, which are small for frequent terms.
+    """
+    last = 0
+    deltas = []
+    for i in postings:
+        deltas.append(i - last)
+        last = i
+    return encode_numbers(deltas)
+
+
+def decode_postings(s):
+    """Decode a string written by :func:`encode_postings`."""
+    postings = []
+    last = 0
+    for delta in decode_numbers(s):
+        last += delta
+        postings.append(last)
+    return postings
+
+
+def encode_names(names):
+    """Front-code a sorted list of names: each name is written as the digit
+    giving the length of the prefix it shares with the previous name, followed
+    by the rest of the name.
+    """
+    result = []
+    last = ''
+    for name in names:
+        n = 0
+        maxn = min(len(name), len(last), 31)
+        while n < maxn and name[n] == last[n]:
+            n += 1
+        result.append(_compact_digits[n] + name[n:])
+        last = name
+    return result
+
+
+def decode_names(encoded):
+    """Decode a list written by :func:`encode_names`."""
+    names = []
+    last = ''
+    for name in encoded:
+        last = last[:_compact_values[name[0]]] + name[1:]
+        names.append(last)
+    return names
+
+
+def intern_strings(strings):
+    """Return a list of the distinct strings in *strings*, and the indices
+    of the strings in that list, encoded with :func:`encode_numbers`.
+    """
+    table = []
+    indices = {}
+    refs = []
+    for string in strings:
+        i = indices.get(string)
+        if i is None:
+            i = indices[string] = len(table)
+            table.append(string)
+        refs.append(i)
+    return table, encode_numbers(refs)
+
+
+# the starts of the parts of object names that are found with the object
+# index, e.g. "path" and "join" in "os.path.join" or "Builder" in
+# "HTMLBuilder"
+_object_key_re = re.compile(r'(?<![a-zA-Z0-9])[a-zA-Z0-9]|(?<=[a-z])[A-Z]|'
+                            r'[A-Z](?=[a-z])')
+
+
 class WordCollector(NodeVisitor):
     """
-    A special visitor that collects words for the `IndexBuilder`.
+    A special visitor that collects words for the `IndexBuilder`.  If
+    *collect_text* is true, the text is collected as well.
     """
 
-    def __init__(self, document, lang):
+    def __init__(self, document, lang, collect_text=False):
         NodeVisitor.__init__(self, document)
         self.found_words = []
+        self.found_text = None
+        if collect_text:
+            self.found_text = []
         self.lang = lang
 
     def dispatch_visit(self, node):
         if node.__class__ is comment:
             raise SkipNode
         if node.__class__ is Text:
-            self.found_words.extend(self.lang.split(node.astext()))
+            text = node.astext()
+            self.found_words.extend(self.lang.split(text))
+            if self.found_text is not None:
+                self.found_text.append(text)
+        elif self.found_text is not None and isinstance(node, TextElement) \
+                 and not isinstance(node, Inline):
+            # separate paragraphs, titles etc.
+            self.found_text.append(' ')
+
+    def get_text(self):
+        """Return the collected text with runs of whitespace collapsed."""
+        return ' '.join(''.join(self.found_text).split())
 
 
 class IndexBuilder(object):
@@ -156,10 +316,18 @@ class IndexBuilder(object):
         'pickle':   pickle
     }
 
-    def __init__(self, env, lang, options):
+    # approximate size of the files the texts of the documents are split
+    # into by freeze_snippets()
+    snippet_file_size = 65536
+
+    def __init__(self, env, lang, options, snippet_length=0):
         self.env = env
+        # number of characters of the text of each document to store
+        self.snippet_length = snippet_length
         # filename -> title
         self._titles = {}
+        # filename -> start of the text
+        self._snippets = {}
         # stemmed word -> set(filenames)
         self._mapping = {}
         # objtype -> index
@@ -169,37 +337,109 @@ class IndexBuilder(object):
         # add language-specific SearchLanguage instance
         self.lang = languages[lang](options)
 
-    def load(self, stream, format):
-        """Reconstruct from frozen data."""
+    def load(self, stream, format, load_shard=None):
+        """Reconstruct from frozen data.
+
+        For a sharded index, *load_shard* is called with the name of a shard
+        and must return its data.
+        """
         if isinstance(format, basestring):
             format = self.formats[format]
         frozen = format.load(stream)
         # if an old index is present, we treat it as not existing.
         if not isinstance(frozen, dict):
             raise ValueError('old format')
-        index2fn = frozen['filenames']
-        self._titles = dict(zip(index2fn, frozen['titles']))
+        if frozen.get('compact'):
+            index2fn = decode_names(frozen['filenames'])
+            titles = [frozen['titles'][i]
+                      for i in decode_numbers(frozen['titleindex'])]
+        else:
+            index2fn = frozen['filenames']
+            titles = frozen['titles']
+        self._titles = dict(zip(index2fn, titles))
+        if 'shards' in frozen:
+            if load_shard is None:
+                raise ValueError('sharded index')
+            terms = {}
+            for i in range(frozen['shards']):
+                terms.update(load_shard('terms%d' % i))
+        else:
+            terms = frozen['terms']
         self._mapping = {}
-        for k, v in frozen['terms'].iteritems():
+        for k, v in terms.iteritems():
             if isinstance(v, int):
                 self._mapping[k] = set([index2fn[v]])
+            elif isinstance(v, basestring):
+                self._mapping[k] = set(index2fn[i] for i in decode_postings(v))
             else:
                 self._mapping[k] = set(index2fn[i] for i in v)
+        self._snippets = {}
+        if 'snippets' in frozen and load_shard is not None:
+            for i in range(frozen['snippets']):
+                self._snippets.update(load_shard('snippets%d' % i))
         # no need to load keywords/objtypes
 
-    def dump(self, stream, format):
+    def dump(self, stream, format, compact=False):
         """Dump the frozen index to a stream."""
         if isinstance(format, basestring):
             format = self.formats[format]
-        format.dump(self.freeze(), stream)
+        format.dump(self.freeze(compact), stream)
+
+    def dumps(self, format, compact=False):
+        """Return the frozen index as a string."""
+        if isinstance(format, basestring):
+            format = self.formats[format]
+        return format.dumps(self.freeze(compact))
+
+    def freeze_sharded(self, nshards, compact=False, objectindex=False):
+        """Create the data structures for an index split into shards, so that
+        a search only needs to load the shards with its terms.  Return the
+        frozen index without the terms and objects, and a dictionary mapping
+        the shard names to their data: ``termsN`` for the terms put in shard
+        *N* by :func:`term_shard`, and ``objects`` (or ``objectindex``).
+        """
+        frozen = self.freeze(compact, objectindex)
+        if objectindex:
+            # searchtools.js needs to know which shard to load
+            shards = {'objectindex': frozen['objectindex']}
+            frozen['objectindex'] = 1
+        else:
+            shards = {'objects': frozen.pop('objects')}
+        for i in range(nshards):
+            shards['terms%d' % i] = {}
+        for term, files in frozen.pop('terms').iteritems():
+            shards['terms%d' % term_shard(term, nshards)][term] = files
+        frozen['shards'] = nshards
+        return frozen, shards
+
+    def freeze_snippets(self):
+        """Return a dictionary mapping the names of the files the texts of
+        the documents are put in to dictionaries mapping the document names
+        to their texts.  The files are named ``snippetsN``, where *N* is
+        given by :func:`term_shard` for the document name, and their number
+        is a power of two chosen so that they are not much larger than
+        :attr:`snippet_file_size`.
+        """
+        total = sum(len(text) for text in self._snippets.itervalues())
+        nfiles = 1
+        while nfiles * self.snippet_file_size < total:
+            nfiles *= 2
+        files = {}
+        for i in range(nfiles):
+            files['snippets%d' % i] = {}
+        for filename, text in self._snippets.iteritems():
+            files['snippets%d' % term_shard(filename, nfiles)][filename] = text
+        return files
 
     def get_objects(self, fn2index):
         rv = {}
         otypes = self._objtypes
         onames = self._objnames
-        for domainname, domain in self.env.domains.iteritems():
+        # iterate in a fixed order, so that an unchanged index is dumped
+        # identically
+        for domainname, domain in sorted(self.env.domains.iteritems()):
             for fullname, dispname, type, docname, anchor, prio in \
-                    domain.get_objects():
+                    sorted(domain.get_objects()):
                 # XXX use dispname?
                 if docname not in fn2index:
                     continue
@@ -222,6 +462,36 @@ class IndexBuilder(object):
                 pdict[name] = (fn2index[docname], i, prio)
         return rv
 
+    def get_object_index(self, objects):
+        """Return the objects returned by :meth:`get_objects` as a table
+        that can be searched without looking at every name: the full names
+        sorted case-insensitively (``names``), the data of each name
+        (``data``), and the positions in the names at which a part of the
+        name starts (see ``_object_key_re``), as pairs of name index and
+        offset sorted by the lowercased rest of the name from that offset and
+        encoded with :func:`encode_numbers` (``keys``).
+        """
+        items = []
+        for prefix, pdict in objects.iteritems():
+            for name, data in pdict.iteritems():
+                if prefix:
+                    name = prefix + '.' + name
+                items.append((name.lower(), name, data))
+        items.sort()
+        keys = []
+        for i, (lower, name, data) in enumerate(items):
+            for match in _object_key_re.finditer(name):
+                offset = match.start()
+                keys.append((name[offset:].lower(), i, offset))
+        keys.sort()
+        refs = []
+        for key, i, offset in keys:
+            refs.append(i)
+            refs.append(offset)
+        return dict(names=[item[1] for item in items],
+                    data=[item[2] for item in items],
+                    keys=encode_numbers(refs))
+
     def get_terms(self, fn2index):
         rv = {}
         for k, v in self._mapping.iteritems():
@@ -230,29 +500,85 @@ class IndexBuilder(object):
                 if fn in fn2index:
                     rv[k] = fn2index[fn]
             else:
-                rv[k] = [fn2index[fn] for fn in v if fn in fn2index]
+                rv[k] = sorted(fn2index[fn] for fn in v if fn in fn2index)
         return rv
 
-    def freeze(self):
-        """Create a usable data structure for serializing."""
-        filenames = self._titles.keys()
-        titles = self._titles.values()
+    def freeze(self, compact=False, objectindex=False):
+        """Create a usable data structure for serializing.
+
+        If *compact* is true, the file names are front-coded, the titles are
+        stored once per distinct title and the file indices of each term are
+        encoded as a string (see :func:`encode_postings`), which
+        searchtools.js only decodes for the terms searched for.
+
+        If *objectindex* is true, the objects are stored as ``objectindex``,
+        see :meth:`get_object_index`, instead of ``objects``.
+        """
+        filenames = sorted(self._titles)
+        titles = [self._titles[fn] for fn in filenames]
         fn2index = dict((f, i) for (i, f) in enumerate(filenames))
         terms = self.get_terms(fn2index)
         objects = self.get_objects(fn2index)  # populates _objtypes
         objtypes = dict((v, k[0] + ':' + k[1])
                         for (k, v) in self._objtypes.iteritems())
         objnames = self._objnames
-        return dict(filenames=filenames, titles=titles, terms=terms,
-                    objects=objects, objtypes=objtypes, objnames=objnames)
+        frozen = dict(filenames=filenames, titles=titles, terms=terms,
+                      objects=objects, objtypes=objtypes, objnames=objnames)
+        if objectindex:
+            frozen['objectindex'] = self.get_object_index(
+                frozen.pop('objects'))
+        if compact:
+            for k, v in terms.iteritems():
+                if isinstance(v, int):
+                    v = [v]
+                terms[k] = encode_postings(v)
+            frozen['titles'], frozen['titleindex'] = intern_strings(titles)
+            frozen['filenames'] = encode_names(filenames)
+            frozen['compact'] = 1
+        return frozen
+
+    def fork(self):
+        """Return a new, empty index builder with the same settings, e.g.
+        for feeding documents in a worker process.
+        """
+        other = self.__class__.__new__(self.__class__)
+        other.env = self.env
+        other.lang = self.lang
+        other.snippet_length = self.snippet_length
+        other._titles = {}
+        other._snippets = {}
+        other._mapping = {}
+        other._objtypes = {}
+        other._objnames = {}
+        return other
+
+    def __getstate__(self):
+        # only the fed data is sent back from worker processes
+        return {'_titles': self._titles, '_mapping': self._mapping,
+                '_snippets': self._snippets}
+
+    def merge(self, other):
+        """Add the documents fed to *other*, an index builder returned by
+        :meth:`fork`.
+        """
+        # add the documents in the same order as feed() would have
+        for filename in sorted(other._titles):
+            self._titles[filename] = other._titles[filename]
+        for word, filenames in other._mapping.iteritems():
+            self._mapping.setdefault(word, set()).update(sorted(filenames))
+        self._snippets.update(other._snippets)
 
     def prune(self, filenames):
         """Remove data for all filenames not in the list."""
         new_titles = {}
+        new_snippets = {}
         for filename in filenames:
             if filename in self._titles:
                 new_titles[filename] = self._titles[filename]
+            if filename in self._snippets:
+                new_snippets[filename] = self._snippets[filename]
         self._titles = new_titles
+        self._snippets = new_snippets
         for wordnames in self._mapping.itervalues():
             wordnames.intersection_update(filenames)
 
@@ -260,8 +586,12 @@ class IndexBuilder(object):
         """Feed a doctree to the index."""
         self._titles[filename] = title
 
-        visitor = WordCollector(doctree, self.lang)
+        visitor = WordCollector(doctree, self.lang,
+                                collect_text=bool(self.snippet_length))
         doctree.walk(visitor)
+        if self.snippet_length:
+            self._snippets[filename] = \
+                visitor.get_text()[:self.snippet_length]
 
         def add_term(word, stem=self.lang.stem):
             word = stem(word)
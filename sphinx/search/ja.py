@@ -18,7 +18,6 @@
 # For details, see http://programming-magic.com/?id=170
 
 import os
-import re
 import sys
 
 try:
@@ -91,14 +90,22 @@ class MecabBinder(object):
 
 
 class TinySegmenter(object):
-    patterns_ = dict([(re.compile(pattern), value) for pattern, value in {
-        u'[一二三四五六七八九十百千万億兆]': u'M',
-        u'[一-龠々〆ヵヶ]': u'H',
-        u'[ぁ-ん]': u'I',
-        u'[ァ-ヴーｱ-ﾝﾞｰ]': u'K',
-        u'[a-zA-Zａ-ｚＡ-Ｚ]': u'A',
-        u'[0-9０-９]': u'N',
-    }.iteritems()])
+    # the character types, as in regular expression character sets; a
+    # character has the first type listing it, all others have the type "O"
+    ctypes_ = [
+        (u'M', u'一二三四五六七八九十百千万億兆'),
+        (u'H', u'一-龠々〆ヵヶ'),
+        (u'I', u'ぁ-ん'),
+        (u'K', u'ァ-ヴーｱ-ﾝﾞｰ'),
+        (u'A', u'a-zA-Zａ-ｚＡ-Ｚ'),
+        (u'N', u'0-9０-９'),
+    ]
+    # the character types and previous decisions, in the order of their codes
+    # in the tables built by _build_tables()
+    ctype_codes_ = u'OMHIKAN'
+    p_codes_ = u'UOB'
+    # the markers before and after the text
+    markers_ = (u'B3', u'B2', u'B1', u'E1', u'E2', u'E3')
     BIAS__ = -332
     BC1__ = {u'HH':6,u'II':2461,u'KH':406,u'OH':-1378}
     BC2__ = {u'AA':-3267,u'AI':2744,u'AN':-878,u'HH':-4070,u'HM':-1711,u'HN':4012,u'HO':3761,u'IA':1327,u'IH':-1184,u'II':-1332,u'IK':1721,u'IO':5492,u'KI':3831,u'KK':-8741,u'MH':-3132,u'MK':3334,u'OO':-2920}
@@ -143,108 +150,164 @@ class TinySegmenter(object):
     UW5__ = {u',':465,u'.':-299,u'1':-514,u'E2':-32768,u']':-2762,u'、':465,u'。':-299,u'「':363,u'あ':1655,u'い':331,u'う':-503,u'え':1199,u'お':527,u'か':647,u'が':-421,u'き':1624,u'ぎ':1971,u'く':312,u'げ':-983,u'さ':-1537,u'し':-1371,u'す':-852,u'だ':-1186,u'ち':1093,u'っ':52,u'つ':921,u'て':-18,u'で':-850,u'と':-127,u'ど':1682,u'な':-787,u'に':-1224,u'の':-635,u'は':-578,u'べ':1001,u'み':502,u'め':865,u'ゃ':3350,u'ょ':854,u'り':-208,u'る':429,u'れ':504,u'わ':419,u'を':-1264,u'ん':327,u'イ':241,u'ル':451,u'ン':-343,u'中':-871,u'京':722,u'会':-1153,u'党':-654,u'務':3519,u'区':-901,u'告':848,u'員':2104,u'大':-1296,u'学':-548,u'定':1785,u'嵐':-1304,u'市':-2991,u'席':921,u'年':1763,u'思':872,u'所':-814,u'挙':1618,u'新':-1682,u'日':218,u'月':-4353,u'査':932,u'格':1356,u'機':-1508,u'氏':-1347,u'田':240,u'町':-3912,u'的':-3149,u'相':1319,u'省':-1052,u'県':-4003,u'研':-997,u'社':-278,u'空':-813,u'統':1955,u'者':-2233,u'表':663,u'語':-1073,u'議':1219,u'選':-1018,u'郎':-368,u'長':786,u'間':1191,u'題':2368,u'館':-689,u'１':-514,u'Ｅ２':-32768,u'｢':363,u'ｲ':241,u'ﾙ':451,u'ﾝ':-343}
     UW6__ = {u',':227,u'.':808,u'1':-270,u'E1':306,u'、':227,u'。':808,u'あ':-307,u'う':189,u'か':241,u'が':-73,u'く':-121,u'こ':-200,u'じ':1782,u'す':383,u'た':-428,u'っ':573,u'て':-1014,u'で':101,u'と':-105,u'な':-253,u'に':-149,u'の':-417,u'は':-236,u'も':-206,u'り':187,u'る':-135,u'を':195,u'ル':-673,u'ン':-496,u'一':-277,u'中':201,u'件':-800,u'会':624,u'前':302,u'区':1792,u'員':-1212,u'委':798,u'学':-960,u'市':887,u'広':-695,u'後':535,u'業':-697,u'相':753,u'社':-507,u'福':974,u'空':-822,u'者':1811,u'連':463,u'郎':1082,u'１':-270,u'Ｅ１':306,u'ﾙ':-673,u'ﾝ':-496}
 
+    # the tables built from the above by _build_tables(), once per class
+    tables_ = None
+
+    def __init__(self):
+        cls = self.__class__
+        if cls.__dict__.get('tables_') is None:
+            cls.tables_ = self._build_tables()
+
+    def _build_tables(self):
+        """Return the tables used by :meth:`split`: the type codes of the
+        characters, and the weights of the features keyed by tuples of words
+        or indexed by integers combining the codes of types and previous
+        decisions.
+        """
+        ctypes = {}
+        for ctype, chars in reversed(self.ctypes_):
+            code = self.ctype_codes_.index(ctype)
+            i = 0
+            while i < len(chars):
+                if chars[i+1:i+2] == u'-':
+                    for n in range(ord(chars[i]), ord(chars[i+2]) + 1):
+                        ctypes[unichr(n)] = code
+                    i += 3
+                else:
+                    ctypes[chars[i]] = code
+                    i += 1
+
+        def splits(key, n):
+            # all ways to write key as n words, i.e. characters or markers
+            if n == 0:
+                return key == u'' and [()] or []
+            result = []
+            for size in (1, 2):
+                head = key[:size]
+                if len(head) == size and (size == 1 or head in self.markers_):
+                    result.extend((head,) + rest
+                                  for rest in splits(key[size:], n - 1))
+            return result
+
+        def words(table, n):
+            rv = {}
+            for key, weight in table.iteritems():
+                for split in splits(key, n):
+                    rv[split] = weight
+            return rv
+
+        def codes(table, alphabets):
+            # a list indexed by the codes of the letters of the keys as
+            # digits, e.g. for two types c1 * 7 + c2
+            size = 1
+            for alphabet in alphabets:
+                size *= len(alphabet)
+            rv = [0] * size
+            for key, weight in table.iteritems():
+                index = 0
+                for letter, alphabet in zip(key, alphabets):
+                    index = index * len(alphabet) + alphabet.index(letter)
+                rv[index] = weight
+            return rv
+
+        c = self.ctype_codes_
+        p = self.p_codes_
+        # the features of only the previous decisions, combined
+        up = []
+        for p1 in p:
+            for p2 in p:
+                for p3 in p:
+                    up.append(self.UP1__.get(p1, 0) + self.UP2__.get(p2, 0) +
+                              self.UP3__.get(p3, 0) +
+                              self.BP1__.get(p1 + p2, 0) +
+                              self.BP2__.get(p2 + p3, 0))
+        return dict(
+            ctypes = ctypes, up = up,
+            uw = [getattr(self, 'UW%d__' % i) for i in range(1, 7)],
+            bw = [words(getattr(self, 'BW%d__' % i), 2) for i in range(1, 4)],
+            tw = [words(getattr(self, 'TW%d__' % i), 3) for i in range(1, 5)],
+            uc = [codes(getattr(self, 'UC%d__' % i), [c])
+                  for i in range(1, 7)],
+            bc = [codes(getattr(self, 'BC%d__' % i), [c, c])
+                  for i in range(1, 4)],
+            tc = [codes(getattr(self, 'TC%d__' % i), [c, c, c])
+                  for i in range(1, 5)],
+            uq = [codes(getattr(self, 'UQ%d__' % i), [p, c])
+                  for i in range(1, 3)],
+            bq = [codes(getattr(self, 'BQ%d__' % i), [p, c, c])
+                  for i in range(1, 5)],
+            tq = [codes(getattr(self, 'TQ%d__' % i), [p, c, c, c])
+                  for i in range(1, 5)],
+        )
+
     # ctype_
     def ctype_(self, char):
-        for pattern, value in self.patterns_.iteritems():
-            if pattern.match(char):
-                return value
-        return u'O'
-    # ts_
-    def ts_(self, dict, key):
-        if key in dict:
-            return dict[key]
-        return 0
+        return self.ctype_codes_[self.tables_['ctypes'].get(char, 0)]
 
     # segment
     def split(self, input):
         if not input:
             return []
 
+        tables = self.tables_
+        uw1, uw2, uw3, uw4, uw5, uw6 = [t.get for t in tables['uw']]
+        bw1, bw2, bw3 = [t.get for t in tables['bw']]
+        tw1, tw2, tw3, tw4 = [t.get for t in tables['tw']]
+        uc1, uc2, uc3, uc4, uc5, uc6 = tables['uc']
+        bc1, bc2, bc3 = tables['bc']
+        tc1, tc2, tc3, tc4 = tables['tc']
+        uq1, uq2 = tables['uq']
+        bq1, bq2, bq3, bq4 = tables['bq']
+        tq1, tq2, tq3, tq4 = tables['tq']
+        up = tables['up']
+        bias = self.BIAS__
+        ctypes = tables['ctypes'].get
+
+        seg = [u'B3', u'B2', u'B1'] + list(input) + [u'E1', u'E2', u'E3']
+        ctype = [0, 0, 0] + [ctypes(char, 0) for char in input] + [0, 0, 0]
         result = []
-        seg = [u'B3',u'B2',u'B1']
-        ctype = [u'O',u'O',u'O']
-        for t in input:
-            seg.append(t)
-            ctype.append(self.ctype_(t))
-        seg.append(u'E1')
-        seg.append(u'E2')
-        seg.append(u'E3')
-        ctype.append(u'O')
-        ctype.append(u'O')
-        ctype.append(u'O')
-        word = seg[3]
-        p1 = u'U'
-        p2 = u'U'
-        p3 = u'U'
-
-        for i in range(4, len(seg) - 3):
-            score = self.BIAS__
-            w1 = seg[i-3]
-            w2 = seg[i-2]
-            w3 = seg[i-1]
-            w4 = seg[i]
-            w5 = seg[i+1]
-            w6 = seg[i+2]
-            c1 = ctype[i-3]
-            c2 = ctype[i-2]
-            c3 = ctype[i-1]
-            c4 = ctype[i]
-            c5 = ctype[i+1]
-            c6 = ctype[i+2]
-            score += self.ts_(self.UP1__, p1)
-            score += self.ts_(self.UP2__, p2)
-            score += self.ts_(self.UP3__, p3)
-            score += self.ts_(self.BP1__, p1 + p2)
-            score += self.ts_(self.BP2__, p2 + p3)
-            score += self.ts_(self.UW1__, w1)
-            score += self.ts_(self.UW2__, w2)
-            score += self.ts_(self.UW3__, w3)
-            score += self.ts_(self.UW4__, w4)
-            score += self.ts_(self.UW5__, w5)
-            score += self.ts_(self.UW6__, w6)
-            score += self.ts_(self.BW1__, w2 + w3)
-            score += self.ts_(self.BW2__, w3 + w4)
-            score += self.ts_(self.BW3__, w4 + w5)
-            score += self.ts_(self.TW1__, w1 + w2 + w3)
-            score += self.ts_(self.TW2__, w2 + w3 + w4)
-            score += self.ts_(self.TW3__, w3 + w4 + w5)
-            score += self.ts_(self.TW4__, w4 + w5 + w6)
-            score += self.ts_(self.UC1__, c1)
-            score += self.ts_(self.UC2__, c2)
-            score += self.ts_(self.UC3__, c3)
-            score += self.ts_(self.UC4__, c4)
-            score += self.ts_(self.UC5__, c5)
-            score += self.ts_(self.UC6__, c6)
-            score += self.ts_(self.BC1__, c2 + c3)
-            score += self.ts_(self.BC2__, c3 + c4)
-            score += self.ts_(self.BC3__, c4 + c5)
-            score += self.ts_(self.TC1__, c1 + c2 + c3)
-            score += self.ts_(self.TC2__, c2 + c3 + c4)
-            score += self.ts_(self.TC3__, c3 + c4 + c5)
-            score += self.ts_(self.TC4__, c4 + c5 + c6)
-#           score += self.ts_(self.TC5__, c4 + c5 + c6)
-            score += self.ts_(self.UQ1__, p1 + c1)
-            score += self.ts_(self.UQ2__, p2 + c2)
-            score += self.ts_(self.UQ1__, p3 + c3)
-            score += self.ts_(self.BQ1__, p2 + c2 + c3)
-            score += self.ts_(self.BQ2__, p2 + c3 + c4)
-            score += self.ts_(self.BQ3__, p3 + c2 + c3)
-            score += self.ts_(self.BQ4__, p3 + c3 + c4)
-            score += self.ts_(self.TQ1__, p2 + c1 + c2 + c3)
-            score += self.ts_(self.TQ2__, p2 + c2 + c3 + c4)
-            score += self.ts_(self.TQ3__, p3 + c1 + c2 + c3)
-            score += self.ts_(self.TQ4__, p3 + c2 + c3 + c4)
-            p = u'O'
-            if score > 0:
-                result.append(word)
-                word = u''
-                p = u'B'
+        start = 0
+        # the previous decisions: 0 (U)nknown, 1 (O)ther, 2 (B)oundary
+        p1 = p2 = p3 = 0
+
+        # compute the score of every position in one pass; the type
+        # features are indexed by the type codes (and the previous decision)
+        # as digits of base 7 (and 3), see _build_tables()
+        for i in xrange(4, len(seg) - 3):
+            w1, w2, w3, w4, w5, w6 = seg[i-3:i+3]
+            c1, c2, c3, c4, c5, c6 = ctype[i-3:i+3]
+            c23 = c2 * 7 + c3
+            c34 = c3 * 7 + c4
+            c45 = c4 * 7 + c5
+            c123 = c1 * 49 + c23
+            c234 = c2 * 49 + c34
+            score = (bias + up[p1 * 9 + p2 * 3 + p3] +
+                     uw1(w1, 0) + uw2(w2, 0) + uw3(w3, 0) +
+                     uw4(w4, 0) + uw5(w5, 0) + uw6(w6, 0) +
+                     bw1((w2, w3), 0) + bw2((w3, w4), 0) + bw3((w4, w5), 0) +
+                     tw1((w1, w2, w3), 0) + tw2((w2, w3, w4), 0) +
+                     tw3((w3, w4, w5), 0) + tw4((w4, w5, w6), 0) +
+                     uc1[c1] + uc2[c2] + uc3[c3] +
+                     uc4[c4] + uc5[c5] + uc6[c6] +
+                     bc1[c23] + bc2[c34] + bc3[c45] +
+                     tc1[c123] + tc2[c234] + tc3[c3 * 49 + c45] +
+                     tc4[c4 * 49 + c5 * 7 + c6] +
+                     # the original uses UQ1 for p3 as well
+                     uq1[p1 * 7 + c1] + uq2[p2 * 7 + c2] + uq1[p3 * 7 + c3] +
+                     bq1[p2 * 49 + c23] + bq2[p2 * 49 + c34] +
+                     bq3[p3 * 49 + c23] + bq4[p3 * 49 + c34] +
+                     tq1[p2 * 343 + c123] + tq2[p2 * 343 + c234] +
+                     tq3[p3 * 343 + c123] + tq4[p3 * 343 + c234])
             p1 = p2
             p2 = p3
-            p3 = p
-            word += seg[i]
+            if score > 0:
+                result.append(input[start:i-3])
+                start = i - 3
+                p3 = 2
+            else:
+                p3 = 1
 
-        result.append(word)
+        result.append(input[start:])
         return result
 
 
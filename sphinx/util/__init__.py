@@ -96,8 +96,10 @@ class FilenameUniqDict(dict):
     """
     def __init__(self):
         self._existing = set()
+        self._docfiles = {}  # docname -> set of filenames
 
     def add_file(self, docname, newfile):
+        self._docfiles.setdefault(docname, set()).add(newfile)
         if newfile in self:
             self[newfile][0].add(docname)
             return self[newfile][1]
@@ -112,17 +114,129 @@ class FilenameUniqDict(dict):
         return uniquename
 
     def purge_doc(self, docname):
-        for filename, (docs, _) in self.items():
+        for filename in self._docfiles.pop(docname, ()):
+            docs, uniquename = self[filename]
             docs.discard(docname)
             if not docs:
                 del self[filename]
-                self._existing.discard(filename)
+                self._existing.discard(uniquename)
+
+    def merge_other(self, docnames, other):
+        """Merge the files of *docnames* from *other*, which was filled by a
+        parallel reader.  Unique names chosen there are kept where possible;
+        return the set of docnames for which a different unique name had to
+        be assigned.
+        """
+        changed = set()
+        for filename, (docs, uniquename) in sorted(other.iteritems(),
+                                                   key=lambda i: i[1][1]):
+            docs = docs & docnames
+            if not docs:
+                continue
+            if filename in self:
+                self[filename][0].update(docs)
+                if self[filename][1] != uniquename:
+                    changed.update(docs)
+            elif uniquename in self._existing:
+                for docname in docs:
+                    self.add_file(docname, filename)
+                changed.update(docs)
+                continue
+            else:
+                self[filename] = (set(docs), uniquename)
+                self._existing.add(uniquename)
+            for docname in docs:
+                self._docfiles.setdefault(docname, set()).add(filename)
+        return changed
 
     def __getstate__(self):
-        return self._existing
+        return self._existing, self._docfiles
 
     def __setstate__(self, state):
-        self._existing = state
+        self._existing, self._docfiles = state
+
+
+class DocIndexedDict(dict):
+    """
+    A dictionary for domain inventories whose values are tuples with the
+    docname at index *docpos* (or docnames themselves, if *docpos* is None).
+    It keeps track of the keys belonging to each docname, so that the entries
+    of one document can be purged without looking at all others.
+    """
+    def __init__(self, initial=None, docpos=0):
+        dict.__init__(self)
+        self.docpos = docpos
+        self._dockeys = {}  # docname -> set of keys
+        if initial:
+            self.update(initial)
+
+    def _docname(self, value):
+        if self.docpos is None:
+            return value
+        return value[self.docpos]
+
+    def _forget(self, key, value):
+        docname = self._docname(value)
+        keys = self._dockeys.get(docname)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._dockeys[docname]
+
+    def __setitem__(self, key, value):
+        if key in self:
+            self._forget(key, dict.__getitem__(self, key))
+        dict.__setitem__(self, key, value)
+        self._dockeys.setdefault(self._docname(value), set()).add(key)
+
+    def __delitem__(self, key):
+        value = dict.__getitem__(self, key)
+        dict.__delitem__(self, key)
+        self._forget(key, value)
+
+    def pop(self, key, *default):
+        if key in self:
+            value = self[key]
+            del self[key]
+            return value
+        if default:
+            return default[0]
+        raise KeyError(key)
+
+    def popitem(self):
+        key, value = dict.popitem(self)
+        self._forget(key, value)
+        return key, value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, other):
+        for key, value in other.iteritems():
+            self[key] = value
+
+    def clear(self):
+        dict.clear(self)
+        self._dockeys.clear()
+
+    def keys_for(self, docname):
+        """Return the keys of all entries for *docname*."""
+        return self._dockeys.get(docname, set())
+
+    def purge_doc(self, docname):
+        for key in self._dockeys.pop(docname, ()):
+            dict.__delitem__(self, key)
+
+    def __reduce__(self):
+        # the items must not be set through __setitem__ on unpickling
+        return (self.__class__, (None, self.docpos),
+                (dict(self), self._dockeys))
+
+    def __setstate__(self, state):
+        items, self._dockeys = state
+        dict.update(self, items)
 
 
 def copy_static_entry(source, targetdir, builder, context={},
@@ -130,21 +244,32 @@ def copy_static_entry(source, targetdir, builder, context={},
     """Copy a HTML builder static_path entry from source to targetdir.
 
     Handles all possible cases of files, directories and subdirectories.
+    If the builder has an output writer, the files are written through it
+    and files whose contents did not change are not written again.
     """
     if exclude_matchers:
         relpath = relative_path(builder.srcdir, source)
         for matcher in exclude_matchers:
             if matcher(relpath):
                 return
+    writer = getattr(builder, 'writer', None)
     if path.isfile(source):
         target = path.join(targetdir, path.basename(source))
         if source.lower().endswith('_t') and builder.templates:
             # templated!
             fsrc = open(source, 'r', encoding='utf-8')
-            fdst = open(target[:-2], 'w', encoding='utf-8')
-            fdst.write(builder.templates.render_string(fsrc.read(), context))
-            fsrc.close()
-            fdst.close()
+            try:
+                output = builder.templates.render_string(fsrc.read(), context)
+            finally:
+                fsrc.close()
+            if writer is not None:
+                writer.write_text(target[:-2], output)
+            else:
+                fdst = open(target[:-2], 'w', encoding='utf-8')
+                fdst.write(output)
+                fdst.close()
+        elif writer is not None:
+            writer.copy(source, target)
         else:
             copyfile(source, target)
     elif path.isdir(source):
@@ -155,6 +280,9 @@ def copy_static_entry(source, targetdir, builder, context={},
                 copy_static_entry(path.join(source, entry), targetdir,
                                   builder, context, level=1,
                                   exclude_matchers=exclude_matchers)
+        elif writer is not None:
+            target = path.join(targetdir, path.basename(source))
+            copy_tree_with_writer(source, target, writer)
         else:
             target = path.join(targetdir, path.basename(source))
             if path.exists(target):
@@ -162,6 +290,24 @@ def copy_static_entry(source, targetdir, builder, context={},
             shutil.copytree(source, target)
 
 
+def copy_tree_with_writer(source, target, writer):
+    """Make *target* a copy of the directory *source*, writing the files
+    through the output *writer* and removing files not present in *source*.
+    """
+    copied = set()
+    for root, dirs, files in os.walk(source):
+        targetroot = path.join(target, root[len(source):].lstrip(path.sep))
+        for filename in files:
+            targetname = path.join(targetroot, filename)
+            writer.copy(path.join(root, filename), targetname)
+            copied.add(targetname)
+    for root, dirs, files in os.walk(target):
+        for filename in files:
+            targetname = path.join(root, filename)
+            if targetname not in copied:
+                os.unlink(targetname)
+
+
 _DEBUG_HEADER = '''\
 # Sphinx version: %s
 # Python version: %s
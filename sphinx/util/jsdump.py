@@ -90,7 +90,7 @@ def dumps(obj, key=False):
         return '{%s}' % ','.join('%s:%s' % (
             dumps(key, True),
             dumps(value)
-        ) for key, value in obj.iteritems())
+        ) for key, value in sorted(obj.iteritems()))
     elif isinstance(obj, (tuple, list, set)):
         return '[%s]' % ','.join(dumps(x) for x in obj)
     elif isinstance(obj, basestring):
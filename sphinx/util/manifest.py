@@ -0,0 +1,399 @@
+# -*- coding: utf-8 -*-
+"""
+    sphinx.util.manifest
+    ~~~~~~~~~~~~~~~~~~~~
+
+    Writing output files only if their contents changed, and recording what
+    they were written from.
+
+    :copyright: Copyright 2007-2011 by the Sphinx team, see AUTHORS.
+    :license: BSD, see LICENSE for details.
+"""
+
+import os
+import time
+import threading
+from os import path
+try:
+    from hashlib import md5
+except ImportError:
+    # 2.4 compatibility
+    from md5 import md5
+
+from sphinx.util import jsonimpl
+from sphinx.util.osutil import SEP, ensuredir, copytimes, movefile
+from sphinx.util.parallel import ThreadedTasks
+
+MANIFEST_FILENAME = '.manifest'
+
+
+class OutputManifest(object):
+    """Records the content digests of the files written to an output
+    directory, so that files whose contents did not change are not written
+    again and keep their modification time.
+
+    A file is only considered unchanged if it still has the size and
+    modification time recorded when it was written, so that files modified
+    or removed by someone else are written again.
+
+    For pages, what they were written from is recorded as well: the source
+    document, the templates and the configuration.
+
+    Files may be written from several threads at once.  If :attr:`write_hook`
+    is set, it is called with the file name, the contents and whether the
+    file was written for every file passing through :meth:`write`.
+    """
+
+    format_version = 2
+
+    def __init__(self, outdir, filename=MANIFEST_FILENAME):
+        self.outdir = path.abspath(outdir)
+        self.filename = path.join(self.outdir, filename)
+        # relative filename -> [digest, size, mtime, time last written or
+        #                       found unchanged]
+        self.entries = {}
+        # relative filename -> sorted list of the templates it was rendered
+        # from
+        self.dependencies = {}
+        # relative filename -> {'source': time the document was read,
+        #                       'config': digest, 'keys': optional config
+        #                       values included in the digest} for pages
+        self.pages = {}
+        # all templates available when the files were written
+        self.template_files = None
+        # keys of the entries updated in a worker process
+        self._touched = None
+        # number of files written and found unchanged in this build
+        self.written = 0
+        self.unchanged = 0
+        self.write_hook = None
+        self._lock = threading.Lock()
+
+    def _key(self, filename):
+        filename = path.abspath(filename)
+        if filename.startswith(self.outdir + path.sep):
+            filename = filename[len(self.outdir)+1:]
+        return filename.replace(path.sep, SEP)
+
+    def load(self):
+        try:
+            f = open(self.filename, 'rb')
+            try:
+                data = jsonimpl.load(f)
+            finally:
+                f.close()
+            if data.get('version') != self.format_version:
+                raise ValueError
+            self.entries = data['files']
+            self.dependencies = data.get('dependencies', {})
+            self.pages = data.get('pages', {})
+            self.template_files = data.get('templates')
+        except (IOError, OSError, ValueError, KeyError, AttributeError):
+            self.entries = {}
+            self.dependencies = {}
+            self.pages = {}
+            self.template_files = None
+
+    def save(self):
+        ensuredir(self.outdir)
+        f = open(self.filename, 'wb')
+        try:
+            jsonimpl.dump({'version': self.format_version,
+                           'files': self.entries,
+                           'dependencies': self.dependencies,
+                           'pages': self.pages,
+                           'templates': self.template_files}, f)
+        finally:
+            f.close()
+
+    def _entry(self, filename):
+        """Return the entry for *filename* if the file is unmodified since
+        it was recorded, else None.
+        """
+        entry = self.entries.get(self._key(filename))
+        if entry is None:
+            return None
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return None
+        if entry[1] != st.st_size or entry[2] != st.st_mtime:
+            return None
+        return entry
+
+    def is_current(self, filename):
+        """Return True if *filename* is unmodified since it was written."""
+        return self._entry(filename) is not None
+
+    def get_mtime(self, filename):
+        """Return the time *filename* was last written or found unchanged.
+
+        Raises :exc:`OSError` if the file does not exist.
+        """
+        entry = self._entry(filename)
+        if entry is not None:
+            return entry[3]
+        return path.getmtime(filename)
+
+    def get_dependencies(self, filename):
+        """Return the list of templates *filename* was rendered from, or None
+        if unknown.
+        """
+        return self.dependencies.get(self._key(filename))
+
+    def dependent_files(self):
+        """Return the file names of all files with recorded templates."""
+        return [path.join(self.outdir, key.replace(SEP, path.sep))
+                for key in self.dependencies]
+
+    def set_dependencies(self, filename, dependencies):
+        """Record the templates *filename* was rendered from."""
+        key = self._key(filename)
+        self._lock.acquire()
+        try:
+            if dependencies is None:
+                self.dependencies.pop(key, None)
+            else:
+                self.dependencies[key] = sorted(dependencies)
+            if self._touched is not None:
+                self._touched.add(key)
+        finally:
+            self._lock.release()
+
+    def get_page(self, filename):
+        """Return the record of what the page *filename* was written from,
+        see :meth:`set_page`, or None if unknown.
+        """
+        return self.pages.get(self._key(filename))
+
+    def set_page(self, filename, source, config, keys):
+        """Record that the page *filename* was written from the document
+        read at the time *source* (None for pages without a document), with
+        the configuration digest *config*.  *keys* are the names of the
+        config values that were only included in the digest because the
+        page uses them.
+        """
+        key = self._key(filename)
+        self._lock.acquire()
+        try:
+            self.pages[key] = {'source': source, 'config': config,
+                               'keys': sorted(keys)}
+            if self._touched is not None:
+                self._touched.add(key)
+        finally:
+            self._lock.release()
+
+    def write(self, filename, data):
+        """Write the byte string *data* to *filename*, unless the file
+        already has these contents.  Return True if the file was written.
+        """
+        digest = md5(data).hexdigest()
+        entry = self._entry(filename)
+        if entry is not None and entry[0] == digest:
+            self._note_unchanged(filename, entry)
+            written = False
+        else:
+            ensuredir(path.dirname(filename))
+            f = open(filename, 'wb')
+            try:
+                f.write(data)
+            finally:
+                f.close()
+            self._record(filename, digest)
+            written = True
+        if self.write_hook is not None:
+            self.write_hook(filename, data, written)
+        return written
+
+    def write_text(self, filename, text, encoding='utf-8', errors='strict'):
+        """Like :meth:`write`, but for a unicode string."""
+        return self.write(filename, text.encode(encoding, errors))
+
+    def write_chunks(self, filename, chunks):
+        """Like :meth:`write`, but for an iterable of byte strings, which are
+        written to a temporary file as they come instead of being collected
+        in memory.  The :attr:`write_hook` gets the contents of the file read
+        back in.
+        """
+        digest = md5()
+        ensuredir(path.dirname(filename))
+        tmpname = filename + '.tmp'
+        f = open(tmpname, 'wb')
+        try:
+            try:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    f.write(chunk)
+            finally:
+                f.close()
+        except:
+            os.unlink(tmpname)
+            raise
+        digest = digest.hexdigest()
+        entry = self._entry(filename)
+        if entry is not None and entry[0] == digest:
+            os.unlink(tmpname)
+            self._note_unchanged(filename, entry)
+            written = False
+        else:
+            movefile(tmpname, filename)
+            self._record(filename, digest)
+            written = True
+        if self.write_hook is not None:
+            f = open(filename, 'rb')
+            try:
+                data = f.read()
+            finally:
+                f.close()
+            self.write_hook(filename, data, written)
+        return written
+
+    def copy(self, source, dest):
+        """Copy *source* to *dest* and its modification times, unless *dest*
+        already has the same contents.  Return True if the file was written.
+        """
+        f = open(source, 'rb')
+        try:
+            data = f.read()
+        finally:
+            f.close()
+        written = self.write(dest, data)
+        if written:
+            try:
+                # don't do full copystat because the source may be read-only
+                copytimes(source, dest)
+            except OSError:
+                pass
+            else:
+                self._record(dest, self.entries[self._key(dest)][0],
+                             count=False)
+        return written
+
+    def _note_unchanged(self, filename, entry):
+        self._lock.acquire()
+        try:
+            entry[3] = time.time()
+            if self._touched is not None:
+                self._touched.add(self._key(filename))
+            self.unchanged += 1
+        finally:
+            self._lock.release()
+
+    def _record(self, filename, digest, count=True):
+        st = os.stat(filename)
+        key = self._key(filename)
+        self._lock.acquire()
+        try:
+            self.entries[key] = [digest, st.st_size, st.st_mtime, time.time()]
+            if self._touched is not None:
+                self._touched.add(key)
+            if count:
+                self.written += 1
+        finally:
+            self._lock.release()
+
+    def fork(self):
+        """Return a manifest with the same entries, but counting writes
+        separately, for use in a worker process.
+        """
+        other = self.__class__(self.outdir)
+        other.filename = self.filename
+        other.entries = self.entries
+        other.dependencies = self.dependencies
+        other.pages = self.pages
+        other.template_files = self.template_files
+        other.write_hook = self.write_hook
+        other._touched = set()
+        return other
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        state['write_hook'] = None
+        if self._touched is not None:
+            # only the updated entries are sent back from worker processes
+            state['entries'] = dict((key, self.entries[key])
+                                    for key in self._touched
+                                    if key in self.entries)
+            state['dependencies'] = dict((key, self.dependencies[key])
+                                         for key in self._touched
+                                         if key in self.dependencies)
+            state['pages'] = dict((key, self.pages[key])
+                                  for key in self._touched
+                                  if key in self.pages)
+            state['_touched'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def merge(self, other):
+        """Add the entries and counts of *other*, e.g. from a worker
+        process.
+        """
+        self.entries.update(other.entries)
+        self.dependencies.update(other.dependencies)
+        self.pages.update(other.pages)
+        self.written += other.written
+        self.unchanged += other.unchanged
+
+
+class OutputWriter(object):
+    """Writes output files through an :class:`OutputManifest` in background
+    threads, so that file I/O overlaps with rendering.
+
+    At most *maxqueued* files wait to be written; adding files blocks while
+    the queue is full.  Errors writing files are reported through *warn* by
+    :meth:`flush`, which waits until all queued files are written.  The time
+    spent waiting for the writer threads is added up in :attr:`blocked`.
+    """
+
+    def __init__(self, manifest, warn, nthreads=2, maxqueued=100):
+        self.manifest = manifest
+        self.warn = warn
+        self.blocked = 0
+        self._tasks = ThreadedTasks(nthreads, maxqueued)
+        self._errors = []
+
+    def _run(self, args):
+        errprefix, func, funcargs = args
+        try:
+            func(*funcargs)
+        except EnvironmentError, err:
+            self._errors.append(errprefix + str(err))
+
+    def _add(self, errprefix, func, *args):
+        start = time.time()
+        self._tasks.add_task(self._run, (errprefix, func, args))
+        self.blocked += time.time() - start
+
+    def write(self, filename, data):
+        """Queue writing the byte string *data* to *filename*."""
+        self._add('error writing file %s: ' % filename,
+                  self.manifest.write, filename, data)
+
+    def write_text(self, filename, text, encoding='utf-8', errors='strict'):
+        """Like :meth:`write`, but for a unicode string."""
+        self.write(filename, text.encode(encoding, errors))
+
+    def copy(self, source, dest, errprefix=None):
+        """Queue copying *source* to *dest*.  *errprefix* is the start of
+        the warning given if that fails.
+        """
+        if errprefix is None:
+            errprefix = 'error writing file %s: ' % dest
+        self._add(errprefix, self.manifest.copy, source, dest)
+
+    def flush(self):
+        """Wait until all queued files are written, and warn about those
+        that could not be written.
+        """
+        start = time.time()
+        try:
+            self._tasks.join()
+        finally:
+            self.blocked += time.time() - start
+        errors, self._errors = self._errors, []
+        for error in errors:
+            self.warn(error)
@@ -78,3 +78,55 @@ def patfilter(names, pat):
         _pat_cache[pat] = re.compile(_translate_pattern(pat))
     match = _pat_cache[pat].match
     return filter(match, names)
+
+
+def _literal_prefix(pat):
+    """Return the part of *pat* before the first wildcard."""
+    for i, c in enumerate(pat):
+        if c in '*?[':
+            return pat[:i]
+    return pat
+
+
+class PatternMatcher(object):
+    """Finds the entries of a mapping from patterns to values whose patterns
+    match a name.
+
+    The patterns are compiled once: patterns without wildcards are looked up
+    in a dictionary, and the others are grouped by the first path component
+    they match literally, so that only few of them have to be tried.
+    """
+
+    def __init__(self, mapping):
+        self.exact = {}
+        # [(specificity, pattern, match, value)]
+        generic = []
+        grouped = {}
+        for pattern, value in mapping.iteritems():
+            prefix = _literal_prefix(pattern)
+            if prefix == pattern:
+                self.exact[pattern] = value
+                continue
+            # longer literal prefixes, fewer stars and more other characters
+            # make a pattern more specific
+            specificity = (-len(prefix), pattern.count('*'), -len(pattern))
+            entry = (specificity, pattern,
+                     re.compile(_translate_pattern(pattern)).match, value)
+            if '/' in prefix:
+                grouped.setdefault(prefix.split('/', 1)[0], []).append(entry)
+            else:
+                generic.append(entry)
+        self.generic = sorted(generic)
+        self.grouped = dict((key, sorted(entries + generic))
+                            for (key, entries) in grouped.iteritems())
+
+    def match(self, name):
+        """Return the list of the (pattern, value) pairs whose patterns match
+        *name*, the most specific first.  A pattern without wildcards equal
+        to *name* is the only match.
+        """
+        if name in self.exact:
+            return [(name, self.exact[name])]
+        entries = self.grouped.get(name.split('/', 1)[0], self.generic)
+        return [(pattern, value) for (_, pattern, match, value) in entries
+                if match(name)]
@@ -148,6 +148,10 @@ def make_refnode(builder, fromdocname, todocname, targetid, child, title=None):
     else:
         node['refuri'] = (builder.get_relative_uri(fromdocname, todocname)
                           + '#' + targetid)
+        # let the environment know which documents refer to which
+        env = getattr(builder, 'env', None)
+        if env is not None:
+            env.note_reference(fromdocname, todocname)
     if title:
         node['reftitle'] = title
     node.append(child)
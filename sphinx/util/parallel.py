@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+    sphinx.util.parallel
+    ~~~~~~~~~~~~~~~~~~~~
+
+    Utilities for running parts of a build in parallel worker processes or
+    background threads.
+
+    :copyright: Copyright 2007-2011 by the Sphinx team, see AUTHORS.
+    :license: BSD, see LICENSE for details.
+"""
+
+import os
+import sys
+import threading
+import traceback
+from Queue import Queue
+from collections import deque
+
+try:
+    import multiprocessing
+except ImportError:
+    # Python < 2.6
+    multiprocessing = None
+
+from sphinx.errors import SphinxParallelError
+
+# the workers rely on fork() to get a copy of the environment and application
+# state; that is only available on POSIX systems
+parallel_available = multiprocessing is not None and os.name == 'posix'
+
+
+class SerialTasks(object):
+    """Has the same interface as ParallelTasks, but executes tasks directly."""
+
+    def __init__(self, nproc=1):
+        pass
+
+    def add_task(self, task_func, arg=None, result_func=None):
+        if arg is not None:
+            res = task_func(arg)
+        else:
+            res = task_func()
+        if result_func:
+            result_func(res)
+
+    def join(self):
+        pass
+
+
+class ParallelTasks(object):
+    """Executes up to *nproc* tasks in forked worker processes.
+
+    The return value of each task is pickled and sent back to the main
+    process, where it is given to the task's *result_func*.  Result functions
+    are always called in the order the tasks were added, so that merging the
+    results is deterministic.
+    """
+
+    def __init__(self, nproc):
+        self.nproc = max(nproc, 1)
+        # (process, receiving end of pipe, result_func) of running tasks, in
+        # the order they were added
+        self._running = deque()
+
+    def _process(self, pipe, func, arg):
+        try:
+            if arg is None:
+                ret = func()
+            else:
+                ret = func(arg)
+            pipe.send((False, ret))
+        except BaseException, err:
+            # the exception itself may not be picklable
+            pipe.send((True, ('%s: %s' % (err.__class__.__name__, err),
+                              traceback.format_exc())))
+
+    def _join_one(self):
+        proc, precv, result_func = self._running.popleft()
+        # receive before joining, the child blocks until its result
+        # has been read from the pipe
+        try:
+            exc, result = precv.recv()
+        except EOFError:
+            exc, result = True, ('worker process died unexpectedly', '')
+        proc.join()
+        if exc:
+            self.terminate()
+            raise SphinxParallelError(*result)
+        if result_func:
+            result_func(result)
+
+    def add_task(self, task_func, arg=None, result_func=None):
+        """Start *task_func* in a new process; blocks while all *nproc*
+        slots are taken.
+        """
+        while len(self._running) >= self.nproc:
+            self._join_one()
+        precv, psend = multiprocessing.Pipe(False)
+        proc = multiprocessing.Process(target=self._process,
+                                       args=(psend, task_func, arg))
+        proc.start()
+        self._running.append((proc, precv, result_func))
+
+    def join(self):
+        """Wait for all running tasks and process their results."""
+        while self._running:
+            self._join_one()
+
+    def terminate(self):
+        """Kill all remaining worker processes."""
+        while self._running:
+            proc, precv, result_func = self._running.popleft()
+            proc.terminate()
+            proc.join()
+
+
+class ThreadedTasks(object):
+    """Executes tasks in up to *nthreads* background threads.
+
+    This is only useful for tasks that spend most of their time outside of
+    the interpreter lock, like compression or file I/O.  At most *maxqueued*
+    tasks wait for a thread; :meth:`add_task` blocks while the queue is
+    full.  The first exception raised by a task is raised again by
+    :meth:`join`.
+    """
+
+    def __init__(self, nthreads, maxqueued=100):
+        self.nthreads = max(nthreads, 1)
+        self._queue = Queue(maxqueued)
+        self._threads = []
+        self._errors = []
+        # tasks may be added from several threads
+        self._lock = threading.Lock()
+
+    def _run(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                break
+            func, arg = task
+            try:
+                if arg is None:
+                    func()
+                else:
+                    func(arg)
+            except Exception:
+                self._errors.append(sys.exc_info())
+
+    def add_task(self, task_func, arg=None):
+        """Queue *task_func* for execution in a background thread."""
+        if not self._threads:
+            self._lock.acquire()
+            try:
+                if not self._threads:
+                    for i in range(self.nthreads):
+                        thread = threading.Thread(target=self._run)
+                        thread.setDaemon(True)
+                        thread.start()
+                        self._threads.append(thread)
+            finally:
+                self._lock.release()
+        self._queue.put((task_func, arg))
+
+    def join(self):
+        """Wait until all queued tasks are done."""
+        self._lock.acquire()
+        try:
+            threads, self._threads = self._threads, []
+        finally:
+            self._lock.release()
+        for thread in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join()
+        if self._errors:
+            exc_info = self._errors[0]
+            self._errors = []
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+
+def make_chunks(arguments, nproc, maxbatch=10):
+    """Partition *arguments* into chunks for *nproc* workers, so that every
+    worker gets some work but the results still arrive regularly.
+    """
+    nargs = len(arguments)
+    chunksize = min(nargs // nproc, maxbatch)
+    if chunksize == 0:
+        chunksize = 1
+    nchunks, rest = divmod(nargs, chunksize)
+    if rest:
+        nchunks += 1
+    return [arguments[i*chunksize:(i+1)*chunksize] for i in range(nchunks)]
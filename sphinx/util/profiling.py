@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+    sphinx.util.profiling
+    ~~~~~~~~~~~~~~~~~~~~~
+
+    Collecting wall and CPU times of the phases of a build.
+
+    :copyright: Copyright 2007-2011 by the Sphinx team, see AUTHORS.
+    :license: BSD, see LICENSE for details.
+"""
+
+import os
+import time
+
+from sphinx.util import jsonimpl
+
+
+def _cpu_time():
+    times = os.times()
+    return times[0] + times[1]
+
+
+class BuildProfiler(object):
+    """Records the wall and CPU time spent in named phases of a build.
+
+    Phases are timed with :meth:`start` and :meth:`stop` (or :meth:`call`)
+    and may be nested; besides the total time of each phase, the time spent
+    in the phase itself, excluding nested phases, is recorded.  A phase
+    started for a document also attributes all nested phases to it.
+
+    A disabled profiler does nothing but call the functions given to
+    :meth:`call`, so that the timing points can stay in place.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.phases = {}    # phase -> [count, wall, cpu, own wall, own cpu]
+        self.documents = {} # docname -> {phase: own wall}
+        self._stack = []    # [phase, docname, wall, cpu, child wall,
+                            #  child cpu] of the running phases
+
+    def start(self, phase, docname=None):
+        if not self.enabled:
+            return
+        if docname is None and self._stack:
+            docname = self._stack[-1][1]
+        self._stack.append([phase, docname, time.time(), _cpu_time(), 0, 0])
+
+    def stop(self):
+        if not self.enabled:
+            return
+        phase, docname, wall, cpu, childwall, childcpu = self._stack.pop()
+        wall = time.time() - wall
+        cpu = _cpu_time() - cpu
+        entry = self.phases.get(phase)
+        if entry is None:
+            entry = self.phases[phase] = [0, 0, 0, 0, 0]
+        entry[0] += 1
+        entry[1] += wall
+        entry[2] += cpu
+        entry[3] += wall - childwall
+        entry[4] += cpu - childcpu
+        if docname is not None:
+            docphases = self.documents.setdefault(docname, {})
+            docphases[phase] = docphases.get(phase, 0) + wall - childwall
+        if self._stack:
+            self._stack[-1][4] += wall
+            self._stack[-1][5] += cpu
+
+    def call(self, phase, func, *args, **kwds):
+        """Call *func* with the given arguments, timed as *phase*."""
+        if not self.enabled:
+            return func(*args, **kwds)
+        self.start(phase)
+        try:
+            return func(*args, **kwds)
+        finally:
+            self.stop()
+
+    def fork(self):
+        """Return a new, empty profiler for use in a worker process."""
+        return BuildProfiler(self.enabled)
+
+    def merge(self, other):
+        """Add the times recorded by *other*, e.g. in a worker process."""
+        for phase, times in other.phases.iteritems():
+            entry = self.phases.setdefault(phase, [0, 0, 0, 0, 0])
+            for i, value in enumerate(times):
+                entry[i] += value
+        for docname, phases in other.documents.iteritems():
+            docphases = self.documents.setdefault(docname, {})
+            for phase, wall in phases.iteritems():
+                docphases[phase] = docphases.get(phase, 0) + wall
+
+    def dump(self, filename):
+        """Write all recorded times to *filename* in JSON format."""
+        phases = {}
+        for phase, (count, wall, cpu, ownwall, owncpu) in \
+                self.phases.iteritems():
+            phases[phase] = {'count': count, 'wall': wall, 'cpu': cpu,
+                             'own_wall': ownwall, 'own_cpu': owncpu}
+        f = open(filename, 'w')
+        try:
+            jsonimpl.dump({'phases': phases, 'documents': self.documents},
+                          f, indent=1, sort_keys=True)
+        finally:
+            f.close()
+
+    def summary(self, n=15):
+        """Return a list of lines describing the *n* phases and documents
+        that took the most time.
+        """
+        lines = ['%-40s %6s %9s %9s %9s' %
+                 ('phase', 'count', 'own wall', 'wall', 'cpu')]
+        phases = sorted(self.phases.iteritems(),
+                        key=lambda item: item[1][3], reverse=True)
+        for phase, (count, wall, cpu, ownwall, owncpu) in phases[:n]:
+            lines.append('%-40s %6d %8.3fs %8.3fs %8.3fs' %
+                         (phase[:40], count, ownwall, wall, cpu))
+        if self.documents:
+            lines.append('')
+            lines.append('%-40s %9s' % ('document', 'wall'))
+            docs = sorted([(sum(phases.itervalues()), docname)
+                           for (docname, phases)
+                           in self.documents.iteritems()], reverse=True)
+            for wall, docname in docs[:n]:
+                lines.append('%-40s %8.3fs' % (docname[:40], wall))
+        return lines
+
+
+# used where no application (and therefore no profiler) is available
+null_profiler = BuildProfiler(enabled=False)
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+    sphinx.util.watch
+    ~~~~~~~~~~~~~~~~~
+
+    Polling for changes of the files a project is built from.
+
+    :copyright: Copyright 2007-2011 by the Sphinx team, see AUTHORS.
+    :license: BSD, see LICENSE for details.
+"""
+
+import os
+import time
+from os import path
+
+
+class SourceWatcher(object):
+    """Polls the source directory, the dependencies of all documents and the
+    configuration file of an application for changes.
+
+    The polling interval starts at *min_interval* seconds and grows up to
+    *max_interval* while nothing changes, so that an idle watcher costs
+    little, but a change following shortly after another is noticed quickly.
+    Once a change is seen, the watcher waits until no more changes happen
+    for *settle* seconds, so that a burst of changes (e.g. a version control
+    checkout or an editor saving several files) results in one rebuild.
+    """
+
+    def __init__(self, app, min_interval=0.1, max_interval=2.0, settle=0.2):
+        self.app = app
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.settle = settle
+        self.interval = min_interval
+        from sphinx.application import CONFIG_FILENAME
+        self.config_file = path.join(app.confdir, CONFIG_FILENAME)
+        self._snapshot = self.snapshot()
+
+    def _ignored_dirs(self):
+        return set([path.abspath(self.app.outdir),
+                    path.abspath(self.app.doctreedir)])
+
+    def snapshot(self):
+        """Return a dictionary mapping all watched files to their modification
+        time and size.
+        """
+        result = {}
+        def add(filename):
+            try:
+                st = os.stat(filename)
+            except EnvironmentError:
+                return
+            result[filename] = (st.st_mtime, st.st_size)
+
+        ignored = self._ignored_dirs()
+        for root, dirs, files in os.walk(self.app.srcdir):
+            for dirname in dirs[:]:
+                if dirname.startswith('.') or \
+                       path.join(root, dirname) in ignored:
+                    dirs.remove(dirname)
+            for filename in files:
+                if not filename.startswith('.'):
+                    add(path.join(root, filename))
+        # dependencies may live outside of the source directory
+        env = self.app.env
+        for deps in env.dependencies.itervalues():
+            for dep in deps:
+                filename = path.normpath(path.join(self.app.srcdir, dep))
+                if filename not in result:
+                    add(filename)
+        add(self.config_file)
+        return result
+
+    def poll(self):
+        """Return the set of files that were added, changed or removed since
+        the last call.
+        """
+        old, new = self._snapshot, self.snapshot()
+        self._snapshot = new
+        changed = set(filename for filename in new
+                      if old.get(filename) != new[filename])
+        changed.update(filename for filename in old if filename not in new)
+        return changed
+
+    def wait(self):
+        """Block until files change, and return the set of changed files."""
+        while True:
+            changed = self.poll()
+            if changed:
+                break
+            time.sleep(self.interval)
+            self.interval = min(self.interval * 1.5, self.max_interval)
+        # batch bursts of changes
+        while True:
+            time.sleep(self.settle)
+            more = self.poll()
+            if not more:
+                break
+            changed.update(more)
+        self.interval = self.min_interval
+        return changed
@@ -9,9 +9,15 @@
     :license: BSD, see LICENSE for details.
 """
 
+import time
+import tempfile
 from StringIO import StringIO
 
 from sphinx.application import ExtensionError
+from sphinx.domains import Domain
+from sphinx.util.watch import SourceWatcher
+from sphinx.util.profiling import BuildProfiler
+from sphinx.util.jsonimpl import json
 
 from util import *
 
@@ -69,3 +75,121 @@ def test_extensions():
         assert warnings.getvalue().startswith("WARNING: extension 'shutil'")
     finally:
         app.cleanup()
+
+
+def test_parallel_read_domains():
+    class UnmergeableDomain(Domain):
+        name = 'unmergeable'
+    warnings = StringIO()
+    app = TestApp(status=StringIO(), warning=warnings)
+    try:
+        assert app.is_parallel_allowed('read')
+        app.add_domain(UnmergeableDomain)
+        assert not app.is_parallel_allowed('read')
+        assert 'unmergeable domain does not implement' in warnings.getvalue()
+        assert app.is_parallel_allowed('write')
+    finally:
+        app.cleanup()
+
+
+def test_invalid_doctree_cache_size():
+    warnings = StringIO()
+    app = TestApp(status=StringIO(), warning=warnings,
+                  confoverrides={'doctree_cache_size': '1,5MB'})
+    try:
+        assert 'invalid doctree_cache_size' in warnings.getvalue()
+        assert app.config.doctree_cache_size == 16
+    finally:
+        app.cleanup()
+
+
+def test_source_watcher():
+    app = TestApp(srcdir='(temp)', status=StringIO(), warning=StringIO())
+    try:
+        watcher = SourceWatcher(app)
+        assert not watcher.poll()
+        filename = app.srcdir / 'math.txt'
+        filename.write_text(filename.text() + u'\nNew paragraph.\n')
+        (app.outdir / 'ignored.txt').write_text(u'')
+        assert watcher.poll() == set([filename])
+        assert not watcher.poll()
+        # pickling can be deferred while watching
+        app.builder.defer_pickling = True
+        app.builder.pickle_environment()
+        assert app.builder.env_unsaved
+        assert not (app.doctreedir / 'environment.pickle').exists()
+        app.builder.pickle_environment(force=True)
+        assert not app.builder.env_unsaved
+        assert (app.doctreedir / 'environment.pickle').exists()
+    finally:
+        app.cleanup()
+
+
+def test_watch_interrupted():
+    # the environment of an unfinished build is not pickled
+    app = TestApp(srcdir='(temp)', status=StringIO(), warning=StringIO())
+    try:
+        picklefile = app.doctreedir / 'environment.pickle'
+        if picklefile.exists():
+            picklefile.unlink()
+        build = app._build
+        def interrupted_build(*args):
+            build(*args)
+            raise KeyboardInterrupt
+        app._build = interrupted_build
+        raises(KeyboardInterrupt, app.watch, True)
+        assert app.builder.env_unsaved
+        assert not picklefile.exists()
+    finally:
+        app.cleanup()
+
+
+def test_watch_pngmath():
+    # the pngmath temporary directory must be created again for each build
+    # of a watch session; "true" stands in for latex and dvipng
+    srcdir = path(tempfile.mkdtemp())
+    try:
+        (srcdir / 'conf.py').write_text(
+            u"extensions = ['sphinx.ext.pngmath']\n"
+            u"pngmath_latex = pngmath_dvipng = 'true'\n")
+        (srcdir / 'contents.rst').write_text(u'Math\n====\n\n:math:`a+b`\n')
+        app = TestApp(srcdir=srcdir, status=StringIO(), warning=StringIO())
+        try:
+            app.builder.defer_pickling = True
+            app._build(True)
+            assert not hasattr(app.builder, '_mathpng_tempdir')
+            for i in range(2):
+                time.sleep(1)
+                (srcdir / 'contents.rst').write_text(
+                    u'Math\n====\n\n:math:`a+%d`\n' % i)
+                app._build()
+                assert not hasattr(app.builder, '_mathpng_tempdir')
+        finally:
+            app.cleanup()
+    finally:
+        srcdir.rmtree(True)
+
+
+def test_profiler():
+    app = TestApp(srcdir='(temp)', status=StringIO(), warning=StringIO())
+    try:
+        app.profiler = BuildProfiler()
+        app.builder.build_all()
+        phases = app.profiler.phases
+        for phase in ('read', 'read: parse', 'read: domain py',
+                      'resolve references', 'html: template render',
+                      'finish', 'event doctree-read: sphinx.ext.todo.'
+                      'process_todos'):
+            assert phase in phases, phase
+        # own times don't include nested phases
+        count, wall, cpu, ownwall, owncpu = phases['read']
+        assert count == len(app.env.found_docs)
+        assert ownwall < wall
+        assert 'read: parse' in app.profiler.documents['contents']
+        assert len(app.profiler.summary(3)) == 1 + 3 + 2 + 3
+        reportfile = app.outdir / 'profile.json'
+        app.profiler.dump(reportfile)
+        report = json.loads(reportfile.text())
+        assert report['phases']['read']['count'] == count
+    finally:
+        app.cleanup()
@@ -9,17 +9,35 @@
     :license: BSD, see LICENSE for details.
 """
 
+import os
+import gzip
+import time
+import tempfile
+
+from docutils import nodes
+
 from util import *
 
+from sphinx.application import ENV_PICKLE_FILENAME
+from sphinx.environment import BuildEnvironment
+from sphinx.util.parallel import parallel_available
+from sphinx.util.manifest import OutputManifest, OutputWriter
+from sphinx.search import js_index
+
 
 def teardown_module():
     (test_root / '_build').rmtree(True)
 
 # just let the remaining ones run for now
 
-@with_app(buildername='pickle')
+@with_app(buildername='pickle', freshenv=True)
 def test_pickle(app):
     app.builder.build_all()
+    # the references noted while writing are saved in the doctree dir, even
+    # though a copy of the environment is pickled to the output dir first
+    env = BuildEnvironment.frompickle(
+        app.config, app.doctreedir / ENV_PICKLE_FILENAME)
+    assert 'math' in env.references['contents']
 
 @with_app(buildername='json')
 def test_json(app):
@@ -61,3 +79,264 @@ else:
 @with_app(buildername='singlehtml', cleanenv=True)
 def test_singlehtml(app):
     app.builder.build_all()
+
+
+def test_singlehtml_streaming():
+    # write the same page with and without streaming
+    apps = []
+    try:
+        for streaming in (False, True):
+            app = TestApp(buildername='singlehtml', freshenv=True,
+                          confoverrides={'singlehtml_streaming': streaming},
+                          outdir=test_root / '_build' /
+                          ('singlehtml%d' % streaming))
+            apps.append(app)
+            app.builder.build_all()
+    finally:
+        for app in reversed(apps):
+            app.cleanup()
+
+    def load_page(outdir):
+        # meta tags of documents other than the master are only found when
+        # not streaming; script tags differ between applications
+        return [line for line in (outdir / 'contents.html').text().splitlines()
+                if line.strip() and '<meta' not in line and
+                '<script' not in line]
+    assert load_page(apps[0].outdir) == load_page(apps[1].outdir)
+    assert 'id="document-subdir/images"' in \
+           (apps[1].outdir / 'contents.html').text()
+
+
+@skip_unless(parallel_available, 'parallel building is not available')
+def test_html_parallel():
+    # write the same tree serially and in parallel
+    apps = []
+    try:
+        for parallel in (0, 2):
+            app = TestApp(srcdir=apps and apps[0].srcdir or '(temp)',
+                          buildername='html', freshenv=True,
+                          parallel=parallel, outdir=test_root / '_build' /
+                          ('html%d' % parallel))
+            apps.append(app)
+            app.builder.build_all()
+    finally:
+        for app in reversed(apps):
+            app.cleanup()
+    outdirs = [app.outdir for app in apps]
+    serial, parallel = outdirs
+    def load_page(outdir, fn):
+        # script tags are added to a class attribute by every application
+        return [line for line in (outdir / fn).text().splitlines()
+                if '<script' not in line]
+    for fn in ('contents.html', 'markup.html', 'objects.html',
+               'subdir/images.html'):
+        assert load_page(serial, fn) == load_page(parallel, fn), fn
+    def load_index(outdir):
+        index = js_index.loads((outdir / 'searchindex.js').text())
+        filenames = index['filenames']
+        terms = {}
+        for term, fns in index['terms'].iteritems():
+            if isinstance(fns, int):
+                fns = [fns]
+            terms[term] = sorted(filenames[i] for i in fns)
+        return dict(zip(filenames, index['titles'])), terms
+    assert load_index(serial) == load_index(parallel)
+
+
+@skip_unless(parallel_available, 'parallel building is not available')
+def test_html_parallel_pngmath():
+    # the workers must remove their pngmath temporary directories; "true"
+    # stands in for latex and dvipng
+    srcdir = path(tempfile.mkdtemp())
+    tmpdir = path(tempfile.mkdtemp())
+    oldtmpdir = tempfile.tempdir
+    try:
+        (srcdir / 'conf.py').write_text(
+            u"extensions = ['sphinx.ext.pngmath']\n"
+            u"pngmath_latex = pngmath_dvipng = 'true'\n")
+        docs = ['doc%d' % i for i in range(8)]
+        (srcdir / 'contents.rst').write_text(
+            u'Contents\n========\n\n.. toctree::\n\n' +
+            u''.join(u'   %s\n' % doc for doc in docs))
+        for i, doc in enumerate(docs):
+            (srcdir / (doc + '.rst')).write_text(
+                u'Doc\n===\n\n:math:`a+%d`\n' % i)
+        tempfile.tempdir = tmpdir
+        app = TestApp(srcdir=srcdir, parallel=2)
+        try:
+            app.builder.build_all()
+        finally:
+            app.cleanup()
+        assert os.listdir(tmpdir) == []
+    finally:
+        tempfile.tempdir = oldtmpdir
+        tmpdir.rmtree(True)
+        srcdir.rmtree(True)
+
+
+@with_app(buildername='html')
+def test_html_title_cache(app):
+    app.builder.build(['contents', 'markup'])
+    titles = app.env.titles
+    before = titles['markup'].deepcopy()
+    cache = app.builder._title_cache
+    html = app.builder.render_title('markup')
+    assert cache['markup'][1] == html
+    assert 'Testing various markup' in html
+    # rendering does not modify the title node
+    assert titles['markup'].pformat() == before.pformat()
+    assert app.builder.render_title('markup') == html
+    # a document read again is rendered again
+    app.env.all_docs['markup'] += 1
+    cache['markup'] = (cache['markup'][0], 'stale')
+    assert app.builder.render_title('markup') == html
+    # partial nodes are rendered with the docutils defaults, not with the
+    # settings of the environment
+    para = nodes.paragraph('', '', nodes.reference(
+        'a@example.org', 'a@example.org', refuri='mailto:a@example.org'))
+    assert 'href="mailto:a&#64;example.org"' in \
+           app.builder.render_partial(para)['fragment']
+
+
+@with_app(buildername='html')
+def test_html_unchanged_files(app):
+    app.builder.build_all()
+    page = app.outdir / 'markup.html'
+    oldmtime = os.stat(page).st_mtime
+    manifest = app.builder.manifest
+    manifest.written = manifest.unchanged = 0
+    app.builder.build_all()
+    # nothing changed, so nothing is written again
+    assert manifest.written == 0
+    assert manifest.unchanged > 0
+    assert os.stat(page).st_mtime == oldmtime
+    # but files changed by someone else are
+    page.write_text('garbage')
+    app.builder.build_all()
+    assert manifest.written == 1
+    assert 'garbage' not in page.text()
+
+
+@with_app(buildername='html')
+def test_html_template_dependencies(app):
+    app.builder.build_update()
+    templates = app.builder.manifest.get_dependencies(
+        app.outdir / 'contents.html')
+    sidebar = app.srcdir / '_templates' / 'contentssb.html'
+    assert sidebar in templates
+    assert app.srcdir / '_templates' / 'layout.html' in templates
+    assert list(app.builder.get_outdated_docs()) == []
+    # only the page using the sidebar is outdated
+    mtime = os.stat(sidebar).st_mtime
+    os.utime(sidebar, (time.time() + 100, time.time() + 100))
+    try:
+        assert list(app.builder.get_outdated_docs()) == ['contents']
+    finally:
+        os.utime(sidebar, (mtime, mtime))
+
+
+@with_app(buildername='html')
+def test_html_config_dependencies(app):
+    app.add_config_value('html_test_value', 'a', 'html')
+    app.builder.context_config_values = {
+        'html_test_value': ('test_value',),
+        'html_last_updated_fmt': ('last_updated',),
+    }
+    app.builder.build_all()
+    page = app.builder.manifest.get_page(app.outdir / 'contents.html')
+    assert page['source'] == app.env.all_docs['contents']
+    assert page['keys'] == ['html_last_updated_fmt']
+    assert list(app.builder.get_outdated_docs()) == []
+    alldocs = sorted(app.env.found_docs)
+    # no template uses the value
+    app.config.html_test_value = 'b'
+    assert list(app.builder.get_outdated_docs()) == []
+    # the layout template uses last_updated
+    lufmt = app.config.html_last_updated_fmt
+    app.config.html_last_updated_fmt = '%Y'
+    assert sorted(app.builder.get_outdated_docs()) == alldocs
+    app.config.html_last_updated_fmt = lufmt
+    assert list(app.builder.get_outdated_docs()) == []
+    # the value is not given to templates
+    app.config.html_secnumber_suffix = ' '
+    assert sorted(app.builder.get_outdated_docs()) == alldocs
+
+
+@with_app(buildername='html', confoverrides={'html_sidebars': {
+    'index': ['index.html'], '**': 'all.html', 'api/*': ['api.html'],
+    'api/*/*': ['apisub.html'], 'api/ref/*': ['ref.html'],
+    'api/[ab]*': ['ab.html']}})
+def test_html_sidebars(app):
+    app.builder.prepare_writing(())
+    warnings = []
+    app.builder.warn = warnings.append
+    def sidebars(pagename):
+        ctx = {}
+        app.builder.add_sidebars(pagename, ctx)
+        return ctx['sidebars'] or ctx['customsidebar']
+    # patterns without wildcards take precedence
+    assert sidebars('index') == ['index.html']
+    assert sidebars('other') == 'all.html'
+    assert warnings == []
+    # the pattern with the longest literal part wins
+    assert sidebars('api/ref/foo') == ['ref.html']
+    assert len(warnings) == 1
+    assert warnings[0] == ("page api/ref/foo matches two patterns in "
+                           "html_sidebars: 'api/ref/*' and 'api/*/*'")
+    assert sidebars('api/c') == ['api.html']
+    assert sidebars('api/b') == ['ab.html']
+    assert len(warnings) == 3
+
+
+@with_app(buildername='html', confoverrides={'html_precompress': 1},
+          outdir=test_root / '_build' / 'htmlgz')
+def test_html_precompress(app):
+    app.builder.build_all()
+    for fn in ('contents.html', '_static/basic.css', 'searchindex.js',
+               '_sources/contents.txt'):
+        f = gzip.open(app.outdir / fn + '.gz')
+        try:
+            assert f.read() == (app.outdir / fn).bytes(), fn
+        finally:
+            f.close()
+    assert not (app.outdir / '_images' / 'rimg.png.gz').exists()
+    assert (app.outdir / '_images' / 'rimg.png').exists()
+    # errors writing compressed files are reported as warnings
+    app._warning.reset()
+    app.builder._write_compressed((app.outdir / 'contents.html' / 'x.gz',
+                                   'data'))
+    app.builder.finish_precompress()
+    assert 'error writing compressed file' in ''.join(app._warning.content)
+
+
+@with_app(buildername='html', confoverrides={'html_precompress': 10},
+          outdir=test_root / '_build' / 'htmlgz2')
+def test_html_precompress_level(app):
+    assert app.builder.precompress_level == 0
+    assert 'compression level from 1 to 9' in ''.join(app._warning.content)
+
+
+def test_output_writer():
+    outdir = path(tempfile.mkdtemp())
+    try:
+        warnings = []
+        writer = OutputWriter(OutputManifest(outdir), warnings.append,
+                              nthreads=2, maxqueued=2)
+        for i in range(10):
+            writer.write(outdir / ('%d.txt' % i), 'data %d' % i)
+        (outdir / 'file').write_text('')
+        # a file cannot be used as a directory
+        writer.write(outdir / 'file' / 'x.txt', 'data')
+        writer.copy(outdir / 'missing.txt', outdir / 'y.txt', 'cannot copy: ')
+        writer.flush()
+        for i in range(10):
+            assert (outdir / ('%d.txt' % i)).text() == 'data %d' % i
+        # the files are written in no particular order
+        warnings.sort()
+        assert len(warnings) == 2
+        assert warnings[0].startswith('cannot copy: ')
+        assert warnings[1].startswith('error writing file %s: ' %
+                                      (outdir / 'file' / 'x.txt'))
+        assert writer.manifest.written == 10
+    finally:
+        outdir.rmtree(True)
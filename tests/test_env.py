@@ -9,11 +9,17 @@
     :license: BSD, see LICENSE for details.
 """
 import sys
+import pickle
+
+from docutils import nodes
 
 from util import *
 
+from sphinx.environment import BuildEnvironment, DoctreeCache
+from sphinx.domains.python import DottedNameDict
 from sphinx.builders.html import StandaloneHTMLBuilder
 from sphinx.builders.latex import LaTeXBuilder
+from sphinx.util.parallel import parallel_available
 
 app = env = None
 warnings = []
@@ -117,3 +123,167 @@ def test_object_inventory():
 
     assert env.domains['py'].data is env.domaindata['py']
     assert env.domains['c'].data is env.domaindata['c']
+
+@skip_unless(parallel_available, 'parallel building is not available')
+def test_parallel_read():
+    # read the same tree with a fresh serial and a parallel environment
+    envs = []
+    for parallel in (0, 2):
+        papp = TestApp(srcdir=app.srcdir, freshenv=True, parallel=parallel,
+                       doctreedir=app.srcdir / '_build' / ('p%d' % parallel))
+        try:
+            penv = papp.env
+            penv.set_warnfunc(lambda *args: None)
+            msg, num, it = penv.update(papp.config, papp.srcdir,
+                                       papp.doctreedir, papp)
+            assert list(it) == sorted(penv.found_docs)
+            envs.append(penv)
+        finally:
+            papp.cleanup()
+    senv, penv = envs
+    assert penv.all_docs.keys() == senv.all_docs.keys()
+    for attr in ('toctree_includes', 'files_to_rebuild', 'indexentries',
+                 'metadata', 'citations', 'domaindata', 'glob_toctrees',
+                 'numbered_toctrees', 'dependencies', 'versionchanges'):
+        assert getattr(penv, attr) == getattr(senv, attr), attr
+    assert dict(penv.images) == dict(senv.images)
+    assert dict(penv.dlfiles) == dict(senv.dlfiles)
+    for docname in senv.all_docs:
+        assert penv.titles[docname].astext() == senv.titles[docname].astext()
+        assert penv.tocs[docname].astext() == senv.tocs[docname].astext()
+    assert [todo['docname'] for todo in penv.todo_all_todos] == \
+           [todo['docname'] for todo in senv.todo_all_todos]
+
+def test_source_digests():
+    app.config.source_digests = True
+    try:
+        msg, num, it = env.update(app.config, app.srcdir, app.doctreedir, app)
+        list(it)
+        # digests are recorded for documents that were not read again, too
+        assert 'math' in env.doc_digests
+        # a newer mtime doesn't make a document outdated if its contents
+        # are unchanged
+        env.all_docs['math'] = 0
+        added, changed, removed = env.get_outdated_files(False)
+        assert 'math' not in changed
+        # ... but changed contents do
+        root = path(app.srcdir)
+        (root / 'math.txt').write_text(
+            (root / 'math.txt').text() + u'\nNew paragraph.\n')
+        added, changed, removed = env.get_outdated_files(False)
+        assert 'math' in changed
+    finally:
+        app.config.source_digests = False
+
+def test_shards():
+    picklefile = app.doctreedir / 'environment.pickle'
+    env._global_toctrees['key'] = []
+    env.topickle(picklefile)
+    assert env._global_toctrees == {'key': []}
+    del env._global_toctrees['key']
+    assert (app.doctreedir / 'contents.envshard').isfile()
+    newenv = BuildEnvironment.frompickle(app.config, picklefile)
+    # caches are not pickled
+    assert newenv._global_toctrees == {}
+    # the per-document inventories are only loaded when accessed
+    assert not newenv.tocs._data
+    assert 'contents' in newenv.tocs
+    assert newenv.titles['contents'].astext() == \
+           env.titles['contents'].astext()
+    assert 'contents' in newenv.tocs._data
+    assert 'math' not in newenv.tocs._data
+    assert newenv.indexentries == env.indexentries
+    assert set(newenv.metadata) == set(env.metadata)
+
+def test_doctree_cache():
+    cache = env.doctree_cache
+    cache.hits = cache.misses = 0
+    tree = env.get_doctree('contents', copy=False)
+    assert env.get_doctree('contents', copy=False) is tree
+    assert env.get_doctree('contents') is not tree
+    assert (cache.hits, cache.misses) == (2, 1)
+    # the cache is bounded
+    app.config.doctree_cache_size = 2
+    try:
+        for docname in ('images', 'includes', 'math'):
+            env.get_doctree(docname)
+        assert sorted(cache.entries) == ['includes', 'math']
+    finally:
+        app.config.doctree_cache_size = 16
+    # the limits are given as a count or a size in megabytes
+    assert DoctreeCache.parse_limits(16) == (16, None)
+    assert DoctreeCache.parse_limits('1.5MB') == (None, 1572864)
+    for size in ('16 docs', '1,5MB', None, -1):
+        raises(ValueError, DoctreeCache.parse_limits, size)
+
+def test_global_toctree():
+    builder = StandaloneHTMLBuilder(app)
+    toc = env.get_toctree_for('math', builder, collapse=True)
+    assert [node for node in toc.traverse(nodes.list_item)
+            if node.get('iscurrent')]
+    env.get_toctree_for('contents', builder, collapse=False, maxdepth=2)
+    assert len(env._global_toctrees) == 2
+    # the cached entries are not marked for a particular document
+    for toctree in env._global_toctrees.values()[0]:
+        assert not [node for node in toctree.traverse(nodes.list_item)
+                    if node.get('iscurrent')]
+
+def test_docname_index():
+    objects = env.domaindata['py']['objects']
+    assert 'mod.Cls' in objects.keys_for('objects')
+    # the index is saved with the environment
+    copy = pickle.loads(pickle.dumps(objects, pickle.HIGHEST_PROTOCOL))
+    assert copy.keys_for('objects') == objects.keys_for('objects')
+    copy.purge_doc('objects')
+    assert 'mod.Cls' not in copy
+    assert not [fn for (fn, _) in copy.itervalues() if fn == 'objects']
+    assert len(copy) == len(objects) - len(objects.keys_for('objects'))
+
+    images = pickle.loads(pickle.dumps(env.images, pickle.HIGHEST_PROTOCOL))
+    images.purge_doc('images')
+    images.purge_doc('subdir/images')
+    assert not [docs for (docs, _) in images.itervalues()
+                if 'images' in docs or 'subdir/images' in docs]
+    # unique names are free again
+    assert images.add_file('images', 'img.png') == 'img.png'
+
+def test_python_fuzzy_lookup():
+    objects = env.domaindata['py']['objects']
+    assert objects.find_suffix('Cls.meth1') == set(['mod.Cls.meth1'])
+    assert env.domains['py'].find_obj(env, None, None, 'meth1', 'meth', 1) \
+           == [('mod.Cls.meth1', ('objects', 'method'))]
+    copy = pickle.loads(pickle.dumps(objects, pickle.HIGHEST_PROTOCOL))
+    copy.purge_doc('objects')
+    assert not copy.find_suffix('Cls.meth1')
+    assert copy._suffixes == DottedNameDict(dict(copy))._suffixes
+
+def test_reference_graph():
+    builder = StandaloneHTMLBuilder(app)
+    env.get_and_resolve_doctree('contents', builder)
+    assert 'contents' in env.referrers['math']
+    assert 'math' in env.references['contents']
+    # a document whose targets changed makes its referrers outdated
+    env.changed_targets = set(['math'])
+    assert 'contents' in list(env.check_dependents(set()))
+    assert 'contents' not in list(env.check_dependents(set(['contents'])))
+    env.changed_targets = set()
+    # the signature covers the targets defined in a document
+    signature = env.get_target_signature('objects')
+    assert env.target_signatures['objects'] == signature
+    objects = env.domaindata['py']['objects']
+    saved = objects.pop('mod.Cls')
+    try:
+        assert env.get_target_signature('objects') != signature
+    finally:
+        objects['mod.Cls'] = saved
+    env.clear_references('contents')
+    assert 'contents' not in env.referrers.get('math', ())
+    # resolving again with the same outcome does not change the references
+    env._saved_references = {}
+    env.get_and_resolve_doctree('contents', builder)
+    assert env.references_changed()
+    env._saved_references = {}
+    env.get_and_resolve_doctree('contents', builder)
+    assert not env.references_changed()
+    env.clear_references('contents')
+    assert env.references_changed()
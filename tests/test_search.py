@@ -9,10 +9,15 @@
     :license: BSD, see LICENSE for details.
 """
 
+from StringIO import StringIO
+
 from docutils import frontend, utils
 from docutils.parsers import rst
 
-from sphinx.search import IndexBuilder
+from sphinx.search import IndexBuilder, js_index, term_shard, \
+     encode_postings, decode_postings, encode_names, decode_names, \
+     decode_numbers
+from sphinx.search.ja import TinySegmenter
 from sphinx.util.pycompat import b
 
 
@@ -31,12 +36,136 @@ FILE_CONTENTS = '''\
 test that non-comments are indexed: fermion
 '''
 
-def test_wordcollector():
-    doc = utils.new_document(b('test data'), settings)
-    doc['file'] = 'dummy'
-    parser.parse(FILE_CONTENTS, doc)
 
-    ix = IndexBuilder(None, 'en', {})
-    ix.feed('filename', 'title', doc)
+class DummyEnvironment(object):
+    domains = {}
+
+
+def make_index(texts, docnames=None, titles=None, **kwds):
+    """Return an English index of documents parsed from *texts*; *kwds* are
+    passed to the IndexBuilder.
+    """
+    if docnames is None:
+        docnames = ['doc%d' % i for i in range(len(texts))]
+    if titles is None:
+        titles = ['title %d' % i for i in range(len(texts))]
+    ix = IndexBuilder(DummyEnvironment(), 'en', {}, **kwds)
+    for docname, title, text in zip(docnames, titles, texts):
+        doc = utils.new_document(b('test data'), settings)
+        doc['file'] = 'dummy'
+        parser.parse(text, doc)
+        ix.feed(docname, title, doc)
+    return ix
+
+
+def test_wordcollector():
+    ix = make_index([FILE_CONTENTS])
     assert 'boson' not in ix._mapping
     assert 'fermion' in ix._mapping
+
+
+def test_sharded_index():
+    ix = make_index(['quarks and leptons', 'bosons and fermions',
+                     u'gluons \u65e5\u672c\u8a9e'])
+    frozen, shards = ix.freeze_sharded(3)
+    assert frozen['shards'] == 3
+    assert 'terms' not in frozen and 'objects' not in frozen
+    assert sorted(shards) == ['objects', 'terms0', 'terms1', 'terms2']
+    for i in range(3):
+        for term in shards['terms%d' % i]:
+            assert term_shard(term, 3) == i
+
+    # read it back in
+    data = dict((name, js_index.dumps_shard(name, shard))
+                for (name, shard) in shards.iteritems())
+    ix2 = IndexBuilder(DummyEnvironment(), 'en', {})
+    ix2.load(StringIO(js_index.dumps(frozen)), js_index,
+             lambda name: js_index.loads_shard(data[name]))
+    assert ix2._titles == ix._titles
+    assert ix2._mapping == ix._mapping
+
+
+def test_compact_index():
+    postings = [0, 1, 2, 40, 1000, 1001, 70000]
+    assert decode_postings(encode_postings(postings)) == postings
+    assert encode_postings([0, 1, 2]) == 'ABB'
+    names = ['api', 'api/builders', 'api/builders/html', 'changes', 'index']
+    assert decode_names(encode_names(names)) == names
+    assert encode_names(names)[:2] == ['Aapi', 'D/builders']
+
+    ix = make_index(['quarks and leptons', 'bosons and fermions',
+                     'leptons and bosons'],
+                    ['dir/doc0', 'dir/doc1', 'dir/doc2'],
+                    ['title 0', 'title 1', 'title 0'])
+    frozen = ix.freeze(compact=True)
+    assert frozen['titles'] == ['title 0', 'title 1']
+    assert frozen['terms']['lepton'] == 'AC'
+
+    # the sections are dumped like the whole index
+    data, sizes = js_index.dumps_sections(frozen)
+    assert data == js_index.dumps(frozen)
+    assert [key for (key, size) in sizes] == sorted(frozen)
+
+    # read it back in
+    ix2 = IndexBuilder(DummyEnvironment(), 'en', {})
+    ix2.load(StringIO(data), js_index)
+    assert ix2._titles == ix._titles
+    assert ix2._mapping == ix._mapping
+
+
+def test_snippets():
+    ix = make_index(['Quarks and *leptons*.\n\nThe end.',
+                     '.. comment\n\n' + 'Bosons   and\nfermions, ' * 3],
+                    snippet_length=30)
+    assert ix._snippets == {'doc0': 'Quarks and leptons. The end.',
+                            'doc1': 'Bosons and fermions, Bosons an'}
+    files = ix.freeze_snippets()
+    assert files == {'snippets0': ix._snippets}
+
+    # read them back in
+    frozen = ix.freeze()
+    frozen['snippets'] = 1
+    ix2 = IndexBuilder(DummyEnvironment(), 'en', {}, snippet_length=30)
+    ix2.load(StringIO(js_index.dumps(frozen)), js_index, files.get)
+    assert ix2._snippets == ix._snippets
+    ix2.prune(['doc1'])
+    assert ix2._snippets.keys() == ['doc1']
+
+
+def test_object_index():
+    ix = IndexBuilder(DummyEnvironment(), 'en', {})
+    objects = {'os.path': {'join': (0, 0, 1), 'abspath': (1, 0, 1)},
+               '': {'Os': (2, 1, 0), '__init__': (2, 2, 2)}}
+    index = ix.get_object_index(objects)
+    assert index['names'] == ['__init__', 'Os', 'os.path.abspath',
+                              'os.path.join']
+    assert index['data'] == [(2, 2, 2), (2, 1, 0), (1, 0, 1), (0, 0, 1)]
+    refs = decode_numbers(index['keys'])
+    keys = [index['names'][i][offset:].lower()
+            for (i, offset) in zip(refs[::2], refs[1::2])]
+    assert keys == ['abspath', 'init__', 'join', 'os', 'os.path.abspath',
+                    'os.path.join', 'path.abspath', 'path.join']
+    index = ix.get_object_index({'': {'HTMLBuilder': (0, 0, 1)}})
+    assert decode_numbers(index['keys']) == [0, 4, 0, 0]
+
+
+def test_tinysegmenter():
+    segmenter = TinySegmenter()
+    assert segmenter.split(u'') == []
+    assert segmenter.split(u'私の名前は中野です') == \
+           [u'私', u'の', u'名前', u'は',
+            u'中野', u'です']
+    assert segmenter.split(
+        u'日本語の文章を単語に分割します。') == \
+           [u'日本語', u'の', u'文章', u'を',
+            u'単語', u'に', u'分割', u'し',
+            u'ます', u'。']
+    assert segmenter.split(
+        u'Sphinxは「ドキュメント」を作ります') == \
+           [u'Sphinx', u'は', u'「',
+            u'ドキュメント', u'」', u'を',
+            u'作り', u'ます']
+    # numerals have the type of numerals, not of other kanji
+    assert segmenter.ctype_(u'三') == u'M'
+    assert segmenter.ctype_(u'龠') == u'H'
+    assert segmenter.ctype_(u'?') == u'O'
@@ -15,6 +15,7 @@ import zipfile
 from util import *
 
 from sphinx.theming import Theme, ThemeError
+from sphinx.jinja2glue import BuiltinTemplateLoader
 
 
 @with_app(confoverrides={'html_theme': 'ziptheme',
@@ -55,3 +56,20 @@ def test_theme_api(app):
     # cleanup temp directories
     theme.cleanup()
     assert not os.path.exists(themedir)
+
+
+@with_app()
+def test_template_bytecode_cache(app):
+    templates = app.builder.templates
+    templates.bytecode_cache.clear()
+    templates.environment.cache.clear()
+    templates.environment.get_template('page.html')
+    assert templates.bytecode_cache.hits == 0
+    assert templates.bytecode_cache.misses > 0
+
+    # a new template environment finds the compiled templates on disk
+    loader = BuiltinTemplateLoader()
+    loader.init(app.builder, app.builder.theme)
+    loader.environment.get_template('page.html')
+    assert loader.bytecode_cache.hits == templates.bytecode_cache.misses
+    assert loader.bytecode_cache.misses == 0
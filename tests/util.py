@@ -126,7 +126,7 @@ class TestApp(application.Sphinx):
                  buildername='html', confoverrides=None,
                  status=None, warning=None, freshenv=None,
                  warningiserror=None, tags=None,
-                 confname='conf.py', cleanenv=False):
+                 confname='conf.py', cleanenv=False, parallel=0):
 
         application.CONFIG_FILENAME = confname
 
@@ -167,7 +167,7 @@ class TestApp(application.Sphinx):
 
         application.Sphinx.__init__(self, srcdir, confdir, outdir, doctreedir,
                                     buildername, confoverrides, status, warning,
-                                    freshenv, warningiserror, tags)
+                                    freshenv, warningiserror, tags, parallel)
 
     def cleanup(self, doctrees=False):
         AutoDirective._registry.clear()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Benchmark for the Japanese word splitter
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Measure the throughput of the TinySegmenter used for the Japanese search
+    index, in characters per second.  The corpus is read from the files given
+    on the command line (UTF-8 encoded), or taken from the messages of the
+    Japanese translation of Sphinx.
+
+    With ``--reference``, the original implementation, which matches regular
+    expressions to find character types and looks up every feature with a
+    method call, is timed as well for comparison.
+
+    :copyright: Copyright 2007-2011 by the Sphinx team, see AUTHORS.
+    :license: BSD, see LICENSE for details.
+"""
+
+import re
+import sys
+import time
+import codecs
+from optparse import OptionParser
+from os.path import join, dirname, abspath
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from sphinx.search.ja import TinySegmenter
+
+
+class ReferenceSegmenter(TinySegmenter):
+    """The segmenter as it was before it was made table-driven; it uses the
+    same weights as :class:`TinySegmenter`.
+    """
+
+    patterns_ = dict([(re.compile(pattern), value) for pattern, value in {
+        u'[一二三四五六七八九十百千万億兆]': u'M',
+        u'[一-龠々〆ヵヶ]': u'H',
+        u'[ぁ-ん]': u'I',
+        u'[ァ-ヴーｱ-ﾝﾞｰ]': u'K',
+        u'[a-zA-Zａ-ｚＡ-Ｚ]': u'A',
+        u'[0-9０-９]': u'N',
+    }.iteritems()])
+
+    def ctype_(self, char):
+        for pattern, value in self.patterns_.iteritems():
+            if pattern.match(char):
+                return value
+        return u'O'
+
+    def ts_(self, dict, key):
+        if key in dict:
+            return dict[key]
+        return 0
+
+    def split(self, input):
+        if not input:
+            return []
+
+        result = []
+        seg = [u'B3',u'B2',u'B1']
+        ctype = [u'O',u'O',u'O']
+        for t in input:
+            seg.append(t)
+            ctype.append(self.ctype_(t))
+        seg.append(u'E1')
+        seg.append(u'E2')
+        seg.append(u'E3')
+        ctype.append(u'O')
+        ctype.append(u'O')
+        ctype.append(u'O')
+        word = seg[3]
+        p1 = u'U'
+        p2 = u'U'
+        p3 = u'U'
+
+        for i in range(4, len(seg) - 3):
+            score = self.BIAS__
+            w1 = seg[i-3]
+            w2 = seg[i-2]
+            w3 = seg[i-1]
+            w4 = seg[i]
+            w5 = seg[i+1]
+            w6 = seg[i+2]
+            c1 = ctype[i-3]
+            c2 = ctype[i-2]
+            c3 = ctype[i-1]
+            c4 = ctype[i]
+            c5 = ctype[i+1]
+            c6 = ctype[i+2]
+            score += self.ts_(self.UP1__, p1)
+            score += self.ts_(self.UP2__, p2)
+            score += self.ts_(self.UP3__, p3)
+            score += self.ts_(self.BP1__, p1 + p2)
+            score += self.ts_(self.BP2__, p2 + p3)
+            score += self.ts_(self.UW1__, w1)
+            score += self.ts_(self.UW2__, w2)
+            score += self.ts_(self.UW3__, w3)
+            score += self.ts_(self.UW4__, w4)
+            score += self.ts_(self.UW5__, w5)
+            score += self.ts_(self.UW6__, w6)
+            score += self.ts_(self.BW1__, w2 + w3)
+            score += self.ts_(self.BW2__, w3 + w4)
+            score += self.ts_(self.BW3__, w4 + w5)
+            score += self.ts_(self.TW1__, w1 + w2 + w3)
+            score += self.ts_(self.TW2__, w2 + w3 + w4)
+            score += self.ts_(self.TW3__, w3 + w4 + w5)
+            score += self.ts_(self.TW4__, w4 + w5 + w6)
+            score += self.ts_(self.UC1__, c1)
+            score += self.ts_(self.UC2__, c2)
+            score += self.ts_(self.UC3__, c3)
+            score += self.ts_(self.UC4__, c4)
+            score += self.ts_(self.UC5__, c5)
+            score += self.ts_(self.UC6__, c6)
+            score += self.ts_(self.BC1__, c2 + c3)
+            score += self.ts_(self.BC2__, c3 + c4)
+            score += self.ts_(self.BC3__, c4 + c5)
+            score += self.ts_(self.TC1__, c1 + c2 + c3)
+            score += self.ts_(self.TC2__, c2 + c3 + c4)
+            score += self.ts_(self.TC3__, c3 + c4 + c5)
+            score += self.ts_(self.TC4__, c4 + c5 + c6)
+            score += self.ts_(self.UQ1__, p1 + c1)
+            score += self.ts_(self.UQ2__, p2 + c2)
+            score += self.ts_(self.UQ1__, p3 + c3)
+            score += self.ts_(self.BQ1__, p2 + c2 + c3)
+            score += self.ts_(self.BQ2__, p2 + c3 + c4)
+            score += self.ts_(self.BQ3__, p3 + c2 + c3)
+            score += self.ts_(self.BQ4__, p3 + c3 + c4)
+            score += self.ts_(self.TQ1__, p2 + c1 + c2 + c3)
+            score += self.ts_(self.TQ2__, p2 + c2 + c3 + c4)
+            score += self.ts_(self.TQ3__, p3 + c1 + c2 + c3)
+            score += self.ts_(self.TQ4__, p3 + c2 + c3 + c4)
+            p = u'O'
+            if score > 0:
+                result.append(word)
+                word = u''
+                p = u'B'
+            p1 = p2
+            p2 = p3
+            p3 = p
+            word += seg[i]
+
+        result.append(word)
+        return result
+
+
+def default_corpus():
+    fn = join(dirname(dirname(abspath(__file__))),
+              'sphinx', 'locale', 'ja', 'LC_MESSAGES', 'sphinx.po')
+    messages = []
+    current = None
+    f = codecs.open(fn, 'r', encoding='utf-8')
+    try:
+        for line in f:
+            line = line.strip()
+            if line.startswith('msgstr "'):
+                current = [line[8:-1]]
+                messages.append(current)
+            elif line.startswith('"') and current is not None:
+                current.append(line[1:-1])
+            else:
+                current = None
+    finally:
+        f.close()
+    messages = [''.join(parts).replace('\\n', ' ').replace('\\"', '"')
+                for parts in messages]
+    return [msg for msg in messages if msg]
+
+
+def read_corpus(filenames):
+    lines = []
+    for fn in filenames:
+        f = codecs.open(fn, 'r', encoding='utf-8')
+        try:
+            lines.extend(line.strip() for line in f)
+        finally:
+            f.close()
+    return [line for line in lines if line]
+
+
+def run(segmenter, corpus, repeat):
+    """Split *corpus* *repeat* times and return the fastest time and the
+    number of words.
+    """
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        nwords = 0
+        for line in corpus:
+            nwords += len(segmenter.split(line))
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, nwords
+
+
+def main(argv):
+    parser = OptionParser(usage='%prog [-n repeat] [-r] [file ...]')
+    parser.add_option('-n', '--repeat', dest='repeat', type='int', default=5,
+                      help='number of runs; the fastest one is reported')
+    parser.add_option('-m', '--multiply', dest='multiply', type='int',
+                      default=20, help='number of copies of the corpus to '
+                      'split in each run')
+    parser.add_option('-r', '--reference', dest='reference',
+                      action='store_true', default=False,
+                      help='time the original implementation as well')
+    options, args = parser.parse_args(argv[1:])
+    if args:
+        corpus = read_corpus(args)
+    else:
+        corpus = default_corpus()
+    corpus = corpus * options.multiply
+    nchars = sum(len(line) for line in corpus)
+
+    segmenters = [('current', TinySegmenter())]
+    if options.reference:
+        segmenters.append(('reference', ReferenceSegmenter()))
+    print '%d lines, %d characters' % (len(corpus), nchars)
+    for name, segmenter in segmenters:
+        best, nwords = run(segmenter, corpus, options.repeat)
+        print '%-10s %d words, best of %d: %.3fs, %.0f characters per ' \
+              'second' % (name + ':', nwords, options.repeat, best,
+                          nchars / best)
+
+
+if __name__ == '__main__':
+    main(sys.argv)